@@ -1,4 +1,3 @@
-import logging
 from flask import Flask
 from app.config import Config
 
@@ -9,13 +8,18 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    )
+    from app import logs
+
+    logs.setup()
 
     from app.webhook import webhook_bp
+    from app.payments import payments_bp
 
     app.register_blueprint(webhook_bp)
+    app.register_blueprint(payments_bp)
+
+    from app.cli import register_commands
+
+    register_commands(app)
 
     return app
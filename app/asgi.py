@@ -0,0 +1,438 @@
+"""
+ASGI entry point serving the same /health and /webhook routes as the
+Flask app, with non-blocking Graph API and Supabase calls.
+
+Only CPU-bound work (process_product_photo) is handed to an executor,
+so a single worker can hold many messages that are waiting on
+graph.facebook.com or Supabase at once. Onboarding and history are
+short, rare flows and reuse the sync implementations on the default
+thread pool rather than duplicating them.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from urllib.parse import parse_qs
+from app.config import Config
+from app import async_database as adb
+from app import async_messenger as amessenger
+from app import audit_log
+from app import billing
+from app import brand_kit
+from app import commands
+from app import history
+from app import logs
+from app import metrics
+from app import onboarding
+from app import payments
+from app import prefetch
+from app import rate_limit
+from app import render_queue
+from app import signatures
+from app import subscriptions
+from app import template_registry
+from app import warmup
+from app.rate_limit import PRIORITY_NOTICE
+from app.webhook import (
+    HELP_MESSAGE,
+    PROCESSING_FAILED_MESSAGE,
+    PROCESSING_MESSAGE,
+    SUPPORTED_TYPES,
+    UNKNOWN_COMMAND_MESSAGE,
+    UNSUPPORTED_TYPE_MESSAGE,
+    image_metadata,
+    parse_message,
+)
+
+logger = logging.getLogger(__name__)
+
+_cpu_executor: Executor = None
+_render_scheduler: render_queue.FairScheduler = None
+
+
+def get_cpu_executor() -> Executor:
+    """Lazy pool for CPU-bound rendering (thread or process, per config)."""
+    global _cpu_executor
+    if _cpu_executor is None:
+        if Config.ASYNC_CPU_EXECUTOR == "process":
+            # Render processes watch the templates themselves
+            _cpu_executor = ProcessPoolExecutor(
+                max_workers=Config.ASYNC_CPU_WORKERS, initializer=template_registry.start
+            )
+        else:
+            _cpu_executor = ThreadPoolExecutor(
+                max_workers=Config.ASYNC_CPU_WORKERS, thread_name_prefix="render"
+            )
+    return _cpu_executor
+
+
+def get_render_scheduler() -> render_queue.FairScheduler:
+    """Fair queue in front of the CPU executor, one slot per CPU worker."""
+    global _render_scheduler
+    if _render_scheduler is None:
+        _render_scheduler = render_queue.FairScheduler(
+            Config.ASYNC_CPU_WORKERS, Config.RENDER_MAX_PER_USER, executor=get_cpu_executor()
+        )
+    return _render_scheduler
+
+
+def create_asgi_app():
+    """Build the ASGI callable. Mirrors app.create_app for the async server."""
+    Config.validate()
+
+    async def asgi_app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await _lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"]
+        method = scope["method"]
+
+        if path == "/health" and method == "GET":
+            await _respond(send, 200, b"ok", "text/plain")
+        elif path == "/ready" and method == "GET":
+            body, is_ready = await asyncio.get_running_loop().run_in_executor(
+                None, warmup.readiness
+            )
+            await _respond(
+                send, 200 if is_ready else 503, json.dumps(body).encode(), "application/json"
+            )
+        elif path == "/metrics" and method == "GET":
+            if metrics.enabled():
+                body = metrics.render_prometheus().encode()
+                await _respond(send, 200, body, "text/plain; version=0.0.4")
+            else:
+                await _respond(send, 404, b"metrics disabled", "text/plain")
+        elif path == "/webhook" and method == "GET":
+            await _verify(scope, send)
+        elif path == "/webhook" and method == "POST":
+            body = await _read_body(receive)
+            if not signatures.check_webhook(body, _header(scope, signatures.WHATSAPP_HEADER)):
+                await _respond(send, 401, b'{"error":"invalid signature"}', "application/json")
+                return
+            with logs.correlate():
+                await handle_message(body)
+            await _respond(send, 200, b'{"status":"ok"}', "application/json")
+        elif path == "/payments/callback" and method == "POST":
+            body = await _read_body(receive)
+            status, result = await asyncio.get_running_loop().run_in_executor(
+                None, payments.accept, body, _header(scope, payments.SIGNATURE_HEADER)
+            )
+            await _respond(send, status, json.dumps(result).encode(), "application/json")
+        elif path in ("/health", "/ready", "/metrics", "/webhook", "/payments/callback"):
+            await _respond(send, 405, b"Method Not Allowed", "text/plain")
+        else:
+            await _respond(send, 404, b"Not Found", "text/plain")
+
+    return asgi_app
+
+
+async def _lifespan(receive, send) -> None:
+    """Handle ASGI startup/shutdown: release pools on exit."""
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            await _warm_up()
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            await amessenger.aclose()
+            if _cpu_executor is not None:
+                _cpu_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _warm_up() -> None:
+    """
+    Create the async clients and run the sync warm-up steps before uvicorn
+    starts accepting connections. The sync Supabase clients are still
+    warmed because onboarding runs through the sync modules.
+    """
+    try:
+        await adb.get_client()
+        await adb.get_service_client()
+        amessenger.get_http_client()
+    except Exception as e:
+        logger.error(f"Async client warm-up failed: {e}", exc_info=True)
+    await asyncio.get_running_loop().run_in_executor(None, warmup.run)
+    subscriptions.start()
+    payments.start()
+    rate_limit.start()
+    audit_log.start()
+    template_registry.start()
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    more = True
+    while more:
+        event = await receive()
+        chunks.append(event.get("body", b""))
+        more = event.get("more_body", False)
+    return b"".join(chunks)
+
+
+def _header(scope, name: str) -> str | None:
+    wanted = name.lower().encode()
+    for key, value in scope.get("headers", []):
+        if key.lower() == wanted:
+            return value.decode("latin-1")
+    return None
+
+
+async def _respond(send, status: int, body: bytes, content_type: str) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _verify(scope, send) -> None:
+    """WhatsApp webhook verification (called once during Meta setup)."""
+    args = parse_qs(scope.get("query_string", b"").decode())
+    mode = args.get("hub.mode", [None])[0]
+    token = args.get("hub.verify_token", [None])[0]
+    challenge = args.get("hub.challenge", [""])[0]
+
+    if mode == "subscribe" and token == Config.WHATSAPP_VERIFY_TOKEN:
+        logger.info("Webhook verified successfully")
+        await _respond(send, 200, challenge.encode(), "text/plain")
+        return
+
+    logger.warning(f"Webhook verification failed. mode={mode}")
+    await _respond(send, 403, b"Forbidden", "text/plain")
+
+
+async def handle_message(raw_body: bytes) -> None:
+    """Async counterpart of webhook.handle_message. Never raises."""
+    started = time.perf_counter()
+    message_type = "none"
+    media = None
+    try:
+        body = json.loads(raw_body) if raw_body else None
+        parsed = parse_message(body)
+        if not parsed:
+            return
+
+        phone = parsed["phone"]
+        message_type = parsed["message_type"]
+        # The download only needs the media id; run it alongside routing
+        media = prefetch.start_async(parsed["media_id"], amessenger.download_media)
+        await amessenger.mark_as_read(parsed["message_id"])
+
+        if message_type not in SUPPORTED_TYPES:
+            await amessenger.send_text(phone, UNSUPPORTED_TYPE_MESSAGE)
+            return
+
+        await _route_message(
+            phone,
+            parsed["message_type"],
+            parsed["message_body"],
+            parsed["media_id"],
+            parsed["caption"],
+            media,
+        )
+
+    except Exception as e:
+        metrics.inc("pichasafi_webhook_errors_total")
+        logger.error(f"Webhook processing error: {e}", exc_info=True)
+
+    finally:
+        if media is not None:
+            media.cancel()  # no-op if the render used it
+        metrics.observe(
+            "pichasafi_webhook_seconds", time.perf_counter() - started, type=message_type
+        )
+        metrics.inc("pichasafi_messages_total", type=message_type)
+        metrics.flush()
+
+
+async def _route_message(
+    phone: str,
+    message_type: str,
+    message_body: str,
+    media_id: str,
+    caption: str,
+    media: prefetch.AsyncMediaPrefetch = None,
+) -> None:
+    """Same routing rules as webhook._route_message."""
+    user = await adb.get_user_by_phone(phone)
+    if not user:
+        user = await adb.create_user(phone)
+        logger.info(f"New user created: {phone}")
+
+    if user["onboarding_step"] != "complete":
+        if media is not None:
+            media.cancel()
+        await asyncio.to_thread(
+            onboarding.handle_onboarding, phone, user, message_type, message_body, media_id
+        )
+        return
+
+    if message_type == "interactive" and history.is_history_reply(message_body):
+        await asyncio.to_thread(history.handle_reply, phone, user, message_body)
+        return
+
+    if message_type == "text" and message_body:
+        command = message_body.strip().lower()
+
+        if command == "help":
+            await amessenger.send_text(phone, HELP_MESSAGE)
+            return
+        if command == "status":
+            await amessenger.send_text(
+                phone, billing.format_usage_message(billing.usage_from_user(user))
+            )
+            return
+        if command == "history":
+            await asyncio.to_thread(history.send_history, phone, user)
+            return
+        if command in ("edit", "edit brand", "edit profile"):
+            await adb.update_user(phone, {"onboarding_step": "new"})
+            await asyncio.to_thread(
+                onboarding.handle_onboarding,
+                phone, {**user, "onboarding_step": "new"}, message_type, message_body,
+            )
+            return
+
+        await amessenger.send_text(
+            phone, UNKNOWN_COMMAND_MESSAGE.format(message_body=message_body)
+        )
+        return
+
+    if message_type == "image" and media_id:
+        await _handle_product_image(phone, user, media_id, caption, media)
+        return
+
+
+async def _timed(stage_name: str, awaitable):
+    """Await under metrics.stage(stage_name); lets gathered calls be timed individually."""
+    with metrics.stage(stage_name):
+        return await awaitable
+
+
+async def _handle_product_image(
+    phone: str, user: dict, media_id: str, caption: str, media: prefetch.AsyncMediaPrefetch = None
+) -> None:
+    """Download (or collect the prefetch), process (off-loop), and send back an enhanced product photo."""
+    usage = billing.usage_from_user(user)
+    if not usage["allowed"]:
+        if media is not None:
+            media.cancel()
+        await amessenger.send_text(phone, billing.get_limit_reached_message())
+        return
+
+    # The notice and the download are independent round trips
+    notice = asyncio.ensure_future(
+        amessenger.send_text(phone, PROCESSING_MESSAGE, priority=PRIORITY_NOTICE)
+    )
+
+    from app import image_guard
+
+    trace = metrics.begin_trace()
+    try:
+        with metrics.stage("download_media"):
+            # With a prefetch this is only the part routing didn't overlap
+            if media is not None:
+                image_bytes = await media.result()
+            else:
+                image_bytes = await amessenger.download_media(media_id)
+
+        # Header only: reject or plan a downscale before any pixels are decoded
+        with metrics.stage("inspect_image"):
+            checked = image_guard.inspect(image_bytes)
+
+        from app.image_processor import process_product_photo
+
+        options = commands.parse_caption(caption)
+        render = process_product_photo
+        if Config.ASYNC_CPU_EXECUTOR != "process":
+            # Carry the trace into the render thread so its stages are recorded
+            render = partial(contextvars.copy_context().run, process_product_photo)
+        # Merchants take turns on the CPU workers, weighted by tier
+        render_started = time.perf_counter()
+        result_bytes = await asyncio.wrap_future(get_render_scheduler().submit(
+            phone,
+            user.get("subscription_tier") or "free",
+            render,
+            image_bytes,
+            user.get("brand_color_bg") or "#1A1A2E",
+            options,
+            brand_kit.for_user(user),
+        ))
+        render_seconds = time.perf_counter() - render_started
+
+        ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        # Concurrent, but timed separately under the same stage names as
+        # the sync pipeline
+        original_url, result_url = await asyncio.gather(
+            _timed("upload_original", adb.upload_to_storage(
+                f"originals/{phone}/{ts}.jpg", image_bytes, wait=False
+            )),
+            _timed("upload_result", adb.upload_to_storage(
+                f"generated/{phone}/{ts}.jpg", result_bytes
+            )),
+        )
+
+        # Journaled locally and inserted in batches off the reply path
+        with metrics.stage("save_generated_image"):
+            audit_log.record_generated_image(
+                user_id=user["id"],
+                image_type="poster" if options["template"] else "product_enhance",
+                original_url=original_url,
+                result_url=result_url,
+                template_used=options["template"],
+                metadata=image_metadata(
+                    caption, image_bytes, result_bytes, render_seconds, checked["downscale"]
+                ),
+            )
+
+        updated = await adb.increment_image_count(phone)
+        usage = billing.usage_from_user(updated or user)
+
+        await notice
+        note = f"\n{image_guard.IMAGE_DOWNSCALED_NOTE}" if checked["downscale"] else ""
+        with metrics.stage("send_image"):
+            await amessenger.send_image(
+                phone,
+                result_url,
+                caption=(
+                    f"Here's your enhanced product photo!\n"
+                    f"Images remaining: {usage['remaining']}/{usage['limit']}{note}"
+                ),
+            )
+        metrics.inc("pichasafi_images_processed_total")
+        if trace is not None:
+            timings = metrics.format_trace(metrics.end_trace(trace))
+            trace = None
+            logger.info(f"Image pipeline for {phone}: {timings}")
+
+    except image_guard.ImageTooLarge:
+        await asyncio.gather(notice, return_exceptions=True)
+        metrics.end_trace(trace)
+        await amessenger.send_text(phone, image_guard.IMAGE_TOO_LARGE_MESSAGE)
+
+    except Exception as e:
+        # Settle the notice so it can't arrive after the failure message
+        await asyncio.gather(notice, return_exceptions=True)
+        metrics.inc("pichasafi_images_failed_total")
+        timings = metrics.format_trace(metrics.end_trace(trace))
+        logger.error(
+            f"Image processing failed for {phone}: {e} {timings}", exc_info=True
+        )
+        await amessenger.send_text(phone, PROCESSING_FAILED_MESSAGE)
@@ -0,0 +1,166 @@
+"""
+Fonts, template config and static render layers, loaded once per process
+and shared by renders. Templates themselves are compiled and hot-reloaded
+by app/template_registry.py.
+
+When preload_shared() runs in the gunicorn master (see gunicorn.conf.py)
+everything here is created before fork and stays shared copy-on-write
+across workers:
+  - model files are mmapped read-only, so their pages live once in the
+    page cache no matter how many processes map them;
+  - fonts are opened by path, which lets FreeType map the file itself;
+    the faces are built in the master and only ever read by workers;
+  - gradient layers are kept as immutable raw bytes; each render gets a
+    fresh Image built from them, so workers only ever read those pages.
+gc.freeze() afterwards keeps the worker's collector from dirtying the
+pages that hold these objects.
+"""
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from app.config import Config
+from app import brand_kit
+from app import template_registry
+
+logger = logging.getLogger(__name__)
+
+FONT_FILES = {
+    "regular": "Poppins-Regular.ttf",
+    "semibold": "Poppins-SemiBold.ttf",
+    "bold": "Poppins-Bold.ttf",
+}
+
+_lock = threading.RLock()
+_fonts: dict = {}
+_mapped: dict[str, mmap.mmap] = {}
+# (size, color_top, color_bottom, template version) -> raw RGB bytes;
+# preloaded keys are pinned
+_layers: "OrderedDict[tuple, bytes]" = OrderedDict()
+_pinned_layers: set = set()
+
+
+def load_template_config() -> dict:
+    """Template specs of the live template version, by name."""
+    return template_registry.current().specs()
+
+
+def map_file(path: str) -> mmap.mmap:
+    """Read-only shared mapping of a file (e.g. model weights), cached by path."""
+    mapped = _mapped.get(path)
+    if mapped is None:
+        with _lock:
+            mapped = _mapped.get(path)
+            if mapped is None:
+                with open(path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                _mapped[path] = mapped
+    return mapped
+
+
+def get_font(weight: str = "regular", size: int = 16):
+    """Cached Poppins ImageFont for a weight ('regular', 'semibold', 'bold')."""
+    key = (weight, size)
+    font = _fonts.get(key)
+    if font is None:
+        from PIL import ImageFont
+
+        path = os.path.join(Config.FONTS_DIR, FONT_FILES.get(weight, FONT_FILES["regular"]))
+        font = ImageFont.truetype(path, size)
+        with _lock:
+            _fonts.setdefault(key, font)
+    return _fonts[key]
+
+
+def preload_fonts() -> int:
+    """Load every font size the templates use (compiling loads them). Returns the count."""
+    return sum(len(template.fonts) for template in template_registry.current().templates.values())
+
+
+def get_gradient_layer(size: tuple, color_top, color_bottom, version: str = None):
+    """
+    Gradient background for (size, colors as hex or RGB tuples), built from cached bytes the
+    caller can't modify. Preloaded layers are shared with the master;
+    others are rendered on demand and kept in a small per-worker LRU
+    (GRADIENT_CACHE_SIZE). Keyed by template version (default: the live
+    one) so a template swap never reuses a layer built for the old set.
+    """
+    from PIL import Image
+
+    version = version or template_registry.version()
+    key = (tuple(size), _hex(color_top), _hex(color_bottom), version)
+    data = _layers.get(key)
+    if data is None:
+        from app.image_processor import create_gradient_background
+
+        data = create_gradient_background(size, color_top, color_bottom).tobytes()
+        with _lock:
+            _layers[key] = data
+            _evict_layers()
+    elif key not in _pinned_layers:
+        with _lock:
+            if key in _layers:
+                _layers.move_to_end(key)
+    return Image.frombuffer("RGB", key[0], data, "raw", "RGB", 0, 1)
+
+
+def _hex(color) -> str:
+    return color.upper() if isinstance(color, str) else brand_kit.rgb_to_hex(color)
+
+
+def _evict_layers() -> None:
+    unpinned = [k for k in _layers if k not in _pinned_layers]
+    for key in unpinned[: max(0, len(unpinned) - Config.GRADIENT_CACHE_SIZE)]:
+        del _layers[key]
+
+
+def preload_gradients() -> int:
+    """Render and pin the PRELOAD_GRADIENTS brand backgrounds."""
+    from app.image_processor import OUTPUT_SIZE
+
+    version = template_registry.version()
+    count = 0
+    for color in Config.PRELOAD_GRADIENTS:
+        top, bottom = brand_kit.for_color(color)["gradient"]
+        layer_key = (OUTPUT_SIZE, _hex(top), _hex(bottom), version)
+        get_gradient_layer(*layer_key)
+        _pinned_layers.add(layer_key)
+        count += 1
+    return count
+
+
+def _drop_stale_layers(snapshot) -> None:
+    """After a template swap: forget layers of older versions, re-pin the preloads."""
+    with _lock:
+        for key in [k for k in _layers if k[-1] != snapshot.version]:
+            del _layers[key]
+        _pinned_layers.difference_update([k for k in _pinned_layers if k[-1] != snapshot.version])
+    preload_gradients()
+
+
+template_registry.on_reload(_drop_stale_layers)
+
+
+def preload_model_files() -> int:
+    """Map SHARED_MODEL_FILES (e.g. U2Net weights) so workers share the pages."""
+    count = 0
+    for path in Config.SHARED_MODEL_FILES:
+        if os.path.exists(path):
+            map_file(path)
+            count += 1
+        else:
+            logger.warning(f"Shared model file not found: {path}")
+    return count
+
+
+def preload_shared() -> dict:
+    """Load every immutable asset; call in the master before fork."""
+    return {
+        "templates": len(template_registry.current().templates),
+        "fonts": preload_fonts(),
+        "gradients": preload_gradients(),
+        "model_files": preload_model_files(),
+    }
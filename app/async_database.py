@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from functools import partial
+from typing import TYPE_CHECKING
+from app.config import Config
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
+
+logger = logging.getLogger(__name__)
+
+_client: "AsyncClient" = None
+_service_client: "AsyncClient" = None
+_lock = asyncio.Lock()
+
+
+async def get_client() -> "AsyncClient":
+    """Lazy singleton async Supabase client (anon key — respects RLS)."""
+    global _client
+    if _client is None:
+        from supabase import acreate_client
+
+        async with _lock:
+            if _client is None:
+                logger.info("Connecting to Supabase (async)")
+                _client = await acreate_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+    return _client
+
+
+async def get_service_client() -> "AsyncClient":
+    """Lazy singleton async Supabase client (service role key — bypasses RLS)."""
+    global _service_client
+    if _service_client is None:
+        from supabase import acreate_client
+
+        async with _lock:
+            if _service_client is None:
+                logger.info("Connecting to Supabase with service role key (async)")
+                _service_client = await acreate_client(
+                    Config.SUPABASE_URL, Config.SUPABASE_SERVICE_KEY
+                )
+    return _service_client
+
+
+# --- User Operations ---
+
+
+async def get_user_by_phone(phone_number: str) -> dict | None:
+    """Fetch user by WhatsApp phone number. Returns None if not found."""
+    client = await get_client()
+    response = (
+        await client.table("users")
+        .select("*")
+        .eq("phone_number", phone_number)
+        .execute()
+    )
+    if response.data:
+        return response.data[0]
+    return None
+
+
+async def create_user(phone_number: str) -> dict:
+    """Create a new user with onboarding_step='new'."""
+    client = await get_client()
+    response = (
+        await client.table("users")
+        .insert({"phone_number": phone_number, "onboarding_step": "new"})
+        .execute()
+    )
+    return response.data[0]
+
+
+async def update_user(phone_number: str, updates: dict) -> dict | None:
+    """Update user fields by phone number."""
+    client = await get_client()
+    response = (
+        await client.table("users")
+        .update(updates)
+        .eq("phone_number", phone_number)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+async def increment_image_count(phone_number: str, attempts: int = 5) -> dict | None:
+    """
+    Increment the monthly image counter atomically. Concurrent images for
+    one user each re-read the row and only update if the counter hasn't
+    moved since (compare-and-set), retrying otherwise, so none are lost.
+    """
+    client = await get_client()
+    for _ in range(attempts):
+        user = await get_user_by_phone(phone_number)
+        if not user:
+            return None
+        current = user["images_created_this_month"]
+        response = (
+            await client.table("users")
+            .update({"images_created_this_month": current + 1})
+            .eq("phone_number", phone_number)
+            .eq("images_created_this_month", current)
+            .execute()
+        )
+        if response.data:
+            return response.data[0]
+    logger.warning(f"Image count for {phone_number} kept changing; giving up after {attempts} tries")
+    return None
+
+
+# --- Generated Image Operations ---
+
+
+async def save_generated_image(
+    user_id: str,
+    image_type: str,
+    original_url: str,
+    result_url: str,
+    template_used: str = None,
+    metadata: dict = None,
+) -> dict:
+    """Record a generated image in the database."""
+    client = await get_client()
+    response = (
+        await client.table("generated_images")
+        .insert(
+            {
+                "user_id": user_id,
+                "image_type": image_type,
+                "template_used": template_used,
+                "original_image_url": original_url,
+                "result_image_url": result_url,
+                "metadata": metadata or {},
+            }
+        )
+        .execute()
+    )
+    return response.data[0]
+
+
+# --- Storage Operations ---
+
+
+async def upload_to_storage(
+    bucket_path: str, file_bytes: bytes, content_type: str = "image/jpeg", wait: bool = True
+) -> str:
+    """Store bytes via the tiered storage layer (off-loop). Returns the public URL."""
+    from app import storage
+
+    return await asyncio.get_running_loop().run_in_executor(
+        None, partial(storage.get_storage().put, bucket_path, file_bytes, content_type, wait=wait)
+    )
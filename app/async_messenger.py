@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import httpx
+from app.config import Config
+from app import rate_limit
+from app.messenger import _get_headers
+from app.rate_limit import PRIORITY_NOTICE, PRIORITY_REPLY, PRIORITY_RESULT
+
+logger = logging.getLogger(__name__)
+
+_client: httpx.AsyncClient = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Lazy singleton async HTTP client with a pooled keep-alive connection set."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30, connect=10),
+            limits=httpx.Limits(
+                max_connections=Config.ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.ASYNC_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    """Close the shared HTTP client (called on ASGI shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _send(payload: dict, priority: int = PRIORITY_REPLY) -> dict:
+    """Send a message via WhatsApp Cloud API without blocking the event loop (see messenger._send)."""
+    limiter = rate_limit.get_limiter() if rate_limit.enabled() else None
+    retry = priority < PRIORITY_NOTICE
+    if limiter and not await limiter.acquire_async(priority, timeout=rate_limit.wait_for(priority)):
+        logger.warning("WhatsApp send throttled locally" + ("; queued for retry" if retry else ""))
+        if retry:
+            await asyncio.to_thread(limiter.enqueue, payload, priority)
+        return {"error": "rate limited", "queued": retry}
+
+    try:
+        response = await get_http_client().post(
+            Config.WHATSAPP_API_URL,
+            headers=_get_headers(),
+            json=payload,
+        )
+        if limiter:
+            await asyncio.to_thread(limiter.record, response.status_code)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.error(f"WhatsApp API error: {e}")
+        status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+        queued = bool(limiter and retry and rate_limit.is_retryable(status))
+        if queued:
+            await asyncio.to_thread(limiter.enqueue, payload, priority, attempts=1)
+        return {"error": str(e), "status": status, "queued": queued}
+
+
+async def send_text(to: str, message: str, priority: int = PRIORITY_REPLY) -> dict:
+    """Send a plain text message (priority PRIORITY_NOTICE for progress notices)."""
+    return await _send(
+        {
+            "messaging_product": "whatsapp",
+            "to": to,
+            "type": "text",
+            "text": {"body": message},
+        },
+        priority,
+    )
+
+
+async def send_image(to: str, image_url: str, caption: str = "") -> dict:
+    """Send an image by public URL with optional caption."""
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "image",
+        "image": {"link": image_url},
+    }
+    if caption:
+        payload["image"]["caption"] = caption
+    return await _send(payload, PRIORITY_RESULT)
+
+
+async def mark_as_read(message_id: str) -> dict:
+    """Mark an incoming message as read (blue ticks)."""
+    return await _send(
+        {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id,
+        },
+        PRIORITY_NOTICE,
+    )
+
+
+async def download_media(media_id: str) -> bytes:
+    """Async version of messenger.download_media (same two-step lookup)."""
+    client = get_http_client()
+    auth_headers = {"Authorization": f"Bearer {Config.WHATSAPP_ACCESS_TOKEN}"}
+
+    resp = await client.get(
+        f"{Config.WHATSAPP_MEDIA_URL}/{media_id}", headers=auth_headers, timeout=15
+    )
+    resp.raise_for_status()
+    media_url = resp.json().get("url")
+
+    media_resp = await client.get(media_url, headers=auth_headers, timeout=60)
+    media_resp.raise_for_status()
+    return media_resp.content
@@ -0,0 +1,284 @@
+"""
+Buffered writer for generated_images audit rows.
+
+Nothing reads a generated_images row before the user has their image,
+so the insert doesn't belong on the reply path. record_generated_image()
+appends the row to a local journal (fsynced when AUDIT_FSYNC is on) and
+an in-memory buffer, then returns. A background thread flushes the
+buffer as one multi-row insert once AUDIT_BATCH_SIZE rows are waiting
+or the oldest has waited AUDIT_FLUSH_INTERVAL seconds.
+
+Crash safety: each row carries a client-generated id and the insert
+ignores duplicates, so a journal segment can be replayed any number of
+times. A segment is deleted only after its rows are in Supabase.
+Segment names carry the pid and a per-writer token
+({pid}.{token}.{seg}.jsonl). A restarted container that reuses a pid
+therefore never appends to, or deletes, a segment left by the previous
+process. The writer thread replays segments left by dead processes in
+the background when it starts (start() does this at worker startup),
+and retries every REPLAY_RETRY_INTERVAL seconds while a replay keeps
+failing.
+
+Metrics: pichasafi_audit_flush_rows (batch size), pichasafi_audit_flush_seconds,
+pichasafi_audit_flush_errors_total, pichasafi_audit_buffered (gauge).
+"""
+from __future__ import annotations
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_ROW_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+REPLAY_RETRY_INTERVAL = 60.0
+
+_writer: "AuditWriter" = None
+_writer_lock = threading.Lock()
+
+
+class AuditWriter:
+    """Journal-backed buffer of generated_images rows, flushed in batches."""
+
+    def __init__(self, journal_dir: str, batch_size: int, flush_interval: float, fsync: bool = True):
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._buffer: list[dict] = []
+        self._oldest: float = None
+        self._segment = 0
+        self._fd = None
+        self._failed_segments: list[str] = []
+        self._closed = False
+        # Unique per writer, so a reused pid never shares segment names
+        self._token = uuid.uuid4().hex[:8]
+        self.replayed = threading.Event()
+
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, row: dict) -> dict:
+        """Journal and buffer one row. Returns it with its id filled in."""
+        # created_at is set here, not at flush time, so ordering by it
+        # reflects when the image was made
+        row = {
+            "id": str(uuid.uuid4()),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **row,
+        }
+        line = (json.dumps(row, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            os.write(self._fd, line)
+            if self.fsync:
+                os.fsync(self._fd)
+            self._buffer.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            buffered = len(self._buffer)
+        metrics.set_gauge("pichasafi_audit_buffered", buffered)
+        if buffered >= self.batch_size:
+            self._wake.set()
+        return row
+
+    def flush(self) -> int:
+        """Insert everything buffered now. Returns rows written (0 on failure)."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                rows, self._buffer, self._oldest = self._buffer, [], None
+                segment = self._seal_segment()
+            metrics.set_gauge("pichasafi_audit_buffered", 0)
+
+            if self._insert(rows):
+                # Earlier failed segments only held rows that were in this batch
+                for path in self._failed_segments + [segment]:
+                    os.remove(path)
+                self._failed_segments = []
+                return len(rows)
+
+            # Keep the sealed segment for replay and put the rows back so
+            # the next flush retries them first
+            self._failed_segments.append(segment)
+            with self._lock:
+                self._buffer[:0] = rows
+                self._oldest = self._oldest or time.monotonic()
+            return 0
+
+    def replay(self) -> int | None:
+        """
+        Insert rows from journal segments whose process is gone. Returns
+        the rows replayed, or None if a segment had to be kept for a retry.
+        """
+        replayed = 0
+        kept = False
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "*.jsonl"))):
+            if self._is_own(path) or _owner_alive(path):
+                continue
+            rows = _read_segment(path)
+            if rows and not self._insert(rows):
+                logger.warning(f"Audit journal replay failed, keeping {path}")
+                kept = True
+                continue
+            os.remove(path)
+            replayed += len(rows)
+        if replayed:
+            logger.info(f"Replayed {replayed} audit rows from journal")
+        return None if kept else replayed
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush()
+        with self._lock:
+            path = self._segment_path(self._segment)
+            os.close(self._fd)
+            if not self._buffer and os.path.getsize(path) == 0:
+                os.remove(path)
+
+    # --- Internals ---
+
+    def _run(self) -> None:
+        # Replay here, not in __init__: the first image of a request may create the writer
+        next_replay = 0.0
+        while not self._closed:
+            if next_replay is not None and time.monotonic() >= next_replay:
+                try:
+                    pending = self.replay() is None
+                except Exception as e:
+                    logger.error(f"Audit journal replay crashed: {e}", exc_info=True)
+                    pending = True
+                self.replayed.set()
+                next_replay = time.monotonic() + REPLAY_RETRY_INTERVAL if pending else None
+            timeout = self.flush_interval / 4
+            if next_replay is not None:
+                timeout = max(0.0, min(timeout, next_replay - time.monotonic()))
+            self._wake.wait(timeout)
+            self._wake.clear()
+            with self._lock:
+                due = self._buffer and (
+                    len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._oldest >= self.flush_interval
+                )
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Audit flush crashed: {e}", exc_info=True)
+
+    def _insert(self, rows: list[dict]) -> bool:
+        from app import database as db
+
+        started = time.perf_counter()
+        try:
+            db.insert_generated_images(rows)
+        except Exception as e:
+            metrics.inc("pichasafi_audit_flush_errors_total")
+            logger.error(f"Audit flush of {len(rows)} rows failed: {e}")
+            return False
+        metrics.observe("pichasafi_audit_flush_seconds", time.perf_counter() - started)
+        metrics.observe("pichasafi_audit_flush_rows", len(rows), buckets=FLUSH_ROW_BUCKETS)
+        return True
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.journal_dir, f"{os.getpid()}.{self._token}.{segment:06d}.jsonl")
+
+    def _is_own(self, path: str) -> bool:
+        return os.path.basename(path).startswith(f"{os.getpid()}.{self._token}.")
+
+    def _open_segment(self) -> None:
+        self._segment += 1
+        self._fd = os.open(
+            self._segment_path(self._segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+
+    def _seal_segment(self) -> str:
+        """Close the current segment (call with _lock held); returns its path."""
+        path = self._segment_path(self._segment)
+        os.close(self._fd)
+        self._open_segment()
+        return path
+
+
+def _owner_alive(path: str) -> bool:
+    pid = int(os.path.basename(path).split(".")[0])
+    if pid == os.getpid():
+        return False  # another writer token: a previous process with a reused pid
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _read_segment(path: str) -> list[dict]:
+    rows = []
+    with open(path) as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                # A torn final line from a crash mid-write
+                logger.warning(f"Skipping corrupt audit journal line in {path}")
+    return rows
+
+
+def get_writer() -> AuditWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(
+                    Config.AUDIT_JOURNAL_DIR,
+                    Config.AUDIT_BATCH_SIZE,
+                    Config.AUDIT_FLUSH_INTERVAL,
+                    Config.AUDIT_FSYNC,
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def start() -> None:
+    """Replay journals left by dead processes (worker startup), in the background."""
+    if glob.glob(os.path.join(Config.AUDIT_JOURNAL_DIR, "*.jsonl")):
+        get_writer()
+
+
+def record_generated_image(
+    user_id: str,
+    image_type: str,
+    original_url: str,
+    result_url: str,
+    template_used: str = None,
+    metadata: dict = None,
+) -> dict:
+    """Queue a generated_images row (same fields as database.save_generated_image)."""
+    return get_writer().record(
+        {
+            "user_id": user_id,
+            "image_type": image_type,
+            "template_used": template_used,
+            "original_image_url": original_url,
+            "result_image_url": result_url,
+            "metadata": metadata or {},
+        }
+    )
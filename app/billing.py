@@ -5,13 +5,45 @@ from app import database as db
 
 logger = logging.getLogger(__name__)
 
+# Paid plans as offered in get_limit_reached_message (prices in TZS)
+UNLIMITED = 1_000_000
+PLANS = {
+    "starter": {"price": 15000, "monthly_limit": 30},
+    "pro": {"price": 35000, "monthly_limit": 100},
+    "business": {"price": 75000, "monthly_limit": UNLIMITED},
+}
+PLAN_CURRENCY = "TZS"
+PLAN_PERIOD_DAYS = 30
 
-def check_usage(phone: str) -> dict:
+
+def plan_for_payment(amount: float, plan: str = None) -> str | None:
+    """
+    The plan a payment buys: the named plan if the amount covers it,
+    otherwise the plan priced exactly at `amount`. None if neither.
+    """
+    if plan:
+        plan = plan.strip().lower()
+        if plan in PLANS and amount >= PLANS[plan]["price"]:
+            return plan
+        return None
+    for name, details in PLANS.items():
+        if amount == details["price"]:
+            return name
+    return None
+
+
+def check_usage(phone: str, user: dict = None) -> dict:
     """
     Check if user can create an image.
     Returns dict with allowed, used, limit, remaining, tier.
+    Pass the user row when the caller already has it to skip the read;
+    expired subscriptions are downgraded in that row by app/subscriptions.py.
     """
-    user = db.get_user_by_phone(phone)
+    return usage_from_user(user or db.get_user_by_phone(phone))
+
+
+def usage_from_user(user: dict | None) -> dict:
+    """Compute the check_usage dict from an already-fetched user row."""
     if not user:
         return {"allowed": False, "used": 0, "limit": 0, "tier": "none", "remaining": 0}
 
@@ -35,10 +67,20 @@ def record_usage(phone: str) -> dict | None:
 
 def get_usage_message(phone: str) -> str:
     """Human-readable usage status."""
-    usage = check_usage(phone)
+    return format_usage_message(check_usage(phone))
+
+
+def format_usage_message(usage: dict) -> str:
+    """Render a check_usage/usage_from_user dict for the user."""
     if usage["tier"] == "none":
         return "No account found. Send any message to get started!"
 
+    if usage["limit"] >= UNLIMITED:
+        return (
+            f"*Usage this month:*\n"
+            f"Images created: {usage['used']} (unlimited)\n"
+            f"Plan: {usage['tier'].title()}"
+        )
     return (
         f"*Usage this month:*\n"
         f"Images created: {usage['used']}/{usage['limit']}\n"
@@ -0,0 +1,168 @@
+"""
+Brand kit: a merchant's derived palette, computed when their colors change.
+
+build() turns the three brand colors on the users row
+(brand_color_primary, brand_color_secondary, brand_color_bg) into
+everything a render needs:
+
+  primary, secondary, bg     the brand colors as RGB tuples
+  gradient                   top and bottom stops of the background
+                             gradient (bg, and bg darkened to 70%)
+  accent_light, accent_dark  tint and shade of the primary color
+  text_on_bg                 text color readable on both gradient stops
+  text_on_primary            text color readable on the primary color
+
+Text colors come from pick_text_color(): the first candidate (the
+brand's secondary color, then white, then near-black) that meets the
+WCAG AA contrast ratio of 4.5:1. If none does, the one with the best
+worst-case contrast wins.
+
+Onboarding stores the kit as JSON in users.brand_kit whenever the colors
+are set. Renders take it from the row with for_user(). A row with no kit,
+an outdated kit, or a kit built from colors that have since changed is
+rebuilt in memory. Caption color overrides use for_color(), which keeps
+the last few kits in memory.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+
+KIT_VERSION = 1
+DEFAULT_PRIMARY = "#FF6B00"
+DEFAULT_SECONDARY = "#FFFFFF"
+DEFAULT_BG = "#1A1A2E"
+WHITE = (255, 255, 255)
+NEAR_BLACK = (17, 17, 17)
+AA_CONTRAST = 4.5
+GRADIENT_DARKEN = 0.7
+RGB_FIELDS = ("primary", "secondary", "bg", "accent_light", "accent_dark", "text_on_bg", "text_on_primary")
+
+
+def hex_to_rgb(hex_color: str) -> tuple:
+    """'#RRGGBB' -> (R, G, B)."""
+    hex_color = hex_color.lstrip("#")
+    return tuple(int(hex_color[i : i + 2], 16) for i in (0, 2, 4))
+
+
+def rgb_to_hex(rgb: tuple) -> str:
+    return "#{:02X}{:02X}{:02X}".format(*rgb)
+
+
+def darken(rgb: tuple, factor: float) -> tuple:
+    """Scale each channel (0.0 = black, 1.0 = unchanged)."""
+    return tuple(int(c * factor) for c in rgb)
+
+
+def tint(rgb: tuple, amount: float) -> tuple:
+    """Mix toward white (0.0 = unchanged, 1.0 = white)."""
+    return tuple(round(c + (255 - c) * amount) for c in rgb)
+
+
+def relative_luminance(rgb: tuple) -> float:
+    """WCAG 2.x relative luminance of an sRGB color."""
+    def channel(c: int) -> float:
+        c = c / 255
+        return c / 12.92 if c <= 0.03928 else ((c + 0.055) / 1.055) ** 2.4
+
+    r, g, b = (channel(c) for c in rgb)
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def contrast_ratio(a: tuple, b: tuple) -> float:
+    """WCAG contrast ratio, 1.0 (none) to 21.0 (black on white)."""
+    la, lb = relative_luminance(a), relative_luminance(b)
+    return (max(la, lb) + 0.05) / (min(la, lb) + 0.05)
+
+
+def pick_text_color(backgrounds, candidates=(WHITE, NEAR_BLACK), minimum: float = AA_CONTRAST) -> tuple:
+    """
+    First candidate readable (>= `minimum`) on every background; if none
+    is, the candidate with the best worst-case contrast.
+    """
+    if isinstance(backgrounds[0], int):
+        backgrounds = (backgrounds,)
+    best, best_ratio = None, -1.0
+    for candidate in candidates:
+        ratio = min(contrast_ratio(candidate, bg) for bg in backgrounds)
+        if ratio >= minimum:
+            return tuple(candidate)
+        if ratio > best_ratio:
+            best, best_ratio = candidate, ratio
+    return tuple(best)
+
+
+def build(primary: str = None, secondary: str = None, bg: str = None) -> dict:
+    """The kit for these colors, JSON-ready (for users.brand_kit)."""
+    source = [(c or default).upper() for c, default in (
+        (primary, DEFAULT_PRIMARY), (secondary, DEFAULT_SECONDARY), (bg, DEFAULT_BG)
+    )]
+    primary_rgb, secondary_rgb, bg_rgb = (hex_to_rgb(c) for c in source)
+    gradient = (bg_rgb, darken(bg_rgb, GRADIENT_DARKEN))
+    text_candidates = (secondary_rgb, WHITE, NEAR_BLACK)
+    kit = {
+        "version": KIT_VERSION,
+        "source": source,
+        "primary": primary_rgb,
+        "secondary": secondary_rgb,
+        "bg": bg_rgb,
+        "gradient": gradient,
+        "accent_light": tint(primary_rgb, 0.35),
+        "accent_dark": darken(primary_rgb, 0.65),
+        "text_on_bg": pick_text_color(gradient, text_candidates),
+        "text_on_primary": pick_text_color(primary_rgb, text_candidates),
+    }
+    # Lists, as they come back from the JSONB column
+    return _as_lists(kit)
+
+
+def _as_lists(kit: dict) -> dict:
+    out = dict(kit)
+    for field in RGB_FIELDS:
+        out[field] = list(kit[field])
+    out["gradient"] = [list(stop) for stop in kit["gradient"]]
+    return out
+
+
+def _as_tuples(kit: dict) -> dict:
+    out = dict(kit)
+    for field in RGB_FIELDS:
+        out[field] = tuple(kit[field])
+    out["gradient"] = tuple(tuple(stop) for stop in kit["gradient"])
+    return out
+
+
+def colors_of(user: dict) -> list[str]:
+    return [
+        (user.get("brand_color_primary") or DEFAULT_PRIMARY).upper(),
+        (user.get("brand_color_secondary") or DEFAULT_SECONDARY).upper(),
+        (user.get("brand_color_bg") or DEFAULT_BG).upper(),
+    ]
+
+
+def for_user(user: dict) -> dict:
+    """The user's kit with RGB tuples, from the row when it is current."""
+    kit = user.get("brand_kit")
+    source = colors_of(user)
+    if not kit or kit.get("version") != KIT_VERSION or kit.get("source") != source:
+        return _cached(*source)
+    return _as_tuples(kit)
+
+
+def for_color(bg: str) -> dict:
+    """A kit for a one-off background color (caption overrides)."""
+    return _cached(DEFAULT_PRIMARY, DEFAULT_SECONDARY, bg.upper())
+
+
+@lru_cache(maxsize=64)
+def _cached(primary: str, secondary: str, bg: str) -> dict:
+    return _as_tuples(build(primary, secondary, bg))
+
+
+def update_for(user: dict, **colors) -> dict:
+    """
+    Row updates that set brand colors and the matching kit, e.g.
+    update_for(user, brand_color_primary="#0066FF").
+    """
+    row = {**user, **colors}
+    primary, secondary, bg = colors_of(row)
+    return {**colors, "brand_kit": build(primary, secondary, bg)}
@@ -0,0 +1,245 @@
+"""
+Bulk broadcast of one text message to every user.
+
+Recipients are streamed from Supabase a page at a time (keyset
+pagination on users.id, BROADCAST_PAGE_SIZE rows per page; the next
+page is fetched while the current one sends) and sent by a pool of
+BROADCAST_CONCURRENCY threads. Every send goes through the shared rate
+limiter at PRIORITY_BULK, so a broadcast takes only the capacity left
+over by live replies and result images on the same phone number, and
+backs off with everyone else on a 429.
+
+Checkpointing: each broadcast has a journal, BROADCAST_DIR/<id>.jsonl.
+Before a message is posted a "pending" line for the recipient is
+written and fsynced; when the post returns a "sent" or "failed" line
+follows, and once a page is finished a "cursor" line records the last
+user id in it. Re-running with the same id (by default a hash of the
+message) resumes after the last cursor and skips everyone with a line
+in the journal. A recipient left pending by a crash may or may not
+have got the message, so they are reported as "unknown" and not sent
+again: a broadcast is delivered at most once per user.
+
+Only sends that certainly did not reach Meta are retried (the local
+throttle timed out, or a 429), up to BROADCAST_MAX_ATTEMPTS times with
+backoff; any other error marks the recipient failed.
+
+    flask --app run broadcast --message "New templates are here!"
+
+Metrics: pichasafi_broadcast_messages_total{result}, pichasafi_broadcast_rate (gauge).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from app.config import Config
+from app import database as db
+from app import messenger
+from app import metrics
+from app.rate_limit import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+REPORT_INTERVAL = 2.0
+
+
+def default_id(message: str) -> str:
+    """Default id: the same message resumes the same broadcast."""
+    return hashlib.sha256(message.encode()).hexdigest()[:16]
+
+
+class Broadcast:
+    """One resumable broadcast and its journal."""
+
+    def __init__(
+        self,
+        message: str,
+        broadcast_id: str = None,
+        journal_dir: str = None,
+        concurrency: int = None,
+        page_size: int = None,
+        max_attempts: int = None,
+    ):
+        self.message = message
+        self.id = broadcast_id or default_id(message)
+        self.concurrency = concurrency or Config.BROADCAST_CONCURRENCY
+        self.page_size = page_size or Config.BROADCAST_PAGE_SIZE
+        self.max_attempts = max_attempts or Config.BROADCAST_MAX_ATTEMPTS
+        journal_dir = journal_dir or Config.BROADCAST_DIR
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = os.path.join(journal_dir, f"{self.id}.jsonl")
+
+        # Totals over every run of this broadcast, rebuilt from the journal
+        self.counts = {"sent": 0, "failed": 0, "unknown": 0}
+        self.finished = False
+        self._sent_before = 0
+        self._cursor = None
+        self._seen: set[str] = set()
+        self._started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._load()
+
+    # --- Journal ---
+
+    def _load(self) -> None:
+        """Replay an existing journal: cursor, recipients already handled, counts."""
+        if not os.path.exists(self.path):
+            return
+        state = {}
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                kind = entry.get("t")
+                if kind == "cursor":
+                    self._cursor = entry["id"]
+                elif kind == "end":
+                    self.finished = True
+                elif kind in ("pending", "sent", "failed"):
+                    state[entry["phone"]] = kind
+        self._seen = set(state)
+        for kind in state.values():
+            self.counts["unknown" if kind == "pending" else kind] += 1
+        self._sent_before = self.counts["sent"]
+        if self.counts["unknown"]:
+            logger.warning(
+                f"Broadcast {self.id}: {self.counts['unknown']} recipients were mid-send "
+                "when the last run stopped; not sending to them again"
+            )
+
+    def _write(self, entry: dict, sync: bool = False) -> None:
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    # --- Sending ---
+
+    def _send_one(self, phone: str) -> str | None:
+        if self._stop.is_set():
+            return None  # not journaled, so the next run sends it
+        # Durable before the post: a crash after this line never re-sends
+        self._write({"t": "pending", "phone": phone}, sync=True)
+        for attempt in range(1, self.max_attempts + 1):
+            result = messenger.send_text(phone, self.message, priority=PRIORITY_BULK)
+            if "error" not in result:
+                outcome = "sent"
+                break
+            outcome = "failed"
+            # Throttled locally or by Meta: the message never went out
+            if result.get("error") != "rate limited" and result.get("status") != 429:
+                break
+            if attempt < self.max_attempts and not self._stop.is_set():
+                time.sleep(min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+        self._write({"t": outcome, "phone": phone})
+        with self._lock:
+            self.counts[outcome] += 1
+        metrics.inc("pichasafi_broadcast_messages_total", result=outcome)
+        return outcome
+
+    def _pages(self, pool: ThreadPoolExecutor):
+        """Yield recipient pages, fetching the next one while the caller sends."""
+        upcoming = pool.submit(db.list_broadcast_recipients, self._cursor, self.page_size)
+        while True:
+            page = upcoming.result()
+            if not page:
+                return
+            if len(page) == self.page_size:
+                upcoming = pool.submit(db.list_broadcast_recipients, page[-1]["id"], self.page_size)
+            else:
+                upcoming = pool.submit(list)
+            yield page
+
+    def run(self, progress=None) -> dict:
+        """
+        Send to every recipient not yet in the journal. `progress` is
+        called with stats() every REPORT_INTERVAL seconds and at the end.
+        """
+        if self.finished:
+            logger.info(f"Broadcast {self.id} already finished")
+            return self.stats()
+        self._started = time.perf_counter()
+        done = threading.Event()
+        reporter = threading.Thread(
+            target=self._report_loop, args=(progress, done), name="broadcast-progress", daemon=True
+        )
+        reporter.start()
+        # One extra thread for the page prefetch
+        pool = ThreadPoolExecutor(max_workers=self.concurrency + 1, thread_name_prefix="broadcast")
+        try:
+            for page in self._pages(pool):
+                futures = [
+                    pool.submit(self._send_one, user["phone_number"])
+                    for user in page
+                    if user["phone_number"] not in self._seen
+                ]
+                wait(futures)
+                for future in futures:
+                    future.result()
+                if self._stop.is_set():
+                    break
+                self._cursor = page[-1]["id"]
+                self._write({"t": "cursor", "id": self._cursor}, sync=True)
+            else:
+                self._write({"t": "end"}, sync=True)
+                self.finished = True
+        except KeyboardInterrupt:
+            # In-flight sends finish; queued ones see the stop flag and skip
+            self._stop.set()
+            raise
+        finally:
+            pool.shutdown(wait=True)
+            done.set()
+            reporter.join()
+            if progress:
+                progress(self.stats())
+        logger.info(f"Broadcast {self.id}: {self.stats()}")
+        return self.stats()
+
+    def stop(self) -> None:
+        """Finish in-flight sends and stop; the next run resumes from the journal."""
+        self._stop.set()
+
+    def stats(self) -> dict:
+        seconds = time.perf_counter() - self._started if self._started else 0.0
+        with self._lock:
+            stats = dict(self.counts)
+            sent = stats["sent"] - self._sent_before
+        stats.update(
+            id=self.id,
+            finished=self.finished,
+            seconds=round(seconds, 1),
+            per_second=round(sent / seconds, 1) if seconds else 0.0,
+        )
+        return stats
+
+    def _report_loop(self, progress, done: threading.Event) -> None:
+        while not done.wait(REPORT_INTERVAL):
+            stats = self.stats()
+            metrics.set_gauge("pichasafi_broadcast_rate", stats["per_second"])
+            if progress:
+                progress(stats)
+
+
+def count_recipients(page_size: int = None) -> int:
+    """Walk the recipient pages without sending (for --dry-run)."""
+    page_size = page_size or Config.BROADCAST_PAGE_SIZE
+    total, cursor = 0, None
+    while True:
+        page = db.list_broadcast_recipients(cursor, page_size)
+        total += len(page)
+        if len(page) < page_size:
+            return total
+        cursor = page[-1]["id"]
@@ -0,0 +1,105 @@
+"""
+Admin commands, run with the Flask CLI:
+
+    flask --app run profile-summary --top 25
+    flask --app run memory-report --pid <gunicorn master pid>
+    flask --app run sweep-subscriptions
+    flask --app run broadcast --message "New templates this week!"
+    flask --app run export-analytics --out /data/exports
+"""
+import click
+from app import broadcast as broadcasts
+from app import export
+from app import memory
+from app import profiling
+from app import subscriptions
+
+
+@click.command("profile-summary")
+@click.option("--top", default=20, show_default=True, help="Number of functions to list.")
+def profile_summary(top: int) -> None:
+    """Summarize the hottest functions across captured request profiles."""
+    click.echo(profiling.format_summary(profiling.summarize(top)))
+
+
+@click.command("memory-report")
+@click.option("--pid", type=int, default=None, help="Gunicorn master pid (default: this process).")
+def memory_report(pid: int) -> None:
+    """Unique vs shared memory of the master and each worker."""
+    click.echo(memory.format_report(memory.report(pid)))
+
+
+@click.command("sweep-subscriptions")
+def sweep_subscriptions() -> None:
+    """Downgrade expired subscriptions now (ignores the sweep interval)."""
+    result = subscriptions.run_due(force=True)
+    if result is None:
+        click.echo("Another process is sweeping; try again shortly.")
+        return
+    click.echo(f"Downgraded {result['downgraded']} subscriptions in {result['batches']} batches ({result['seconds']}s)")
+
+
+@click.command("broadcast")
+@click.option("--message", help="Text to send to every user.")
+@click.option("--file", "path", type=click.Path(exists=True, dir_okay=False), help="Read the text from a file.")
+@click.option("--id", "broadcast_id", help="Journal id (default: derived from the message, so re-runs resume).")
+@click.option("--concurrency", type=int, default=None, help="Parallel sends (default: BROADCAST_CONCURRENCY).")
+@click.option("--page-size", type=int, default=None, help="Recipients per page (default: BROADCAST_PAGE_SIZE).")
+@click.option("--dry-run", is_flag=True, help="Count recipients without sending.")
+def broadcast(message: str, path: str, broadcast_id: str, concurrency: int, page_size: int, dry_run: bool) -> None:
+    """Send a text message to every user, resuming an interrupted run."""
+    if path:
+        with open(path) as f:
+            message = f.read()
+    if not message or not message.strip():
+        raise click.UsageError("Give the text with --message or --file.")
+    if dry_run:
+        click.echo(f"Would send to {broadcasts.count_recipients(page_size)} users")
+        return
+
+    job = broadcasts.Broadcast(
+        message.strip(), broadcast_id=broadcast_id, concurrency=concurrency, page_size=page_size
+    )
+    if job.finished:
+        click.echo(f"Broadcast {job.id} already finished; pass a new --id to send it again.")
+        return
+    click.echo(f"Broadcast {job.id} (journal {job.path})")
+
+    def progress(stats: dict) -> None:
+        click.echo(
+            f"\rsent {stats['sent']}  failed {stats['failed']}  unknown {stats['unknown']}  "
+            f"{stats['per_second']} msg/s  {stats['seconds']}s",
+            nl=False,
+        )
+
+    try:
+        stats = job.run(progress)
+    except KeyboardInterrupt:
+        click.echo(f"\nStopped; run the same command again to resume broadcast {job.id}.")
+        raise SystemExit(130)
+    click.echo("\nDone." if stats["finished"] else "\nStopped before the end; run again to resume.")
+
+
+@click.command("export-analytics")
+@click.option("--out", "out_dir", required=True, type=click.Path(file_okay=False), help="Directory for the files and state.")
+@click.option("--format", "fmt", type=click.Choice(export.FORMATS), default="csv", show_default=True)
+@click.option("--table", "tables", multiple=True, type=click.Choice(list(export.TABLES)), help="Only these tables.")
+@click.option("--full", is_flag=True, help="Export every row, not just rows since the last run.")
+@click.option("--page-size", type=int, default=None, help="Rows per page (default: EXPORT_PAGE_SIZE).")
+def export_analytics(out_dir: str, fmt: str, tables: tuple, full: bool, page_size: int) -> None:
+    """Stream generated_images and users to compressed CSV or Parquet files."""
+    try:
+        results = export.run(out_dir, fmt, tables or None, full=full, page_size=page_size)
+    except export.ExportError as e:
+        raise click.ClickException(str(e))
+    for r in results:
+        where = r["path"] or "nothing new"
+        click.echo(f"{r['table']}: {r['rows']} rows, {r['bytes']} bytes in {r['seconds']}s -> {where}")
+
+
+def register_commands(app) -> None:
+    app.cli.add_command(profile_summary)
+    app.cli.add_command(memory_report)
+    app.cli.add_command(sweep_subscriptions)
+    app.cli.add_command(broadcast)
+    app.cli.add_command(export_analytics)
@@ -1,3 +1,137 @@
-# Phase 2: Full command parser
-# Will handle: help, status, edit, templates, subscribe, history
-# And image+caption combinations like "poster 85000" or "sale 30%"
+"""
+Caption grammar for image messages: "poster 85000", "sale 30%",
+"new white", "ofa 20% tsh 15,000 #FF6B00".
+
+parse_caption() turns a caption into render options in one left-to-right
+pass. The grammar is the TOKEN_RULES table; it is compiled at import into
+a single alternation regex, so parsing is one scan with no per-word
+dictionary probing beyond the keyword lookups. Captions without a
+recognised token (most of them) cost one regex scan; empty captions
+return the defaults without touching the regex at all.
+
+Options:
+  template    None (plain enhanced photo) | "product_showcase" |
+              "sale_promo" | "new_arrival"
+  price       int, in whole currency units (85000, "85k", "85,000", "1.2m")
+  currency    "TZS" (default) | "KES"
+  discount    int percent, 1-99 ("30%", "-30%", "30% off")
+  background  "gradient" (default) | "solid"
+  color       "#RRGGBB" override for the brand background, or None
+  unknown     words that matched nothing (kept for logging)
+"""
+from __future__ import annotations
+
+import math
+import re
+
+DEFAULT_OPTIONS = {
+    "template": None,
+    "price": None,
+    "currency": "TZS",
+    "discount": None,
+    "background": "gradient",
+    "color": None,
+    "unknown": (),
+}
+
+# Keyword -> option updates. English and Swahili.
+KEYWORDS = {
+    "poster": {"template": "product_showcase"},
+    "bango": {"template": "product_showcase"},
+    "sale": {"template": "sale_promo"},
+    "promo": {"template": "sale_promo"},
+    "ofa": {"template": "sale_promo"},
+    "punguzo": {"template": "sale_promo"},
+    "new": {"template": "new_arrival"},
+    "mpya": {"template": "new_arrival"},
+    "gradient": {"background": "gradient"},
+    "solid": {"background": "solid"},
+    "plain": {"background": "solid"},
+    "white": {"background": "solid", "color": "#FFFFFF"},
+    "nyeupe": {"background": "solid", "color": "#FFFFFF"},
+    "black": {"background": "solid", "color": "#111111"},
+    "nyeusi": {"background": "solid", "color": "#111111"},
+    "dark": {"color": "#1A1A2E"},
+}
+
+CURRENCIES = {"tsh": "TZS", "tzs": "TZS", "ksh": "KES", "kes": "KES"}
+MULTIPLIERS = {"k": 1_000, "m": 1_000_000}
+MAX_PRICE = 1_000_000_000
+# Bare numbers below this are sizes/quantities ("size 42"), not prices,
+# unless marked with a currency, k/m or /=
+MIN_BARE_PRICE = 100
+
+# (group name, pattern). Order matters: earlier rules win at a position.
+TOKEN_RULES = (
+    ("discount", r"(?<![\w.,])-?(?P<pct>\d{1,3}(?:\.\d+)?)\s*%(?:\s*off\b)?"),
+    ("color", r"#(?P<hex>[0-9a-f]{6})\b"),
+    (
+        "price",
+        r"(?:(?P<cur>tsh|tzs|ksh|kes)\.?\s*|(?<![\w.,]))"
+        r"(?P<amount>\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)"
+        r"\s*(?P<mult>k|m)?(?P<suffix>\s*/=)?(?![\w%])",
+    ),
+    ("word", r"[^\W\d_]+"),
+)
+
+_TOKEN_RE = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_RULES), re.IGNORECASE
+)
+
+
+def parse_caption(caption: str | None) -> dict:
+    """Render options for an image caption (see module docstring)."""
+    if not caption or caption.isspace():
+        return dict(DEFAULT_OPTIONS)
+
+    options = dict(DEFAULT_OPTIONS)
+    unknown = []
+    for match in _TOKEN_RE.finditer(caption):
+        kind = match.lastgroup
+        if kind == "word":
+            word = match.group("word").lower()
+            updates = KEYWORDS.get(word)
+            if updates:
+                options.update(updates)
+            elif word in CURRENCIES:
+                options["currency"] = CURRENCIES[word]
+            else:
+                unknown.append(word)
+        elif kind == "discount":
+            pct = int(round(float(match.group("pct"))))
+            if 0 < pct < 100:
+                options["discount"] = pct
+            else:
+                unknown.append(match.group("discount").strip().lower())
+        elif kind == "color":
+            options["color"] = f"#{match.group('hex').upper()}"
+        else:
+            amount, currency = match.group("amount"), match.group("cur")
+            marked = currency or match.group("mult") or match.group("suffix") or "," in amount
+            price = _parse_price(amount, match.group("mult"))
+            if price and (marked or price >= MIN_BARE_PRICE):
+                options["price"] = price
+            else:
+                unknown.append(match.group("price").strip().lower())
+            if currency:
+                options["currency"] = CURRENCIES[currency.lower()]
+
+    # A bare price or discount implies the matching poster layout
+    if options["template"] is None:
+        if options["discount"]:
+            options["template"] = "sale_promo"
+        elif options["price"]:
+            options["template"] = "product_showcase"
+    options["unknown"] = tuple(unknown)
+    return options
+
+
+def _parse_price(amount: str, multiplier: str | None) -> int | None:
+    value = float(amount.replace(",", ""))
+    if multiplier:
+        value *= MULTIPLIERS[multiplier.lower()]
+    # A long enough digit run parses as inf, which int() can't take
+    if not math.isfinite(value):
+        return None
+    value = int(round(value))
+    return value if 0 < value <= MAX_PRICE else None
@@ -9,8 +9,11 @@ class Config:
     WHATSAPP_VERIFY_TOKEN = (os.environ.get("WHATSAPP_VERIFY_TOKEN") or "").strip()
     WHATSAPP_ACCESS_TOKEN = (os.environ.get("WHATSAPP_ACCESS_TOKEN") or "").strip()
     WHATSAPP_PHONE_NUMBER_ID = (os.environ.get("WHATSAPP_PHONE_NUMBER_ID") or "").strip()
+    # App Secret for X-Hub-Signature-256 on POST /webhook (see app/signatures.py); unset = not verified
+    WHATSAPP_APP_SECRET = (os.environ.get("WHATSAPP_APP_SECRET") or "").strip()
+    WHATSAPP_GRAPH_URL = (os.environ.get("WHATSAPP_GRAPH_URL") or "https://graph.facebook.com/v21.0").strip().rstrip("/")
     WHATSAPP_API_URL = ""  # Set in validate()
-    WHATSAPP_MEDIA_URL = "https://graph.facebook.com/v21.0"
+    WHATSAPP_MEDIA_URL = WHATSAPP_GRAPH_URL
 
     # Supabase
     SUPABASE_URL = (os.environ.get("SUPABASE_URL") or "").strip()
@@ -21,6 +24,110 @@ class Config:
     APP_URL = (os.environ.get("APP_URL") or "http://localhost:5000").strip()
     FREE_IMAGE_LIMIT = int((os.environ.get("FREE_IMAGE_LIMIT") or "3").strip())
 
+    # Async (ASGI) server mode
+    ASYNC_HTTP_MAX_CONNECTIONS = int((os.environ.get("ASYNC_HTTP_MAX_CONNECTIONS") or "50").strip())
+    ASYNC_CPU_EXECUTOR = (os.environ.get("ASYNC_CPU_EXECUTOR") or "thread").strip()
+    ASYNC_CPU_WORKERS = int((os.environ.get("ASYNC_CPU_WORKERS") or "2").strip())
+
+    # Readiness (/ready): seconds to cache dependency probe results
+    READY_PROBE_TTL = float((os.environ.get("READY_PROBE_TTL") or "15").strip())
+    # Failed warm-up is re-run from /ready after this delay, doubling per
+    # failure up to WARMUP_RETRY_MAX
+    WARMUP_RETRY_DELAY = float((os.environ.get("WARMUP_RETRY_DELAY") or "5").strip())
+    WARMUP_RETRY_MAX = float((os.environ.get("WARMUP_RETRY_MAX") or "120").strip())
+
+    # Metrics (/metrics endpoint and stage timing)
+    METRICS_ENABLED = (os.environ.get("METRICS_ENABLED") or "").strip().lower() in ("1", "true", "yes")
+    METRICS_DIR = (os.environ.get("METRICS_DIR") or "/tmp/pichasafi-metrics").strip()
+    METRICS_FLUSH_INTERVAL = float((os.environ.get("METRICS_FLUSH_INTERVAL") or "1.0").strip())
+
+    # Profiling of slow requests (off | sample | cprofile)
+    PROFILE_MODE = (os.environ.get("PROFILE_MODE") or "off").strip().lower()
+    PROFILE_SAMPLE_RATE = float((os.environ.get("PROFILE_SAMPLE_RATE") or "0").strip())
+    PROFILE_THRESHOLD_MS = float((os.environ.get("PROFILE_THRESHOLD_MS") or "5000").strip())
+    PROFILE_INTERVAL_MS = float((os.environ.get("PROFILE_INTERVAL_MS") or "10").strip())
+    PROFILE_DIR = (os.environ.get("PROFILE_DIR") or "/tmp/pichasafi-profiles").strip()
+    PROFILE_MAX_FILES = int((os.environ.get("PROFILE_MAX_FILES") or "50").strip())
+
+    # Assets preloaded in the gunicorn master and shared copy-on-write
+    PRELOAD_GRADIENTS = [
+        c.strip() for c in (os.environ.get("PRELOAD_GRADIENTS") or "#1A1A2E").split(",") if c.strip()
+    ]
+    GRADIENT_CACHE_SIZE = int((os.environ.get("GRADIENT_CACHE_SIZE") or "8").strip())
+    SHARED_MODEL_FILES = [
+        p.strip() for p in (os.environ.get("SHARED_MODEL_FILES") or "").split(",") if p.strip()
+    ]
+
+    # Object storage: local disk tier in front of Supabase Storage
+    STORAGE_BACKEND = (os.environ.get("STORAGE_BACKEND") or "supabase").strip().lower()
+    STORAGE_LOCAL_DIR = (os.environ.get("STORAGE_LOCAL_DIR") or "/tmp/pichasafi-bucket").strip()
+    STORAGE_LOCAL_URL = (os.environ.get("STORAGE_LOCAL_URL") or "").strip() or None
+    STORAGE_CACHE_DIR = (os.environ.get("STORAGE_CACHE_DIR") or "/tmp/pichasafi-storage").strip()
+    STORAGE_CACHE_MAX_MB = int((os.environ.get("STORAGE_CACHE_MAX_MB") or "512").strip())
+    STORAGE_WRITE_BACK_THREADS = int((os.environ.get("STORAGE_WRITE_BACK_THREADS") or "2").strip())
+
+    # generated_images audit rows: journaled locally, inserted in batches
+    AUDIT_BATCH_SIZE = int((os.environ.get("AUDIT_BATCH_SIZE") or "50").strip())
+    AUDIT_FLUSH_INTERVAL = float((os.environ.get("AUDIT_FLUSH_INTERVAL") or "2.0").strip())
+    AUDIT_JOURNAL_DIR = (os.environ.get("AUDIT_JOURNAL_DIR") or "/tmp/pichasafi-audit").strip()
+    AUDIT_FSYNC = (os.environ.get("AUDIT_FSYNC") or "true").strip().lower() in ("1", "true", "yes")
+
+    # Outbound Graph API rate limit, shared by all workers on a host
+    RATE_LIMIT_ENABLED = (os.environ.get("RATE_LIMIT_ENABLED") or "true").strip().lower() in ("1", "true", "yes")
+    RATE_LIMIT_DB = (os.environ.get("RATE_LIMIT_DB") or "/tmp/pichasafi-ratelimit.sqlite3").strip()
+    RATE_LIMIT_PER_SECOND = float((os.environ.get("RATE_LIMIT_PER_SECOND") or "50").strip())
+    RATE_LIMIT_BURST = float((os.environ.get("RATE_LIMIT_BURST") or "50").strip())
+    RATE_LIMIT_MIN = float((os.environ.get("RATE_LIMIT_MIN") or "1").strip())
+    RATE_LIMIT_INCREASE = float((os.environ.get("RATE_LIMIT_INCREASE") or "2").strip())
+    RATE_LIMIT_MAX_WAIT = float((os.environ.get("RATE_LIMIT_MAX_WAIT") or "10").strip())
+    RATE_LIMIT_MAX_ATTEMPTS = int((os.environ.get("RATE_LIMIT_MAX_ATTEMPTS") or "5").strip())
+
+    # Start media downloads while routing runs (see app/prefetch.py)
+    PREFETCH_MEDIA = (os.environ.get("PREFETCH_MEDIA") or "true").strip().lower() in ("1", "true", "yes")
+    PREFETCH_THREADS = int((os.environ.get("PREFETCH_THREADS") or "4").strip())
+
+    # Decode limits for user images (see app/image_guard.py)
+    IMAGE_MAX_BYTES = int((os.environ.get("IMAGE_MAX_BYTES") or str(20 * 1024 * 1024)).strip())
+    IMAGE_MAX_PIXELS = int((os.environ.get("IMAGE_MAX_PIXELS") or "16000000").strip())
+    IMAGE_MAX_DECODE_MB = int((os.environ.get("IMAGE_MAX_DECODE_MB") or "160").strip())
+
+    # Expired subscriptions are downgraded in the background (see app/subscriptions.py);
+    # an interval of 0 turns the sweeper thread off
+    SUBSCRIPTION_SWEEP_INTERVAL = float((os.environ.get("SUBSCRIPTION_SWEEP_INTERVAL") or "300").strip())
+    SUBSCRIPTION_SWEEP_BATCH = int((os.environ.get("SUBSCRIPTION_SWEEP_BATCH") or "200").strip())
+    SUBSCRIPTION_SWEEP_LOCK = (os.environ.get("SUBSCRIPTION_SWEEP_LOCK") or "/tmp/pichasafi-subscription-sweep.lock").strip()
+
+    # Mobile-money payment callbacks (see app/payments.py); unset secret = endpoint off
+    PAYMENT_WEBHOOK_SECRET = (os.environ.get("PAYMENT_WEBHOOK_SECRET") or "").strip()
+    PAYMENT_QUEUE_DB = (os.environ.get("PAYMENT_QUEUE_DB") or "/tmp/pichasafi-payments.sqlite3").strip()
+    PAYMENT_MAX_ATTEMPTS = int((os.environ.get("PAYMENT_MAX_ATTEMPTS") or "10").strip())
+    PAYMENT_WORKERS = int((os.environ.get("PAYMENT_WORKERS") or "4").strip())
+
+    # Bulk broadcasts (see app/broadcast.py); journals live in BROADCAST_DIR
+    BROADCAST_DIR = (os.environ.get("BROADCAST_DIR") or "/tmp/pichasafi-broadcasts").strip()
+    BROADCAST_CONCURRENCY = int((os.environ.get("BROADCAST_CONCURRENCY") or "8").strip())
+    BROADCAST_PAGE_SIZE = int((os.environ.get("BROADCAST_PAGE_SIZE") or "500").strip())
+    BROADCAST_MAX_ATTEMPTS = int((os.environ.get("BROADCAST_MAX_ATTEMPTS") or "3").strip())
+
+    # Logging (see app/logs.py): json | text; DEBUG/INFO kept at LOG_SAMPLE_RATE
+    LOG_LEVEL = (os.environ.get("LOG_LEVEL") or "INFO").strip().upper()
+    LOG_FORMAT = (os.environ.get("LOG_FORMAT") or "json").strip().lower()
+    LOG_SAMPLE_RATE = float((os.environ.get("LOG_SAMPLE_RATE") or "1.0").strip())
+    LOG_QUEUE_SIZE = int((os.environ.get("LOG_QUEUE_SIZE") or "10000").strip())
+
+    # Template hot reload: seconds between checks of TEMPLATES_DIR (0 = off)
+    TEMPLATE_RELOAD_INTERVAL = float((os.environ.get("TEMPLATE_RELOAD_INTERVAL") or "2").strip())
+
+    # Render scheduling (see app/render_queue.py): fair queue per merchant, weighted by tier;
+    # RENDER_WORKERS=0 renders inline on the request thread (sync app only)
+    RENDER_WORKERS = int((os.environ.get("RENDER_WORKERS") or "0").strip())
+    RENDER_MAX_PER_USER = int((os.environ.get("RENDER_MAX_PER_USER") or "1").strip())
+
+    # Analytics export (see app/export.py): rows per page, and seconds to stay behind
+    # now so rows still in audit journals aren't skipped by the incremental watermark
+    EXPORT_PAGE_SIZE = int((os.environ.get("EXPORT_PAGE_SIZE") or "1000").strip())
+    EXPORT_LAG = float((os.environ.get("EXPORT_LAG") or "3600").strip())
+
     # Paths
     BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     FONTS_DIR = os.path.join(BASE_DIR, "fonts")
@@ -43,5 +150,5 @@ class Config:
             )
         # Compute derived values after env vars are confirmed
         cls.WHATSAPP_API_URL = (
-            f"https://graph.facebook.com/v21.0/{cls.WHATSAPP_PHONE_NUMBER_ID}/messages"
+            f"{cls.WHATSAPP_GRAPH_URL}/{cls.WHATSAPP_PHONE_NUMBER_ID}/messages"
         )
@@ -1,30 +1,38 @@
 from __future__ import annotations
 
 import logging
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
 from app.config import Config
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 logger = logging.getLogger(__name__)
 
-_client: Client = None
-_service_client: Client = None
+# supabase pulls in storage3/pyiceberg/httpx (~0.5s); imported on first connect
+_client: "Client" = None
+_service_client: "Client" = None
 
 
-def get_client() -> Client:
+def get_client() -> "Client":
     """Lazy singleton Supabase client (anon key — respects RLS)."""
     global _client
     if _client is None:
+        from supabase import create_client
+
         url = Config.SUPABASE_URL
         key = Config.SUPABASE_KEY
-        logger.info(f"Connecting to Supabase: url={url}, key={key[:20]}...{key[-10:]} (len={len(key)})")
+        logger.info(f"Connecting to Supabase: url={url}")
         _client = create_client(url, key)
     return _client
 
 
-def get_service_client() -> Client:
+def get_service_client() -> "Client":
     """Lazy singleton Supabase client (service role key — bypasses RLS)."""
     global _service_client
     if _service_client is None:
+        from supabase import create_client
+
         url = Config.SUPABASE_URL
         key = Config.SUPABASE_SERVICE_KEY
         logger.info("Connecting to Supabase with service role key")
@@ -81,6 +89,129 @@ def increment_image_count(phone_number: str) -> dict | None:
     return update_user(phone_number, {"images_created_this_month": new_count})
 
 
+# --- Subscription Operations ---
+
+
+def list_expired_subscriptions(now: str, limit: int) -> list[dict]:
+    """
+    Paid users whose subscription_expires_at is at or before `now`,
+    oldest expiry first. Served by the idx_users_subscription_expiry
+    partial index, which holds only non-free rows.
+    """
+    response = (
+        get_service_client()
+        .table("users")
+        .select("id, phone_number, subscription_tier, subscription_expires_at")
+        .neq("subscription_tier", "free")
+        .lte("subscription_expires_at", now)
+        .order("subscription_expires_at")
+        .limit(limit)
+        .execute()
+    )
+    return response.data
+
+
+def downgrade_subscriptions(user_ids: list[str], now: str, monthly_limit: int) -> list[dict]:
+    """
+    Move the given users to the free tier. The expiry filter is repeated
+    so a user who renewed since they were listed is left alone. Returns
+    the rows that changed.
+    """
+    response = (
+        get_service_client()
+        .table("users")
+        .update({"subscription_tier": "free", "monthly_limit": monthly_limit})
+        .in_("id", user_ids)
+        .neq("subscription_tier", "free")
+        .lte("subscription_expires_at", now)
+        .execute()
+    )
+    return response.data
+
+
+# --- Broadcast Operations ---
+
+
+def list_broadcast_recipients(after_id: str = None, limit: int = 500) -> list[dict]:
+    """
+    One page of users to broadcast to, in id order. Keyset-paginated:
+    pass the id of the last row seen as `after_id` for the next page, so
+    each page is an index seek on the primary key however deep the run is.
+    """
+    query = get_service_client().table("users").select("id, phone_number")
+    if after_id:
+        query = query.gt("id", after_id)
+    response = query.order("id").limit(limit).execute()
+    return response.data
+
+
+# --- Export Operations ---
+
+
+def list_export_page(
+    table: str, columns: str, after: tuple[str, str] = None, before: str = None, limit: int = 1000
+) -> list[dict]:
+    """
+    One page of a table in (created_at, id) order, for analytics exports.
+    Keyset-paginated: pass the (created_at, id) of the last row seen as
+    `after`. `before` leaves out rows created at or after that time.
+    """
+    query = get_service_client().table(table).select(columns)
+    if after:
+        created_at, row_id = after
+        query = query.gte("created_at", created_at).or_(
+            f'created_at.gt."{created_at}",id.gt.{row_id}'
+        )
+    if before:
+        query = query.lt("created_at", before)
+    response = query.order("created_at").order("id").limit(limit).execute()
+    return response.data
+
+
+# --- Transaction Operations ---
+
+
+def insert_transaction(row: dict) -> dict | None:
+    """Insert a payment row. A transaction_ref already on file is left as
+    it is (idx_transactions_ref is unique), so replays are no-ops.
+    Returns the new row, or None if the ref was already there."""
+    response = (
+        get_service_client()
+        .table("transactions")
+        .upsert(row, on_conflict="transaction_ref", ignore_duplicates=True)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+def get_transaction(transaction_ref: str) -> dict | None:
+    response = (
+        get_service_client()
+        .table("transactions")
+        .select("*")
+        .eq("transaction_ref", transaction_ref)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+def update_transaction(
+    transaction_ref: str, updates: dict, only_if_null: str = None
+) -> dict | None:
+    """Update a payment row. With only_if_null, only while that column is
+    still unset (first writer wins). Returns the row if it changed."""
+    query = (
+        get_service_client()
+        .table("transactions")
+        .update(updates)
+        .eq("transaction_ref", transaction_ref)
+    )
+    if only_if_null:
+        query = query.is_(only_if_null, "null")
+    response = query.execute()
+    return response.data[0] if response.data else None
+
+
 # --- Generated Image Operations ---
 
 
@@ -111,18 +242,79 @@ def save_generated_image(
     return response.data[0]
 
 
+HISTORY_COLUMNS = "id, created_at, image_type, template_used, result_image_url"
+
+
+def list_generated_images(
+    user_id: str, limit: int, before: tuple[str, str] = None
+) -> list[dict]:
+    """
+    A user's images, newest first. Keyset-paginated: pass the
+    (created_at, id) of the last row seen as `before` for the next page.
+    Served by idx_images_user_created without sorting the user's rows.
+    """
+    query = (
+        get_client()
+        .table("generated_images")
+        .select(HISTORY_COLUMNS)
+        .eq("user_id", user_id)
+    )
+    if before:
+        created_at, image_id = before
+        # The plain created_at bound lets the index seek to the cursor;
+        # the or() breaks ties between images with the same timestamp
+        query = query.lte("created_at", created_at).or_(
+            f'created_at.lt."{created_at}",id.lt.{image_id}'
+        )
+    response = (
+        query.order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit)
+        .execute()
+    )
+    return response.data
+
+
+def get_generated_image(user_id: str, image_id: str) -> dict | None:
+    """One of the user's images by id (None if missing or someone else's)."""
+    response = (
+        get_client()
+        .table("generated_images")
+        .select(HISTORY_COLUMNS)
+        .eq("id", image_id)
+        .eq("user_id", user_id)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+def insert_generated_images(rows: list[dict]) -> None:
+    """Multi-row insert of audit rows. Rows carry their own id, so
+    replaying a batch that already landed is a no-op."""
+    (
+        get_client()
+        .table("generated_images")
+        .upsert(rows, ignore_duplicates=True)
+        .execute()
+    )
+
+
 # --- Storage Operations ---
 
 
 def upload_to_storage(
-    bucket_path: str, file_bytes: bytes, content_type: str = "image/jpeg"
+    bucket_path: str, file_bytes: bytes, content_type: str = "image/jpeg", wait: bool = True
 ) -> str:
-    """Upload bytes to Supabase Storage. Returns the public URL.
-    Uses service role key to bypass RLS policies."""
-    client = get_service_client()
-    client.storage.from_("pichasafi").upload(
-        path=bucket_path,
-        file=file_bytes,
-        file_options={"content-type": content_type},
-    )
-    return client.storage.from_("pichasafi").get_public_url(bucket_path)
+    """Store bytes via the tiered storage layer. Returns the public URL.
+    With wait=False the Supabase upload happens in the background; only
+    use that for objects nothing fetches by URL right away."""
+    from app import storage
+
+    return storage.get_storage().put(bucket_path, file_bytes, content_type, wait=wait)
+
+
+def download_from_storage(bucket_path: str) -> bytes:
+    """Object bytes, served from the local disk tier when cached."""
+    from app import storage
+
+    return storage.get_storage().get(bucket_path)
@@ -0,0 +1,282 @@
+"""
+Analytics export: generated_images and users, streamed to compressed files.
+
+    flask --app run export-analytics --out /data/exports
+    flask --app run export-analytics --out /data/exports --format parquet
+    flask --app run export-analytics --out /data/exports --full
+
+Each table is read in keyset pages of EXPORT_PAGE_SIZE rows in
+(created_at, id) order (database.list_export_page). Every page is
+flattened and appended to the output file before the next one is
+fetched, so memory stays at about one page however big the table is.
+
+  csv      gzip-compressed CSV, <table>-<run>.csv.gz (stdlib only)
+  parquet  zstd-compressed Parquet, <table>-<run>.parquet, one row group
+           per page; needs pyarrow, which isn't in requirements.txt
+
+generated_images rows carry the per-render numbers that the webhook
+records in metadata (webhook.image_metadata) as flat columns:
+render_ms, input_bytes, output_bytes, downscaled, and
+stage_<name>_ms for each of STAGES (empty unless metrics were enabled
+when the image was made).
+
+Incremental runs: <out>/export_state.json keeps the (created_at, id) of
+the last row exported for each table, and the next run starts after it.
+A daily run writes one new file per table holding that day's rows.
+Files are written as .part and renamed when complete, and the state only
+moves after that, so an interrupted run is repeated from the same place.
+Rows created in the last EXPORT_LAG seconds are left for the next run,
+because audit rows reach Supabase in batches (and after a crash, on
+replay) with their original created_at. --full ignores the saved state
+and starts a new one.
+users rows are exported by created_at too: an incremental run adds
+new merchants, and a --full run snapshots every merchant's current tier
+and counters.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from app.config import Config
+from app import database as db
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "parquet")
+STATE_FILE = "export_state.json"
+STAGES = (
+    "download_media",
+    "inspect_image",
+    "decode_image",
+    "enhance_image",
+    "create_gradient_background",
+    "place_product",
+    "draw_overlays",
+    "to_jpeg_bytes",
+    "upload_original",
+    "upload_result",
+)
+
+
+class ExportError(Exception):
+    """An export that can't run as asked (bad format, missing pyarrow)."""
+
+
+def _flatten_image(row: dict) -> dict:
+    metadata = row.get("metadata") or {}
+    stages = metadata.get("stages_ms") or {}
+    flat = {
+        "id": row["id"],
+        "user_id": row.get("user_id"),
+        "image_type": row.get("image_type"),
+        "template_used": row.get("template_used"),
+        "created_at": row["created_at"],
+        "render_ms": metadata.get("render_ms"),
+        "input_bytes": metadata.get("input_bytes"),
+        "output_bytes": metadata.get("output_bytes"),
+        "downscaled": bool(metadata.get("downscaled")),
+    }
+    for stage in STAGES:
+        flat[f"stage_{stage}_ms"] = stages.get(stage)
+    return flat
+
+
+def _flatten_user(row: dict) -> dict:
+    return {column: row.get(column) for column, _ in TABLES["users"]["columns"]}
+
+
+# name -> columns selected, output columns with their types, row flattener
+TABLES = {
+    "generated_images": {
+        "select": "id, user_id, image_type, template_used, metadata, created_at",
+        "columns": [
+            ("id", "string"),
+            ("user_id", "string"),
+            ("image_type", "string"),
+            ("template_used", "string"),
+            ("created_at", "timestamp"),
+            ("render_ms", "int"),
+            ("input_bytes", "int"),
+            ("output_bytes", "int"),
+            ("downscaled", "bool"),
+        ] + [(f"stage_{stage}_ms", "int") for stage in STAGES],
+        "flatten": _flatten_image,
+    },
+    "users": {
+        "select": (
+            "id, business_name, location, template_style, subscription_tier, subscription_expires_at, "
+            "images_created_this_month, monthly_limit, onboarding_step, created_at"
+        ),
+        "columns": [
+            ("id", "string"),
+            ("business_name", "string"),
+            ("location", "string"),
+            ("template_style", "string"),
+            ("subscription_tier", "string"),
+            ("subscription_expires_at", "timestamp"),
+            ("images_created_this_month", "int"),
+            ("monthly_limit", "int"),
+            ("onboarding_step", "string"),
+            ("created_at", "timestamp"),
+        ],
+        "flatten": _flatten_user,
+    },
+}
+
+
+# --- Writers ---
+
+
+class _CsvWriter:
+    extension = ".csv.gz"
+
+    def __init__(self, path: str, columns: list):
+        self.names = [name for name, _ in columns]
+        self.file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.names)
+
+    def write(self, rows: list[dict]) -> None:
+        self.writer.writerows([row[name] for name in self.names] for row in rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _ParquetWriter:
+    extension = ".parquet"
+
+    def __init__(self, path: str, columns: list):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ExportError("Parquet export needs pyarrow (pip install pyarrow); use --format csv") from None
+        types = {
+            "string": pa.string(),
+            "int": pa.int64(),
+            "bool": pa.bool_(),
+            "timestamp": pa.timestamp("us", tz="UTC"),
+        }
+        self.pa = pa
+        self.timestamps = [name for name, kind in columns if kind == "timestamp"]
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows: list[dict]) -> None:
+        for row in rows:
+            for name in self.timestamps:
+                if row[name]:
+                    row[name] = datetime.fromisoformat(row[name])
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+WRITERS = {"csv": _CsvWriter, "parquet": _ParquetWriter}
+
+
+# --- State ---
+
+
+def load_state(out_dir: str) -> dict:
+    """{table: [created_at, id]} of the last row each table exported."""
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(out_dir: str, state: dict) -> None:
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+# --- Export ---
+
+
+def export_table(
+    table: str, out_dir: str, fmt: str = "csv", after: list = None, before: str = None,
+    page_size: int = None, run_id: str = None,
+) -> dict:
+    """
+    Stream one table's rows after `after` (and created before `before`)
+    into a new file in out_dir. Returns rows, bytes, seconds, path (None
+    when there was nothing new) and last, the watermark to resume from.
+    """
+    spec = TABLES[table]
+    page_size = page_size or Config.EXPORT_PAGE_SIZE
+    run_id = run_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(out_dir, f"{table}-{run_id}{WRITERS[fmt].extension}")
+    started = time.perf_counter()
+    writer = None
+    rows = 0
+    last = after
+    try:
+        while True:
+            page = db.list_export_page(
+                table, spec["select"], after=tuple(last) if last else None, before=before, limit=page_size
+            )
+            if not page:
+                break
+            if writer is None:
+                writer = WRITERS[fmt](path + ".part", spec["columns"])
+            writer.write([spec["flatten"](row) for row in page])
+            rows += len(page)
+            last = [page[-1]["created_at"], page[-1]["id"]]
+            if len(page) < page_size:
+                break
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(path + ".part")
+        raise
+
+    if writer is None:
+        path = None
+    else:
+        writer.close()
+        os.replace(path + ".part", path)
+    return {
+        "table": table,
+        "rows": rows,
+        "path": path,
+        "bytes": os.path.getsize(path) if path else 0,
+        "seconds": round(time.perf_counter() - started, 2),
+        "last": last,
+    }
+
+
+def run(out_dir: str, fmt: str = "csv", tables=None, full: bool = False, page_size: int = None) -> list[dict]:
+    """Export each table incrementally (from scratch with full). Returns one result per table."""
+    if fmt not in WRITERS:
+        raise ExportError(f"Unknown format {fmt}; use one of {', '.join(FORMATS)}")
+    os.makedirs(out_dir, exist_ok=True)
+    state = {} if full else load_state(out_dir)
+    before = (datetime.now(timezone.utc) - timedelta(seconds=Config.EXPORT_LAG)).isoformat()
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    results = []
+    for table in tables or TABLES:
+        result = export_table(
+            table, out_dir, fmt, after=state.get(table), before=before, page_size=page_size, run_id=run_id
+        )
+        if result["last"]:
+            state[table] = result["last"]
+            _save_state(out_dir, state)
+        logger.info(
+            f"Exported {result['rows']} {table} rows ({result['bytes']} bytes) in {result['seconds']}s"
+        )
+        results.append(result)
+    return results
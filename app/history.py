@@ -0,0 +1,104 @@
+"""
+"history" command: list recent renders and re-send one without re-rendering.
+
+The list is a WhatsApp interactive list (max 10 rows). Each image row's
+id is "resend:<image id>"; when there are more images the last row is
+"history:<created_at>|<id>", a keyset cursor for the next page, so deep
+pages cost the same as the first (see idx_images_user_created and
+bench/history_bench.py).
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from app import database as db
+from app import messenger
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 9  # plus one "older" row = WhatsApp's 10-row limit
+RESEND_PREFIX = "resend:"
+PAGE_PREFIX = "history:"
+
+NO_HISTORY_MESSAGE = "You haven't created any images yet. Send me a product photo to start!"
+NO_MORE_MESSAGE = "That's all — no older images."
+IMAGE_NOT_FOUND_MESSAGE = "Sorry, I couldn't find that image. Type *history* to see your images."
+
+IMAGE_TYPE_LABELS = {
+    "product_enhance": "Product photo",
+    "poster": "Poster",
+}
+
+
+def is_history_reply(message_body: str | None) -> bool:
+    """True for list-reply ids produced by send_history."""
+    return bool(message_body) and message_body.startswith((RESEND_PREFIX, PAGE_PREFIX))
+
+
+def handle_reply(phone: str, user: dict, message_body: str) -> None:
+    """Route a tapped history row: re-send an image or show the next page."""
+    if message_body.startswith(RESEND_PREFIX):
+        resend(phone, user, message_body[len(RESEND_PREFIX):])
+    else:
+        send_history(phone, user, decode_cursor(message_body[len(PAGE_PREFIX):]))
+
+
+def send_history(phone: str, user: dict, cursor: tuple[str, str] = None) -> None:
+    """Send one page of the user's images, newest first."""
+    # One extra row tells us whether an older page exists
+    rows = db.list_generated_images(user["id"], PAGE_SIZE + 1, before=cursor)
+    if not rows:
+        messenger.send_text(phone, NO_MORE_MESSAGE if cursor else NO_HISTORY_MESSAGE)
+        return
+
+    page, more = rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+    list_rows = [
+        {
+            "id": f"{RESEND_PREFIX}{row['id']}",
+            "title": _format_date(row["created_at"]),
+            "description": IMAGE_TYPE_LABELS.get(row["image_type"], row["image_type"])[:72],
+        }
+        for row in page
+    ]
+    if more:
+        last = page[-1]
+        list_rows.append({
+            "id": f"{PAGE_PREFIX}{encode_cursor(last['created_at'], last['id'])}",
+            "title": "Older images",
+            "description": "Show the next page",
+        })
+
+    messenger.send_list(
+        phone,
+        "Your recent images. Tap one and I'll send it again.",
+        "View images",
+        [{"title": "Recent images", "rows": list_rows}],
+    )
+
+
+def resend(phone: str, user: dict, image_id: str) -> None:
+    """Send a stored render again by URL."""
+    row = db.get_generated_image(user["id"], image_id)
+    if not row or not row.get("result_image_url"):
+        messenger.send_text(phone, IMAGE_NOT_FOUND_MESSAGE)
+        return
+    messenger.send_image(
+        phone, row["result_image_url"], caption=f"From your history ({_format_date(row['created_at'])})"
+    )
+
+
+def encode_cursor(created_at: str, image_id: str) -> str:
+    return f"{created_at}|{image_id}"
+
+
+def decode_cursor(cursor: str) -> tuple[str, str] | None:
+    created_at, sep, image_id = cursor.partition("|")
+    return (created_at, image_id) if sep and created_at and image_id else None
+
+
+def _format_date(created_at: str) -> str:
+    """'2026-10-19T06:35:53.93+00:00' -> '19 Oct 2026, 06:35' (fits a 24-char title)."""
+    try:
+        return datetime.fromisoformat(created_at).strftime("%d %b %Y, %H:%M")
+    except (TypeError, ValueError):
+        return str(created_at)[:24]
@@ -0,0 +1,133 @@
+"""
+Guarded decoding of user-sent images.
+
+Image.open() only parses the header, so the dimensions are known before
+any pixels are decoded. A 20000x20000 PNG is a few hundred kB on the
+wire and 1.6 GB once decoded to RGBA, enough to OOM-kill a worker and
+every request in flight with it. Before decoding:
+
+  IMAGE_MAX_BYTES      larger uploads are rejected outright
+  IMAGE_MAX_DECODE_MB  estimated decode memory (source plus RGBA copy,
+                       after JPEG draft reduction) above this is rejected
+  IMAGE_MAX_PIXELS     larger images are reduced to this many pixels:
+                       JPEGs at decode time via draft() (decoded at 1/2,
+                       1/4 or 1/8 scale, never full size), everything
+                       else right after decode
+
+Rejections raise ImageTooLarge; the webhook answers with
+IMAGE_TOO_LARGE_MESSAGE instead of the generic failure. Downscaled
+renders go out with IMAGE_DOWNSCALED_NOTE in the caption.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import math
+import warnings
+from PIL import Image, ImageOps
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TOO_LARGE_MESSAGE = (
+    "Sorry, that image is too large for me to process. "
+    "Please send it as a normal photo (not a document), or a smaller version."
+)
+IMAGE_DOWNSCALED_NOTE = "Your photo was very large, so I worked from a smaller copy."
+
+# Decoded bytes per pixel by mode (the render converts to RGBA anyway)
+BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "LA": 2, "RGB": 4, "RGBA": 4, "CMYK": 4, "YCbCr": 4}
+
+
+class ImageTooLarge(ValueError):
+    """The image is over a decode limit and was not decoded."""
+
+
+def inspect(image_bytes: bytes) -> dict:
+    """
+    Header-only check. Returns {"format", "size", "pixels", "downscale"};
+    raises ImageTooLarge when the image must not be decoded.
+    """
+    if len(image_bytes) > Config.IMAGE_MAX_BYTES:
+        _reject(f"{len(image_bytes)} bytes > IMAGE_MAX_BYTES")
+    img = _open(image_bytes)
+    plan = _plan(img)
+    return {
+        "format": img.format,
+        "size": img.size,
+        "pixels": img.size[0] * img.size[1],
+        "downscale": plan["downscale"],
+    }
+
+
+def decode(image_bytes: bytes, mode: str = "RGBA", target: tuple = None) -> tuple[Image.Image, bool]:
+    """
+    Decode within the limits, upright (EXIF orientation applied), in
+    `mode`. Returns (image, downscaled). With `target` (w, h), a JPEG is
+    decoded at the smallest draft scale that still covers it.
+    """
+    if len(image_bytes) > Config.IMAGE_MAX_BYTES:
+        _reject(f"{len(image_bytes)} bytes > IMAGE_MAX_BYTES")
+    img = _open(image_bytes)
+    plan = _plan(img)
+    if target or plan["draft"]:
+        img.draft("RGB", target or plan["draft"])
+    img = ImageOps.exif_transpose(img).convert(mode)
+    if img.size[0] * img.size[1] > Config.IMAGE_MAX_PIXELS:
+        img.thumbnail(_fit(img.size, Config.IMAGE_MAX_PIXELS), Image.LANCZOS)
+    if plan["downscale"]:
+        metrics.inc("pichasafi_images_downscaled_total")
+        logger.info(f"Downscaled oversized image {plan['size']} -> {img.size}")
+    return img, plan["downscale"]
+
+
+# --- Internals ---
+
+
+def _open(image_bytes: bytes) -> Image.Image:
+    """Parse the header only. PIL's own bomb check stays on as a backstop."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            return Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        _reject(str(e))
+
+
+def _plan(img: Image.Image) -> dict:
+    """What decoding `img` will take: draft target, estimated memory, downscale."""
+    width, height = img.size
+    pixels = width * height
+    downscale = pixels > Config.IMAGE_MAX_PIXELS
+    draft = None
+    decoded = (width, height)
+    if downscale and img.format == "JPEG":
+        draft = _fit(img.size, Config.IMAGE_MAX_PIXELS)
+        decoded = _draft_size(img.size, draft)
+    # The decoded source plus its RGBA copy are alive at the same time
+    per_pixel = BYTES_PER_PIXEL.get(img.mode, 4) + 4
+    estimate_mb = decoded[0] * decoded[1] * per_pixel / (1024 * 1024)
+    if estimate_mb > Config.IMAGE_MAX_DECODE_MB:
+        _reject(f"{img.format} {width}x{height} needs ~{estimate_mb:.0f} MB to decode")
+    return {"size": img.size, "draft": draft, "downscale": downscale}
+
+
+def _fit(size: tuple, max_pixels: int) -> tuple[int, int]:
+    """Largest size with `size`'s aspect ratio and at most max_pixels."""
+    scale = math.sqrt(max_pixels / (size[0] * size[1]))
+    return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+
+def _draft_size(size: tuple, target: tuple) -> tuple[int, int]:
+    """The size JPEG draft() will decode at: the smallest 1/1..1/8 scale still >= target."""
+    for scale in (8, 4, 2):
+        if size[0] // scale >= target[0] and size[1] // scale >= target[1]:
+            return -(-size[0] // scale), -(-size[1] // scale)
+    return size
+
+
+def _reject(reason: str):
+    metrics.inc("pichasafi_images_rejected_total")
+    logger.warning(f"Rejected image: {reason}")
+    raise ImageTooLarge(reason)
@@ -1,11 +1,18 @@
 import io
 import logging
 from PIL import Image, ImageEnhance, ImageFilter
+from app import assets
+from app import brand_kit
+from app import image_guard
+from app import memory
+from app import metrics
+from app import template_registry
 
 logger = logging.getLogger(__name__)
 
 OUTPUT_SIZE = (1080, 1080)
 JPEG_QUALITY = 90
+RSS_BUCKETS = tuple(mb * 1024 * 1024 for mb in (8, 16, 32, 64, 128, 256, 512, 1024))
 
 
 def remove_background(image_bytes: bytes) -> Image.Image:
@@ -45,10 +52,10 @@ def create_gradient_background(
     color_top: str = "#1A1A2E",
     color_bottom: str = "#16213E",
 ) -> Image.Image:
-    """Create a vertical gradient background."""
+    """Create a vertical gradient background (colors as hex or RGB tuples)."""
     img = Image.new("RGB", size)
-    r1, g1, b1 = _hex_to_rgb(color_top)
-    r2, g2, b2 = _hex_to_rgb(color_bottom)
+    r1, g1, b1 = _rgb(color_top)
+    r2, g2, b2 = _rgb(color_bottom)
 
     for y in range(size[1]):
         ratio = y / size[1]
@@ -65,7 +72,7 @@ def create_solid_background(
     size: tuple = OUTPUT_SIZE, color: str = "#1A1A2E"
 ) -> Image.Image:
     """Create a solid color background."""
-    return Image.new("RGB", size, _hex_to_rgb(color))
+    return Image.new("RGB", size, _rgb(color))
 
 
 def place_product_on_background(
@@ -93,28 +100,108 @@ def place_product_on_background(
     return bg
 
 
-def process_product_photo(image_bytes: bytes, bg_color: str = "#1A1A2E") -> bytes:
+def process_product_photo(
+    image_bytes: bytes, bg_color: str = "#1A1A2E", options: dict = None, brand: dict = None
+) -> bytes:
     """
     Phase 1 pipeline (lightweight — no background removal to save memory):
     1. Open and enhance product image
-    2. Create gradient background from brand color
+    2. Create gradient (or solid) background from brand color
     3. Place product on background
-    4. Export as 1080x1080 JPEG
+    4. Draw the price label / badge when the caption asked for one
+    5. Export as 1080x1080 JPEG
+
+    options are caption render options from commands.parse_caption.
+    brand is the user's brand kit (brand_kit.for_user); without one the
+    kit for bg_color is used.
+    Decoding goes through image_guard (size limits, EXIF orientation);
+    the peak RSS of each render is recorded.
 
     Background removal (rembg) disabled due to memory constraints on
     free-tier hosting. Can be re-enabled with more RAM (1GB+).
     """
-    product = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
+    with memory.track_peak() as peak:
+        result = _render(image_bytes, bg_color, options or {}, brand)
+    if peak:
+        metrics.observe("pichasafi_render_peak_rss_bytes", peak["growth_kb"] * 1024, buckets=RSS_BUCKETS)
+        logger.info(f"Render peak RSS {peak['peak_kb'] / 1024:.0f} MB (+{peak['growth_kb'] / 1024:.0f} MB)")
+    return result
+
+
+def _render(image_bytes: bytes, bg_color: str, options: dict, brand: dict = None) -> bytes:
+    if options.get("color"):
+        brand = brand_kit.for_color(options["color"])
+    elif brand is None:
+        brand = brand_kit.for_color(bg_color)
+    # One template version for the whole render, even if a swap lands midway
+    templates = template_registry.current()
+
+    with metrics.stage("decode_image"):
+        # Size-checked before decoding; raises image_guard.ImageTooLarge
+        product, _ = image_guard.decode(image_bytes)
     logger.info(f"Opened image. Size: {product.size}")
-    product = enhance_image(product)
+    with metrics.stage("enhance_image"):
+        product = enhance_image(product)
 
-    background = create_gradient_background(
-        color_top=bg_color,
-        color_bottom=_darken_color(bg_color, 0.7),
-    )
+    with metrics.stage("create_gradient_background"):
+        if options.get("background") == "solid":
+            background = create_solid_background(OUTPUT_SIZE, brand["bg"])
+        else:
+            background = assets.get_gradient_layer(OUTPUT_SIZE, *brand["gradient"], templates.version)
+
+    with metrics.stage("place_product"):
+        result = place_product_on_background(product, background)
+    if options.get("template"):
+        with metrics.stage("draw_overlays"):
+            result = draw_overlays(result, options, template=options["template"], snapshot=templates)
+    with metrics.stage("to_jpeg_bytes"):
+        return _to_jpeg_bytes(result)
+
+
+BADGE_COLOR = "#E53935"
+LABEL_COLOR = "#FFFFFF"
+LABEL_TEXT_COLOR = "#1A1A2E"
+
+
+def draw_overlays(
+    img: Image.Image, options: dict, template: str = "product_showcase", snapshot=None
+) -> Image.Image:
+    """Price label (price_zone) and sale/new badge (top left), in place."""
+    from PIL import ImageDraw
+
+    layout = (snapshot or template_registry.current()).get(template)
+    draw = ImageDraw.Draw(img)
+
+    if options.get("price"):
+        zone = layout.zone("price")
+        text = f"{options.get('currency') or 'TZS'} {options['price']:,}"
+        _draw_pill(
+            draw, (zone["x"], zone["y"]), text, layout.font("price"), LABEL_COLOR, LABEL_TEXT_COLOR
+        )
+
+    badge = None
+    if options.get("discount"):
+        badge = f"-{options['discount']}%"
+    elif options.get("template") == "new_arrival":
+        badge = "NEW"
+    if badge:
+        font = layout.font("business_name")
+        width = draw.textlength(badge, font=font)
+        _draw_pill(draw, (40 + int(width) // 2 + 20, 180), badge, font, BADGE_COLOR, "#FFFFFF")
+
+    return img
 
-    result = place_product_on_background(product, background)
-    return _to_jpeg_bytes(result)
+
+def _draw_pill(draw, center: tuple, text: str, font, fill: str, text_fill: str) -> None:
+    """Rounded label centred on `center`."""
+    left, top, right, bottom = draw.textbbox(center, text, font=font, anchor="mm")
+    pad_x, pad_y = 24, 12
+    draw.rounded_rectangle(
+        (left - pad_x, top - pad_y, right + pad_x, bottom + pad_y),
+        radius=(bottom - top) // 2 + pad_y,
+        fill=fill,
+    )
+    draw.text(center, text, font=font, fill=text_fill, anchor="mm")
 
 
 # --- Helpers ---
@@ -129,6 +216,11 @@ def _to_jpeg_bytes(img: Image.Image) -> bytes:
     return buf.getvalue()
 
 
+def _rgb(color) -> tuple:
+    """A ready RGB tuple, or one parsed from '#RRGGBB'."""
+    return tuple(color) if not isinstance(color, str) else _hex_to_rgb(color)
+
+
 def _hex_to_rgb(hex_color: str) -> tuple:
     """Convert '#RRGGBB' to (R, G, B) tuple."""
     hex_color = hex_color.lstrip("#")
@@ -0,0 +1,148 @@
+"""
+Logo ingestion: normalize once at onboarding so renders never have to.
+
+The uploaded logo is decoded, orientation-corrected, its flat background
+keyed out to alpha (when it doesn't already have transparency) and
+trimmed. Two PNG derivatives are stored next to the original:
+
+  logo_key       full logo, RGBA, longest side <= LOGO_FULL_MAX
+  logo_zone_key  fitted and centred in the template's logo_zone (w x h)
+
+Renders fetch the small zone asset (through the storage disk tier) and
+paste it with composite_logo(). Uploads and stored assets are both
+decoded through image_guard, so an oversized logo raises ImageTooLarge
+instead of exhausting the worker.
+"""
+from __future__ import annotations
+
+import io
+import logging
+from datetime import datetime, timezone
+from PIL import Image, ImageChops, ImageOps
+from app import database as db
+from app import image_guard
+from app import metrics
+from app import template_registry
+
+logger = logging.getLogger(__name__)
+
+LOGO_FULL_MAX = 1024
+LOGO_TEMPLATE = "product_showcase"
+# Max per-channel distance from the corner colour that still counts as
+# background; the alpha ramps up over the next KEY_SOFTNESS levels
+KEY_TOLERANCE = 24
+KEY_SOFTNESS = 24
+# Corners further apart than this mean there is no flat background to key
+CORNER_AGREEMENT = 16
+
+
+def logo_zone(template: str = LOGO_TEMPLATE) -> dict:
+    """{"x", "y", "w", "h"} of the logo slot in a template."""
+    return template_registry.get(template).zone("logo")
+
+
+def normalize_logo(logo_bytes: bytes, zone_size: tuple) -> dict:
+    """Return {"full": png bytes, "zone": png bytes} for a raw logo upload."""
+    with metrics.stage("decode_logo"):
+        # Size-checked before decoding; JPEG decodes straight at a reduced scale
+        img, _ = image_guard.decode(logo_bytes, "RGBA", target=(LOGO_FULL_MAX, LOGO_FULL_MAX))
+        img.thumbnail((LOGO_FULL_MAX, LOGO_FULL_MAX), Image.LANCZOS)
+
+    with metrics.stage("key_logo_background"):
+        if _is_opaque(img):
+            img = _key_out_background(img)
+        bbox = img.getchannel("A").getbbox()
+        if bbox:
+            img = img.crop(bbox)
+
+    zone = Image.new("RGBA", zone_size, (0, 0, 0, 0))
+    fitted = ImageOps.contain(img, zone_size, Image.LANCZOS)
+    zone.paste(
+        fitted,
+        ((zone_size[0] - fitted.width) // 2, (zone_size[1] - fitted.height) // 2),
+    )
+    return {"full": _to_png_bytes(img), "zone": _to_png_bytes(zone)}
+
+
+def ingest_logo(phone: str, logo_bytes: bytes) -> dict:
+    """
+    Store the original and its derivatives. Returns the user-row updates
+    (logo_url plus the storage keys of each asset).
+    """
+    zone = logo_zone()
+    derivatives = normalize_logo(logo_bytes, (zone["w"], zone["h"]))
+
+    ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    original_key = f"logos/{phone}/{ts}_original"
+    logo_key = f"logos/{phone}/{ts}.png"
+    zone_key = f"logos/{phone}/{ts}_{zone['w']}x{zone['h']}.png"
+
+    db.upload_to_storage(original_key, logo_bytes, "application/octet-stream", wait=False)
+    db.upload_to_storage(zone_key, derivatives["zone"], "image/png")
+    logo_url = db.upload_to_storage(logo_key, derivatives["full"], "image/png")
+    logger.info(f"Stored logo for {phone}: {logo_key} (+ {zone['w']}x{zone['h']} zone asset)")
+
+    return {
+        "logo_url": logo_url,
+        "logo_original_key": original_key,
+        "logo_key": logo_key,
+        "logo_zone_key": zone_key,
+    }
+
+
+def load_zone_logo(user: dict) -> Image.Image | None:
+    """The user's pre-fitted logo_zone asset, or None if they have none."""
+    key = user.get("logo_zone_key")
+    if not key:
+        return None
+    img, _ = image_guard.decode(db.download_from_storage(key))
+    return img
+
+
+def composite_logo(canvas: Image.Image, logo: Image.Image, template: str = LOGO_TEMPLATE) -> Image.Image:
+    """Paste a pre-fitted zone logo onto a render in place; returns the canvas."""
+    zone = logo_zone(template)
+    if logo.size != (zone["w"], zone["h"]):
+        # Fitted for an older template version whose zone was another size
+        fitted = ImageOps.contain(logo, (zone["w"], zone["h"]), Image.LANCZOS)
+        logo = Image.new("RGBA", (zone["w"], zone["h"]), (0, 0, 0, 0))
+        logo.paste(fitted, ((logo.width - fitted.width) // 2, (logo.height - fitted.height) // 2))
+    canvas.paste(logo, (zone["x"], zone["y"]), logo)
+    return canvas
+
+
+# --- Helpers ---
+
+
+def _is_opaque(img: Image.Image) -> bool:
+    return img.getchannel("A").getextrema()[0] == 255
+
+
+def _key_out_background(img: Image.Image) -> Image.Image:
+    """Make a flat background (agreed on by all four corners) transparent."""
+    rgb = img.convert("RGB")
+    w, h = rgb.size
+    corners = [rgb.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    spread = max(max(c[i] for c in corners) - min(c[i] for c in corners) for i in range(3))
+    if spread > CORNER_AGREEMENT:
+        return img
+
+    background = tuple(sum(c[i] for c in corners) // 4 for i in range(3))
+    diff = ImageChops.difference(rgb, Image.new("RGB", rgb.size, background))
+    r, g, b = diff.split()
+    distance = ImageChops.lighter(ImageChops.lighter(r, g), b)
+    ramp = [
+        0 if d <= KEY_TOLERANCE
+        else 255 if d >= KEY_TOLERANCE + KEY_SOFTNESS
+        else (d - KEY_TOLERANCE) * 255 // KEY_SOFTNESS
+        for d in range(256)
+    ]
+    keyed = img.copy()
+    keyed.putalpha(ImageChops.multiply(img.getchannel("A"), distance.point(ramp)))
+    return keyed
+
+
+def _to_png_bytes(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
@@ -0,0 +1,232 @@
+"""
+Logging setup: structured lines written off the request thread.
+
+setup() puts a QueueHandler on the root logger. A QueueListener thread
+formats each record and writes it to stderr, so the request thread only
+builds the record and puts it on a queue. When the queue is full
+(LOG_QUEUE_SIZE) the record is dropped and counted; a request is never
+made to wait on log I/O.
+
+  format       LOG_FORMAT=json (default) writes one JSON object per line:
+               ts, level, logger, msg, cid, exc and any `extra=` fields.
+               LOG_FORMAT=text keeps the old human-readable line.
+  correlation  correlate() sets a correlation id (cid) for the current
+               context. Each webhook delivery and each payment gets one, so
+               all of a message's lines can be pulled out together.
+  sampling     DEBUG/INFO records are kept at LOG_SAMPLE_RATE. The decision
+               is made per correlation id, so a kept request keeps all of
+               its lines. WARNING and above are always written.
+  redaction    Configured secrets, bearer tokens, JWTs and key=value
+               credentials are masked on the listener thread before
+               anything is written.
+
+setup() is idempotent. A process forked after setup (gunicorn --preload)
+gets a fresh queue and listener thread of its own.
+
+    python -m bench.log_bench   # per-request logging cost, before/after
+
+Metrics: pichasafi_log_dropped_total, pichasafi_log_sampled_out_total.
+"""
+from __future__ import annotations
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.config import Config
+from app import metrics
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s [%(cid)s]: %(message)s"
+REDACTED = "[REDACTED]"
+SECRET_SETTINGS = (
+    "WHATSAPP_ACCESS_TOKEN",
+    "WHATSAPP_VERIFY_TOKEN",
+    "WHATSAPP_APP_SECRET",
+    "SUPABASE_KEY",
+    "SUPABASE_SERVICE_KEY",
+    "PAYMENT_WEBHOOK_SECRET",
+)
+SECRET_PATTERNS = (
+    (re.compile(r"(?i)\b(bearer\s+)[\w.~+/=-]+"), r"\1" + REDACTED),
+    (re.compile(r"\beyJ[\w-]{8,}\.[\w-]{8,}\.[\w-]+"), REDACTED),
+    (
+        re.compile(r"(?i)\b(access_token|api_?key|apikey|secret|password|token|signature)(\s*[=:]\s*)[^\s,&'\"]+"),
+        r"\1\2" + REDACTED,
+    ),
+)
+# LogRecord attributes that are not `extra=` fields
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "cid"}
+
+_cid: ContextVar[str | None] = ContextVar("log_correlation_id", default=None)
+_handler: "_QueueHandler" = None
+_listener: logging.handlers.QueueListener = None
+_setup_lock = threading.Lock()
+
+
+# --- Correlation ids ---
+
+
+def correlation_id() -> str | None:
+    return _cid.get()
+
+
+@contextmanager
+def correlate(cid: str = None):
+    """Tag every record logged in this context (and tasks/threads that copy it) with `cid`."""
+    token = _cid.set(cid or uuid.uuid4().hex[:12])
+    try:
+        yield _cid.get()
+    finally:
+        _cid.reset(token)
+
+
+# --- Redaction ---
+
+
+def _secret_values() -> list[str]:
+    values = [getattr(Config, name, "") for name in SECRET_SETTINGS]
+    # Longest first so a secret containing another is masked whole
+    return sorted({v for v in values if v and len(v) >= 8}, key=len, reverse=True)
+
+
+def redact(text: str, secrets: list[str] = None) -> str:
+    """Mask credentials in a log line."""
+    for value in _secret_values() if secrets is None else secrets:
+        if value in text:
+            text = text.replace(value, REDACTED)
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+# --- Handlers and formatters ---
+
+
+def _sampled_in(cid: str | None, rate: float) -> bool:
+    if cid is None:
+        return random.random() < rate
+    return zlib.crc32(cid.encode()) % 10_000 < rate * 10_000
+
+
+class ContextFilter(logging.Filter):
+    """Runs on the caller's thread: stamps the correlation id and samples DEBUG/INFO."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.cid = _cid.get()
+        rate = Config.LOG_SAMPLE_RATE
+        if record.levelno < logging.WARNING and rate < 1.0 and not _sampled_in(record.cid, rate):
+            metrics.inc("pichasafi_log_sampled_out_total")
+            return False
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and leaves formatting to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now (they may change after we return); the
+        # traceback has to be rendered here, while its frames exist
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("pichasafi_log_dropped_total")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, credentials masked."""
+
+    def __init__(self):
+        super().__init__()
+        self._secrets = _secret_values()
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage(), self._secrets),
+        }
+        cid = getattr(record, "cid", None)
+        if cid:
+            entry["cid"] = cid
+        exc = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if exc:
+            entry["exc"] = redact(exc, self._secrets)
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The plain line format, with the correlation id and credentials masked."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+        self._secrets = _secret_values()
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "cid"):
+            record.cid = None
+        return redact(super().format(record), self._secrets)
+
+
+# --- Setup ---
+
+
+def _start_listener(stream) -> None:
+    global _listener
+    _handler.queue = queue.Queue(Config.LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else TextFormatter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+def setup(level: str = None, stream=None) -> None:
+    """Route all logging through the queue. Safe to call more than once."""
+    global _handler
+    with _setup_lock:
+        root = logging.getLogger()
+        root.setLevel((level or Config.LOG_LEVEL).upper())
+        if _handler is not None:
+            return
+        # Drop plain stderr handlers (basicConfig's); leave test/capture handlers alone
+        for handler in list(root.handlers):
+            if type(handler) is logging.StreamHandler:
+                root.removeHandler(handler)
+
+        stream = stream or sys.stderr
+        _handler = _QueueHandler(None)  # queue set by _start_listener
+        _handler.addFilter(ContextFilter())
+        _start_listener(stream)
+        root.addHandler(_handler)
+        atexit.register(shutdown)
+        # The listener thread doesn't survive fork(); the child starts its own
+        os.register_at_fork(after_in_child=lambda: _start_listener(stream))
+
+
+def shutdown() -> None:
+    """Write out whatever is still queued."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
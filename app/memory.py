@@ -0,0 +1,135 @@
+"""
+Per-process memory breakdown for the gunicorn master and its workers.
+
+Reads /proc/<pid>/smaps_rollup (Linux 4.14+):
+  unique  Private_Clean + Private_Dirty — pages only this process holds
+          (what killing it would free)
+  shared  Shared_Clean + Shared_Dirty — pages also mapped by another
+          process (the preloaded, copy-on-write assets)
+  pss     proportional set size; summed over processes it is the real total
+`flask --app run memory-report --pid <master pid>` prints the table.
+
+track_peak() measures the peak RSS of the current process around a
+block (the image render): VmHWM from /proc/self/status, reset through
+/proc/self/clear_refs when no other tracked block is running.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_rollup(pid: int) -> dict:
+    """Selected smaps_rollup fields for a pid, in kB."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in FIELDS:
+                values[name] = int(rest.split()[0])
+    return values
+
+
+def child_pids(pid: int) -> list[int]:
+    """Direct children of pid (gunicorn workers of a master)."""
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+        except OSError:
+            continue
+    return sorted(children)
+
+
+def process_memory(pid: int) -> dict:
+    """{"pid", "rss_kb", "pss_kb", "unique_kb", "shared_kb"} for one process."""
+    rollup = read_rollup(pid)
+    return {
+        "pid": pid,
+        "rss_kb": rollup.get("Rss", 0),
+        "pss_kb": rollup.get("Pss", 0),
+        "unique_kb": rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0),
+        "shared_kb": rollup.get("Shared_Clean", 0) + rollup.get("Shared_Dirty", 0),
+    }
+
+
+def report(master_pid: int = None) -> dict:
+    """
+    Memory of the master and every worker. Returns
+    {"master": {...}, "workers": [{...}, ...], "total_pss_kb": int}.
+    Processes that exit while being read are skipped.
+    """
+    master_pid = master_pid or os.getpid()
+    master = process_memory(master_pid)
+    workers = []
+    for pid in child_pids(master_pid):
+        try:
+            workers.append(process_memory(pid))
+        except OSError:
+            continue
+    total = master["pss_kb"] + sum(w["pss_kb"] for w in workers)
+    return {"master": master, "workers": workers, "total_pss_kb": total}
+
+
+def format_report(result: dict) -> str:
+    lines = [f"{'':<8}{'pid':>8}{'rss MB':>10}{'pss MB':>10}{'unique MB':>11}{'shared MB':>11}"]
+    rows = [("master", result["master"])] + [("worker", w) for w in result["workers"]]
+    for role, row in rows:
+        lines.append(
+            f"{role:<8}{row['pid']:>8}{row['rss_kb'] / 1024:>10.1f}{row['pss_kb'] / 1024:>10.1f}"
+            f"{row['unique_kb'] / 1024:>11.1f}{row['shared_kb'] / 1024:>11.1f}"
+        )
+    lines.append(f"Total PSS: {result['total_pss_kb'] / 1024:.1f} MB")
+    return "\n".join(lines)
+
+
+_active = 0
+_active_lock = threading.Lock()
+
+
+def _status_kb(field: str) -> int | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # resets VmHWM to the current RSS
+    except OSError:
+        pass
+
+
+@contextmanager
+def track_peak():
+    """
+    Yields a dict that gets {"start_kb", "peak_kb", "growth_kb"} on exit
+    (empty where /proc is unavailable). The high-water mark is per
+    process, so when tracked blocks overlap in threads each one reports
+    the peak of all of them: an upper bound.
+    """
+    global _active
+    result = {}
+    with _active_lock:
+        if _active == 0:
+            _reset_peak()
+        _active += 1
+    start = _status_kb("VmRSS")
+    try:
+        yield result
+    finally:
+        peak = _status_kb("VmHWM")
+        with _active_lock:
+            _active -= 1
+        if start is not None and peak is not None:
+            result.update(start_kb=start, peak_kb=peak, growth_kb=max(0, peak - start))
@@ -1,11 +1,26 @@
 from __future__ import annotations
 
 import logging
+import threading
 import requests
 from app.config import Config
+from app import rate_limit
+from app.rate_limit import PRIORITY_NOTICE, PRIORITY_REPLY, PRIORITY_RESULT
 
 logger = logging.getLogger(__name__)
 
+_session: requests.Session = None
+
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+def get_session() -> requests.Session:
+    """Lazy shared Session so Graph API calls reuse pooled keep-alive connections."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
 
 def _get_headers() -> dict:
     """Build auth headers lazily so token is read at call time, not import time."""
@@ -15,31 +30,65 @@ def _get_headers() -> dict:
     }
 
 
-def _send(payload: dict) -> dict:
-    """Send a message via WhatsApp Cloud API."""
+def _post(payload: dict) -> requests.Response:
+    return get_session().post(
+        Config.WHATSAPP_API_URL,
+        headers=_get_headers(),
+        json=payload,
+        timeout=30,
+    )
+
+
+def _send(payload: dict, priority: int = PRIORITY_REPLY) -> dict:
+    """
+    Send a message via WhatsApp Cloud API, within the shared rate limit.
+    Throttled and retryable failures go to the retry queue (except notices,
+    which are useless late, and bulk sends, which the broadcaster retries
+    itself) and come back as {"error": ..., "status": ..., "queued": True}.
+    """
+    limiter = rate_limit.get_limiter() if rate_limit.enabled() else None
+    retry = priority < PRIORITY_NOTICE
+    if limiter and not limiter.acquire(priority, timeout=rate_limit.wait_for(priority)):
+        logger.warning("WhatsApp send throttled locally" + ("; queued for retry" if retry else ""))
+        if retry:
+            limiter.enqueue(payload, priority)
+        return {"error": "rate limited", "queued": retry}
+
     try:
-        response = requests.post(
-            Config.WHATSAPP_API_URL,
-            headers=_get_headers(),
-            json=payload,
-            timeout=30,
-        )
+        response = _post(payload)
+        if limiter:
+            limiter.record(response.status_code)
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
         logger.error(f"WhatsApp API error: {e}")
-        return {"error": str(e)}
+        status = e.response.status_code if e.response is not None else None
+        queued = bool(limiter and retry and rate_limit.is_retryable(status))
+        if queued:
+            limiter.enqueue(payload, priority, attempts=1)
+        return {"error": str(e), "status": status, "queued": queued}
+
+
+def resend_queued(payload: dict) -> str:
+    """Retry-queue sender: post once (token already taken). Returns ok | retry | fail."""
+    try:
+        response = _post(payload)
+    except requests.RequestException as e:
+        logger.warning(f"WhatsApp retry failed: {e}")
+        return "retry"
+    return rate_limit.get_limiter().record(response.status_code)
 
 
-def send_text(to: str, message: str) -> dict:
-    """Send a plain text message."""
+def send_text(to: str, message: str, priority: int = PRIORITY_REPLY) -> dict:
+    """Send a plain text message (priority PRIORITY_NOTICE for progress notices)."""
     return _send(
         {
             "messaging_product": "whatsapp",
             "to": to,
             "type": "text",
             "text": {"body": message},
-        }
+        },
+        priority,
     )
 
 
@@ -53,7 +102,7 @@ def send_image(to: str, image_url: str, caption: str = "") -> dict:
     }
     if caption:
         payload["image"]["caption"] = caption
-    return _send(payload)
+    return _send(payload, PRIORITY_RESULT)
 
 
 def send_buttons(to: str, body_text: str, buttons: list[dict]) -> dict:
@@ -105,25 +154,42 @@ def mark_as_read(message_id: str) -> dict:
             "messaging_product": "whatsapp",
             "status": "read",
             "message_id": message_id,
-        }
+        },
+        PRIORITY_NOTICE,
     )
 
 
-def download_media(media_id: str) -> bytes:
+def download_media(media_id: str, cancel: threading.Event = None) -> bytes:
     """
     Download media from WhatsApp. Two-step process:
     1. GET media URL from media_id
     2. GET the actual binary from that URL
+    With `cancel` (see prefetch), stops between steps and body chunks once
+    it is set and raises prefetch.DownloadCancelled.
     """
     auth_headers = {"Authorization": f"Bearer {Config.WHATSAPP_ACCESS_TOKEN}"}
 
     # Step 1: Get the download URL
     url = f"{Config.WHATSAPP_MEDIA_URL}/{media_id}"
-    resp = requests.get(url, headers=auth_headers, timeout=15)
+    resp = get_session().get(url, headers=auth_headers, timeout=15)
     resp.raise_for_status()
     media_url = resp.json().get("url")
 
     # Step 2: Download the actual file
-    media_resp = requests.get(media_url, headers=auth_headers, timeout=60)
-    media_resp.raise_for_status()
-    return media_resp.content
+    if cancel is None:
+        media_resp = get_session().get(media_url, headers=auth_headers, timeout=60)
+        media_resp.raise_for_status()
+        return media_resp.content
+
+    from app.prefetch import DownloadCancelled
+
+    if cancel.is_set():
+        raise DownloadCancelled(media_id)
+    with get_session().get(media_url, headers=auth_headers, timeout=60, stream=True) as media_resp:
+        media_resp.raise_for_status()
+        chunks = []
+        for chunk in media_resp.iter_content(MEDIA_CHUNK_SIZE):
+            if cancel.is_set():
+                raise DownloadCancelled(media_id)
+            chunks.append(chunk)
+    return b"".join(chunks)
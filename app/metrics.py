@@ -0,0 +1,295 @@
+"""
+Lightweight stage timing and Prometheus-style metrics.
+
+    with metrics.stage("download_media"):
+        image_bytes = messenger.download_media(media_id)
+
+Each worker keeps counters, gauges and fixed-bucket histograms in
+memory and periodically snapshots them to METRICS_DIR/<pid>.json.
+/metrics merges every worker's snapshot, so any worker can answer a
+scrape for the whole gunicorn pool. With METRICS_ENABLED unset, stage()
+hands back a shared no-op context manager and the recording functions
+return immediately.
+"""
+from __future__ import annotations
+
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Covers a fast text reply through a slow cold render.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_METRIC = "pichasafi_stage_seconds"
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_gauges: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}  # key -> [bucket_counts..., sum, count]
+_buckets: dict[str, tuple] = {}
+_last_flush = 0.0
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("pichasafi_trace", default=None)
+
+
+def enabled() -> bool:
+    return Config.METRICS_ENABLED
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    """Increment a counter."""
+    if not Config.METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to an absolute value (last writer per worker wins)."""
+    if not Config.METRICS_ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels) -> None:
+    """Record one sample into a histogram."""
+    if not Config.METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _buckets.setdefault(name, buckets)
+        bounds = _buckets[name]
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(bounds) + 2)
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                hist[i] += 1
+                break
+        hist[-2] += value
+        hist[-1] += 1
+
+
+class _Stage:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        observe(STAGE_METRIC, elapsed, stage=self.name, **self.labels)
+        if exc_type is not None:
+            inc("pichasafi_stage_errors_total", stage=self.name, **self.labels)
+        trace = _trace.get()
+        if trace is not None:
+            trace[self.name] = trace.get(self.name, 0.0) + elapsed
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, **labels):
+    """Context manager timing one pipeline stage into the stage histogram."""
+    if not Config.METRICS_ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, labels)
+
+
+# --- Per-message traces ---
+
+
+def begin_trace():
+    """Start collecting stage timings for the current message. Returns a token."""
+    if not Config.METRICS_ENABLED:
+        return None
+    return _trace.set({})
+
+
+def end_trace(token) -> dict:
+    """Stop the current trace and return {stage: seconds}."""
+    if token is None:
+        return {}
+    trace = _trace.get() or {}
+    _trace.reset(token)
+    return trace
+
+
+def current_trace() -> dict:
+    """Stage timings recorded so far in the current trace ({} outside one)."""
+    return dict(_trace.get() or {})
+
+
+def format_trace(trace: dict) -> str:
+    """'download_media=812ms enhance_image=95ms ...' for log lines."""
+    return " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in trace.items())
+
+
+# --- Cross-worker aggregation ---
+
+
+def _snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": [[n, list(l), v] for (n, l), v in _counters.items()],
+            "gauges": [[n, list(l), v] for (n, l), v in _gauges.items()],
+            "histograms": [[n, list(l), list(h)] for (n, l), h in _histograms.items()],
+            "buckets": {n: list(b) for n, b in _buckets.items()},
+        }
+
+
+def _snapshot_path(pid: int = None) -> str:
+    return os.path.join(Config.METRICS_DIR, f"{pid or os.getpid()}.json")
+
+
+def flush(force: bool = False) -> None:
+    """
+    Write this worker's snapshot for other workers to merge. Throttled to
+    once per METRICS_FLUSH_INTERVAL unless forced; called after each request.
+    """
+    global _last_flush
+    if not Config.METRICS_ENABLED:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < Config.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    try:
+        os.makedirs(Config.METRICS_DIR, exist_ok=True)
+        path = _snapshot_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics snapshot: {e}")
+
+
+atexit.register(flush, True)
+
+
+def _pid_alive(path: str) -> bool:
+    try:
+        os.kill(int(os.path.basename(path).split(".")[0]), 0)
+        return True
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+
+
+def _merged() -> tuple[dict, dict, dict, dict]:
+    """Sum counters/histograms across worker snapshots; gauges are summed too."""
+    counters: dict[tuple, float] = {}
+    gauges: dict[tuple, float] = {}
+    histograms: dict[tuple, list] = {}
+    buckets: dict[str, tuple] = {}
+
+    own = _snapshot_path()
+    snapshots = [(_snapshot(), True)]
+    for path in glob.glob(os.path.join(Config.METRICS_DIR, "*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append((json.load(f), _pid_alive(path)))
+        except (OSError, ValueError):
+            continue
+
+    for snap, alive in snapshots:
+        for name, bounds in snap["buckets"].items():
+            buckets.setdefault(name, tuple(bounds))
+        for name, labels, value in snap["counters"]:
+            key = (name, tuple(tuple(p) for p in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        # Counters/histograms of exited workers still count; their gauges don't
+        for name, labels, value in snap["gauges"] if alive else ():
+            key = (name, tuple(tuple(p) for p in labels))
+            gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, hist in snap["histograms"]:
+            key = (name, tuple(tuple(p) for p in labels))
+            current = histograms.get(key)
+            if current is None:
+                histograms[key] = list(hist)
+            else:
+                histograms[key] = [a + b for a, b in zip(current, hist)]
+    return counters, gauges, histograms, buckets
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """Prometheus text exposition (0.0.4) of all workers' merged metrics."""
+    counters, gauges, histograms, buckets = _merged()
+    lines = []
+    typed = set()
+
+    def header(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+    for (name, labels), hist in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(buckets.get(name, DEFAULT_BUCKETS), hist):
+            cumulative += count
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', f'{bound:g}'),))} {cumulative}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {hist[-1]}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {hist[-2]:g}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {hist[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Drop this worker's in-memory metrics (tests)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _buckets.clear()
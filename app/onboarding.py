@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime, timezone
+from app import brand_kit
 from app import database as db
 from app import messenger
 
@@ -93,16 +93,20 @@ def handle_onboarding(
 
     if step == "logo":
         if message_type == "image" and media_id:
+            # PIL loads only when someone actually sends a logo
+            from app import image_guard
+            from app import logo_processor
+
             try:
                 logo_bytes = messenger.download_media(media_id)
-                ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-                filename = f"logos/{phone}_{ts}.jpg"
-                logo_url = db.upload_to_storage(filename, logo_bytes)
+                logo_fields = logo_processor.ingest_logo(phone, logo_bytes)
                 db.update_user(phone, {
-                    "logo_url": logo_url,
+                    **logo_fields,
                     "onboarding_step": "location",
                 })
                 messenger.send_text(phone, f"Logo saved!\n\n{ASK_LOCATION}")
+            except image_guard.ImageTooLarge:
+                messenger.send_text(phone, image_guard.IMAGE_TOO_LARGE_MESSAGE)
             except Exception as e:
                 logger.error(f"Logo upload failed for {phone}: {e}")
                 messenger.send_text(
@@ -149,8 +153,9 @@ def handle_onboarding(
                 phone, "Please reply with a number (1-5) or a hex code (e.g., #FF6B00)."
             )
             return
+        # The derived palette is computed once here, not on every render
         db.update_user(phone, {
-            "brand_color_primary": color,
+            **brand_kit.update_for(user, brand_color_primary=color),
             "onboarding_step": "style",
         })
         messenger.send_text(phone, f"Brand color set to {color}\n\n{ASK_STYLE}")
@@ -0,0 +1,423 @@
+"""
+Mobile-money payment callbacks: verify, queue and acknowledge, then apply.
+
+Providers retry a callback until they get a 2xx, often within seconds,
+so POST /payments/callback only does what has to happen before the
+answer:
+
+  verify  HMAC-SHA256 of the raw body with PAYMENT_WEBHOOK_SECRET, hex,
+          in X-Payment-Signature (a "sha256=" prefix is accepted)
+  parse   the callback body (below); malformed callbacks get a 400
+  queue   one row per transaction_ref in a local SQLite queue
+          (PAYMENT_QUEUE_DB), so a retry of a callback this host already
+          holds is answered "duplicate" straight away
+
+and answers 202. A worker thread then applies each payment: it inserts
+the transactions row (idx_transactions_ref is unique, so a callback
+delivered to two hosts is recorded once) and skips it if the row is no
+longer pending. It fixes the period bought in the row's period_end (set
+once, so a retried apply never extends a subscription twice), upgrades
+the user's tier, limit and expiry, marks the row completed and tells
+the merchant on WhatsApp. Apply errors are retried with backoff up to
+PAYMENT_MAX_ATTEMPTS; after that the row stays in the queue marked dead.
+PAYMENT_WORKERS threads per process apply payments in parallel, but a
+merchant's own payments are applied one at a time, oldest first.
+
+Callback body:
+
+    {"transaction_ref": "MP240501.1234.A56789", "phone": "255712345678",
+     "amount": 35000, "currency": "TZS", "status": "success",
+     "plan": "pro", "provider": "mpesa"}
+
+"plan" is optional (the plan priced at "amount" is used); any status
+other than "success" is a failed payment.
+
+Metrics: pichasafi_payment_callbacks_total{result}, pichasafi_payments_applied_total{outcome},
+pichasafi_payment_queue_depth, pichasafi_payment_apply_seconds.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, jsonify, request
+from app.config import Config
+from app import billing
+from app import database as db
+from app import logs
+from app import messenger
+from app import metrics
+from app import signatures
+
+logger = logging.getLogger(__name__)
+payments_bp = Blueprint("payments", __name__)
+
+SIGNATURE_HEADER = "X-Payment-Signature"
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+LEASE = 60.0  # a claimed payment is re-offered if its worker dies
+POLL_INTERVAL = 0.5
+APPLY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PAYMENT_RECEIVED_MESSAGE = (
+    "Payment received, asante! (ref {ref})\n\n"
+    "You're on *{plan}*: {allowance} until {until}.\n"
+    "Send a product photo to get started."
+)
+PAYMENT_FAILED_MESSAGE = (
+    "Your payment of {currency} {amount:,.0f} (ref {ref}) didn't go through.\n"
+    "Please try again, or type *help*."
+)
+PAYMENT_UNMATCHED_MESSAGE = (
+    "We received {currency} {amount:,.0f} (ref {ref}), but it doesn't match a plan.\n"
+    "We'll sort it out and get back to you."
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payment_queue (
+    transaction_ref TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL,
+    leased_until REAL NOT NULL DEFAULT 0,
+    dead INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payment_due ON payment_queue(dead, not_before);
+CREATE INDEX IF NOT EXISTS idx_payment_phone ON payment_queue(phone);
+"""
+
+# Oldest live payment per phone, and only for phones with nothing in
+# flight: a merchant's payments apply one at a time, in order, so two
+# renewals can't both extend from the same expiry
+CLAIM_SQL = """
+SELECT transaction_ref, payload, attempts FROM payment_queue AS q
+WHERE dead = 0 AND not_before <= :now AND leased_until <= :now
+  AND rowid = (SELECT MIN(rowid) FROM payment_queue AS p WHERE p.phone = q.phone AND p.dead = 0)
+  AND phone NOT IN (SELECT phone FROM payment_queue WHERE leased_until > :now)
+ORDER BY rowid LIMIT :limit
+"""
+
+_queue: "PaymentQueue" = None
+_queue_lock = threading.Lock()
+
+
+class PaymentQueue:
+    """Durable, cross-process queue of verified callbacks, keyed by transaction_ref."""
+
+    def __init__(self, path: str, max_attempts: int, workers: int = 1):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.workers = workers
+        self._local = threading.local()
+        self._workers: list[threading.Thread] = []
+        self._workers_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def enqueue(self, event: dict) -> bool:
+        """Queue a callback. False if this transaction_ref is already queued."""
+        now = time.time()
+        with self._transaction() as conn:
+            added = conn.execute(
+                "INSERT OR IGNORE INTO payment_queue (transaction_ref, phone, payload, not_before, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (event["transaction_ref"], event["phone"], json.dumps(event), now, now),
+            ).rowcount
+        metrics.set_gauge("pichasafi_payment_queue_depth", self.depth())
+        self.ensure_workers()
+        return bool(added)
+
+    def claim_due(self, limit: int = 10) -> list[tuple[str, dict, int]]:
+        """Lease due payments, oldest first: [(transaction_ref, event, attempts)]."""
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(CLAIM_SQL, {"now": now, "limit": limit}).fetchall()
+            conn.executemany(
+                "UPDATE payment_queue SET leased_until = ? WHERE transaction_ref = ?",
+                [(now + LEASE, row[0]) for row in rows],
+            )
+        return [(ref, json.loads(payload), attempts) for ref, payload, attempts in rows]
+
+    def complete(self, ref: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM payment_queue WHERE transaction_ref = ?", (ref,))
+
+    def reschedule(self, ref: str, attempts: int) -> bool:
+        """Back off a failed apply. Returns False (and marks it dead) when out of attempts."""
+        with self._transaction() as conn:
+            if attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE payment_queue SET attempts = ?, dead = 1, leased_until = 0 "
+                    "WHERE transaction_ref = ?",
+                    (attempts, ref),
+                )
+                return False
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+            conn.execute(
+                "UPDATE payment_queue SET attempts = ?, not_before = ?, leased_until = 0 "
+                "WHERE transaction_ref = ?",
+                (attempts, time.time() + delay, ref),
+            )
+        return True
+
+    def depth(self) -> int:
+        (depth,) = self._conn().execute(
+            "SELECT COUNT(*) FROM payment_queue WHERE dead = 0"
+        ).fetchone()
+        return depth
+
+    def dead(self) -> list[dict]:
+        """Payments that ran out of attempts, for manual follow-up."""
+        rows = self._conn().execute(
+            "SELECT payload FROM payment_queue WHERE dead = 1 ORDER BY created"
+        ).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def process_once(self, apply=None, limit: int = 10) -> int:
+        """Apply due payments with `apply(event) -> outcome`. Returns how many were settled."""
+        apply = apply or apply_payment
+        settled = 0
+        for ref, event, attempts in self.claim_due(limit):
+            with logs.correlate(ref):
+                settled += self._apply_one(apply, ref, event, attempts)
+        metrics.set_gauge("pichasafi_payment_queue_depth", self.depth())
+        return settled
+
+    def _apply_one(self, apply, ref: str, event: dict, attempts: int) -> int:
+        started = time.perf_counter()
+        try:
+            outcome = apply(event)
+        except Exception as e:
+            metrics.inc("pichasafi_payments_applied_total", outcome="error")
+            if self.reschedule(ref, attempts + 1):
+                logger.warning(f"Payment {ref} apply failed (attempt {attempts + 1}): {e}")
+            else:
+                logger.error(f"Payment {ref} dead after {attempts + 1} attempts: {e}", exc_info=True)
+            return 0
+        self.complete(ref)
+        metrics.inc("pichasafi_payments_applied_total", outcome=outcome)
+        metrics.observe(
+            "pichasafi_payment_apply_seconds", time.perf_counter() - started, buckets=APPLY_BUCKETS
+        )
+        logger.info(f"Payment {ref}: {outcome}")
+        return 1
+
+    def ensure_workers(self) -> None:
+        """Top the worker threads back up to `workers` (they exit once the queue is empty)."""
+        with self._workers_lock:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            for _ in range(self.workers - len(self._workers)):
+                worker = threading.Thread(target=self._run, name="payment-worker", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    # --- Internals ---
+
+    def _run(self) -> None:
+        while True:
+            try:
+                # One at a time, so the workers share a burst evenly
+                if self.process_once(limit=1):
+                    continue
+                if self.depth() == 0:
+                    return
+            except Exception as e:
+                logger.error(f"Payment worker error: {e}", exc_info=True)
+            # Nothing due: the rest is backing off or leased to another worker
+            time.sleep(POLL_INTERVAL)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # an acknowledged payment must survive a crash
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def enabled() -> bool:
+    """Callbacks are only accepted once a signing secret is configured."""
+    return bool(Config.PAYMENT_WEBHOOK_SECRET)
+
+
+def get_queue() -> PaymentQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = PaymentQueue(
+                    Config.PAYMENT_QUEUE_DB, Config.PAYMENT_MAX_ATTEMPTS, Config.PAYMENT_WORKERS
+                )
+    return _queue
+
+
+def start() -> None:
+    """Resume payments left queued by a previous process (worker startup)."""
+    if enabled() and get_queue().depth():
+        get_queue().ensure_workers()
+
+
+# --- Callback ---
+
+
+@payments_bp.route("/payments/callback", methods=["POST"])
+def callback():
+    status, body = accept(request.get_data(), request.headers.get(SIGNATURE_HEADER))
+    return jsonify(body), status
+
+
+def accept(raw_body: bytes, signature: str | None) -> tuple[int, dict]:
+    """Verify and queue one callback. Returns (HTTP status, response body)."""
+    if not enabled():
+        metrics.inc("pichasafi_payment_callbacks_total", result="disabled")
+        return 503, {"error": "payments not configured"}
+    if not verify_signature(raw_body, signature):
+        metrics.inc("pichasafi_payment_callbacks_total", result="bad_signature")
+        logger.warning("Payment callback with a bad signature")
+        return 401, {"error": "invalid signature"}
+    try:
+        event = parse_callback(raw_body)
+    except ValueError as e:
+        metrics.inc("pichasafi_payment_callbacks_total", result="invalid")
+        logger.warning(f"Invalid payment callback: {e}")
+        return 400, {"error": str(e)}
+
+    if not get_queue().enqueue(event):
+        metrics.inc("pichasafi_payment_callbacks_total", result="duplicate")
+        return 200, {"status": "duplicate"}
+    metrics.inc("pichasafi_payment_callbacks_total", result="queued")
+    return 202, {"status": "queued"}
+
+
+def verify_signature(raw_body: bytes, signature: str | None) -> bool:
+    return signatures.valid(Config.PAYMENT_WEBHOOK_SECRET, raw_body, signature)
+
+
+def parse_callback(raw_body: bytes) -> dict:
+    """Normalize a callback body. Raises ValueError when it can't be used."""
+    try:
+        data = json.loads(raw_body)
+    except ValueError:
+        raise ValueError("body is not JSON")
+    if not isinstance(data, dict):
+        raise ValueError("body is not an object")
+
+    ref = str(data.get("transaction_ref") or "").strip()
+    phone = "".join(ch for ch in str(data.get("phone") or "") if ch.isdigit())
+    if not ref or not phone:
+        raise ValueError("transaction_ref and phone are required")
+    try:
+        amount = float(data.get("amount"))
+    except (TypeError, ValueError):
+        raise ValueError("amount must be a number")
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("amount must be positive")
+    plan = data.get("plan")
+    if plan is not None and not isinstance(plan, str):
+        raise ValueError("plan must be a string")
+
+    return {
+        "transaction_ref": ref,
+        "phone": phone,
+        "amount": amount,
+        "currency": str(data.get("currency") or billing.PLAN_CURRENCY).upper(),
+        "status": str(data.get("status") or "").strip().lower(),
+        "plan": plan,
+        "provider": str(data.get("provider") or "mobile_money"),
+    }
+
+
+# --- Apply ---
+
+
+def apply_payment(event: dict) -> str:
+    """
+    Record one payment and apply it to the user. Safe to run more than
+    once per transaction_ref. Returns the outcome (completed, failed,
+    rejected, duplicate); raises on errors worth retrying.
+    """
+    ref, phone = event["transaction_ref"], event["phone"]
+    user = db.get_user_by_phone(phone)
+    plan = None
+    if event["currency"] == billing.PLAN_CURRENCY:
+        plan = billing.plan_for_payment(event["amount"], event.get("plan"))
+
+    tx = db.insert_transaction({
+        "transaction_ref": ref,
+        "user_id": user["id"] if user else None,
+        "amount": event["amount"],
+        "payment_method": event["provider"],
+        "transaction_type": "subscription",
+        "plan": plan,
+        "status": "pending",
+    }) or db.get_transaction(ref)
+    if tx is None:
+        raise RuntimeError(f"transaction {ref} not found after insert")
+    if tx["status"] != "pending":
+        return "duplicate"
+
+    details = {"ref": ref, "amount": event["amount"], "currency": event["currency"]}
+    if user is None:
+        db.update_transaction(ref, {"status": "rejected"})
+        logger.warning(f"Payment {ref} from unknown number {phone}")
+        return "rejected"
+    if event["status"] != "success":
+        db.update_transaction(ref, {"status": "failed"})
+        messenger.send_text(phone, PAYMENT_FAILED_MESSAGE.format(**details))
+        return "failed"
+    if plan is None:
+        db.update_transaction(ref, {"status": "rejected"})
+        messenger.send_text(phone, PAYMENT_UNMATCHED_MESSAGE.format(**details))
+        return "rejected"
+
+    period_end = tx.get("period_end")
+    if not period_end:
+        # First writer wins, so every apply of this ref uses the same end
+        tx = db.update_transaction(
+            ref, {"period_end": _period_end(user).isoformat()}, only_if_null="period_end"
+        ) or db.get_transaction(ref)
+        period_end = tx["period_end"]
+    limit = billing.PLANS[plan]["monthly_limit"]
+    db.update_user(phone, {
+        "subscription_tier": plan,
+        "monthly_limit": limit,
+        "subscription_expires_at": period_end,
+    })
+    db.update_transaction(ref, {"status": "completed"})
+
+    allowance = "unlimited images" if limit >= billing.UNLIMITED else f"{limit} images a month"
+    until = datetime.fromisoformat(period_end).strftime("%d %b %Y")
+    messenger.send_text(
+        phone, PAYMENT_RECEIVED_MESSAGE.format(ref=ref, plan=plan.title(), allowance=allowance, until=until)
+    )
+    return "completed"
+
+
+def _period_end(user: dict) -> datetime:
+    """End of the period a payment made now buys: renewals extend an unexpired plan."""
+    start = datetime.now(timezone.utc)
+    current = user.get("subscription_expires_at")
+    if current and user.get("subscription_tier") != "free":
+        start = max(start, datetime.fromisoformat(current))
+    return start + timedelta(days=billing.PLAN_PERIOD_DAYS)
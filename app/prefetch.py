@@ -0,0 +1,163 @@
+"""
+Speculative media download for image messages.
+
+An image message used to go mark_as_read -> get_user_by_phone ->
+check_usage -> "Processing..." -> download_media, all in series. The
+media lookup and download only need the media id, so handle_message
+starts them as soon as the message is parsed and routing runs
+alongside. If routing decides not to render (over the limit, still
+onboarding, an error), the download is cancelled and its bytes dropped.
+
+  start(...)        sync servers: runs on a small thread pool; the cancel
+                    Event is checked between the two Graph calls and
+                    between body chunks
+  start_async(...)  ASGI: an asyncio task, cancelled with task.cancel()
+
+Both return an object with result() (awaitable for the async one) and
+cancel(). Set PREFETCH_MEDIA=false to download after routing as before.
+
+Metrics: pichasafi_prefetch_total{outcome=used|discarded|failed} and
+pichasafi_prefetch_saved_seconds, the part of the download that
+overlapped routing (latency taken off the reply path).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+
+
+class DownloadCancelled(Exception):
+    """Raised inside a prefetch whose result is no longer wanted."""
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=Config.PREFETCH_THREADS, thread_name_prefix="prefetch"
+                )
+    return _executor
+
+
+class _Timing:
+    """Shared bookkeeping: when the download started and finished."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: float = None
+        self.settled = False
+
+    def used(self, asked: float) -> None:
+        """Record the overlap with routing; `asked` is when the consumer started waiting."""
+        done = self.finished if self.finished is not None else asked
+        self.settled = True
+        metrics.inc("pichasafi_prefetch_total", outcome="used")
+        metrics.observe("pichasafi_prefetch_saved_seconds", min(asked, done) - self.started)
+
+    def discarded(self) -> None:
+        if not self.settled:
+            self.settled = True
+            metrics.inc("pichasafi_prefetch_total", outcome="discarded")
+
+    def failed(self) -> None:
+        self.settled = True
+        metrics.inc("pichasafi_prefetch_total", outcome="failed")
+
+
+class MediaPrefetch:
+    """A download_media call running on the prefetch pool."""
+
+    def __init__(self, media_id: str, download):
+        self.media_id = media_id
+        self.cancelled = threading.Event()
+        self._timing = _Timing()
+        self._future: Future = _get_executor().submit(self._run, download, media_id)
+
+    def _run(self, download, media_id: str) -> bytes:
+        try:
+            return download(media_id, cancel=self.cancelled)
+        finally:
+            self._timing.finished = time.perf_counter()
+
+    def result(self) -> bytes:
+        """The downloaded bytes (waits for the rest of the download; raises its error)."""
+        asked = time.perf_counter()
+        try:
+            data = self._future.result()
+        except Exception:
+            self._timing.failed()
+            raise
+        self._timing.used(asked)
+        return data
+
+    def cancel(self) -> None:
+        """Stop the download if still running and drop its bytes. Idempotent."""
+        if self._timing.settled:
+            return
+        self.cancelled.set()
+        self._future.cancel()
+        self._timing.discarded()
+
+
+class AsyncMediaPrefetch:
+    """async_messenger.download_media running as a task on the event loop."""
+
+    def __init__(self, media_id: str, download):
+        self.media_id = media_id
+        self._timing = _Timing()
+        self._task = asyncio.ensure_future(download(media_id))
+        self._task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._timing.finished = time.perf_counter()
+        if not task.cancelled():
+            task.exception()  # retrieved here so a discarded failure isn't logged as unhandled
+
+    async def result(self) -> bytes:
+        asked = time.perf_counter()
+        try:
+            data = await self._task
+        except Exception:
+            self._timing.failed()
+            raise
+        self._timing.used(asked)
+        return data
+
+    def cancel(self) -> None:
+        if self._timing.settled:
+            return
+        self._task.cancel()
+        self._timing.discarded()
+
+
+def enabled() -> bool:
+    return Config.PREFETCH_MEDIA
+
+
+def start(media_id: str | None, download) -> MediaPrefetch | None:
+    """
+    Begin `download(media_id, cancel=event)` (messenger.download_media) in the
+    background. None when prefetch is off or there is no media.
+    """
+    if not media_id or not enabled():
+        return None
+    return MediaPrefetch(media_id, download)
+
+
+def start_async(media_id: str | None, download) -> AsyncMediaPrefetch | None:
+    """start() for the event loop; `download` is async_messenger.download_media."""
+    if not media_id or not enabled():
+        return None
+    return AsyncMediaPrefetch(media_id, download)
@@ -0,0 +1,236 @@
+"""
+Opt-in profiling for slow webhook requests.
+
+PROFILE_MODE=sample   A shared background thread samples the stacks of
+                      in-flight request threads every PROFILE_INTERVAL_MS.
+                      Cheap enough to run on every request; the samples
+                      are kept only when the request took at least
+                      PROFILE_THRESHOLD_MS or was picked by
+                      PROFILE_SAMPLE_RATE.
+PROFILE_MODE=cprofile Deterministic cProfile, but only for the
+                      PROFILE_SAMPLE_RATE fraction of requests (it roughly
+                      doubles request time); kept when over the threshold.
+
+Profiles go to PROFILE_DIR as collapsed stacks (*.folded, flamegraph
+compatible) or pstats dumps (*.prof). Only the newest PROFILE_MAX_FILES
+are kept. `flask --app run profile-summary` lists the hottest functions
+across everything captured.
+"""
+from __future__ import annotations
+
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+_sampler: "_StackSampler" = None
+_sampler_lock = threading.Lock()
+
+
+class _StackSampler:
+    """One daemon thread sampling the stacks of registered threads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._targets: dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def register(self, thread_id: int) -> Counter:
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+        return samples
+
+    def unregister(self, thread_id: int) -> None:
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    continue
+                targets = dict(self._targets)
+            frames = sys._current_frames()
+            for thread_id, samples in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+
+def _collapse(frame) -> str:
+    """Root-first 'module:function;...' stack string."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        parts.append(f"{module}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def _get_sampler() -> _StackSampler:
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = _StackSampler(Config.PROFILE_INTERVAL_MS / 1000)
+    return _sampler
+
+
+@contextmanager
+def profile_request(label: str):
+    """Wrap one request; writes a profile if it qualifies. No-op when off."""
+    mode = Config.PROFILE_MODE
+    if mode not in ("sample", "cprofile"):
+        yield
+        return
+
+    picked = random.random() < Config.PROFILE_SAMPLE_RATE
+    if mode == "cprofile" and not picked:
+        yield
+        return
+
+    started = time.perf_counter()
+    profiler = samples = None
+    thread_id = threading.get_ident()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        samples = _get_sampler().register(thread_id)
+
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if profiler is not None:
+            profiler.disable()
+        else:
+            _get_sampler().unregister(thread_id)
+
+        slow = elapsed_ms >= Config.PROFILE_THRESHOLD_MS
+        keep = slow if mode == "cprofile" else (slow or picked)
+        if keep:
+            try:
+                _write_profile(label, elapsed_ms, profiler, samples)
+            except OSError as e:
+                logger.warning(f"Could not write profile: {e}")
+
+
+def _write_profile(label: str, elapsed_ms: float, profiler, samples: Counter) -> str:
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S_%f")
+    base = os.path.join(Config.PROFILE_DIR, f"{ts}_{label}_{elapsed_ms:.0f}ms_{os.getpid()}")
+
+    if profiler is not None:
+        path = f"{base}.prof"
+        profiler.dump_stats(path)
+    else:
+        path = f"{base}.folded"
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    logger.info(f"Saved profile for slow {label} request ({elapsed_ms:.0f}ms): {path}")
+    _rotate()
+    return path
+
+
+def _profile_files() -> list[str]:
+    files = glob.glob(os.path.join(Config.PROFILE_DIR, "*.prof"))
+    files += glob.glob(os.path.join(Config.PROFILE_DIR, "*.folded"))
+    return sorted(files, key=os.path.basename)
+
+
+def _rotate() -> None:
+    """Delete the oldest profiles beyond PROFILE_MAX_FILES."""
+    files = _profile_files()
+    for path in files[: max(0, len(files) - Config.PROFILE_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def summarize(top: int = 20) -> dict:
+    """
+    Aggregate every captured profile. Returns
+    {"profiles": n, "functions": [(name, self_share, total_share), ...]}
+    where shares are fractions of sampled time (folded) or of total
+    profiled time (pstats), merged across both kinds.
+    """
+    self_time: Counter = Counter()
+    total_time: Counter = Counter()
+    files = _profile_files()
+
+    for path in files:
+        if path.endswith(".folded"):
+            file_self, file_total, file_sum = _read_folded(path)
+        else:
+            file_self, file_total, file_sum = _read_pstats(path)
+        if not file_sum:
+            continue
+        # Normalise per profile so one long capture doesn't drown out the rest
+        for name, value in file_self.items():
+            self_time[name] += value / file_sum
+        for name, value in file_total.items():
+            total_time[name] += value / file_sum
+
+    count = len(files) or 1
+    functions = [
+        (name, self_time[name] / count, total_time[name] / count)
+        for name, _ in self_time.most_common(top)
+    ]
+    return {"profiles": len(files), "functions": functions}
+
+
+def _read_folded(path: str) -> tuple[Counter, Counter, float]:
+    self_samples, total_samples = Counter(), Counter()
+    total = 0
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            n = int(count)
+            frames = stack.split(";")
+            self_samples[frames[-1]] += n
+            for name in set(frames):
+                total_samples[name] += n
+            total += n
+    return self_samples, total_samples, total
+
+
+def _read_pstats(path: str) -> tuple[Counter, Counter, float]:
+    stats = pstats.Stats(path)
+    self_time, total_time = Counter(), Counter()
+    for (filename, _, func), (_, _, tottime, cumtime, _) in stats.stats.items():
+        module = os.path.splitext(os.path.basename(filename))[0]
+        name = f"{module}:{func}"
+        self_time[name] += tottime
+        total_time[name] = max(total_time[name], cumtime)
+    return self_time, total_time, stats.total_tt
+
+
+def format_summary(summary: dict) -> str:
+    lines = [f"Profiles analysed: {summary['profiles']}"]
+    if summary["functions"]:
+        lines.append(f"{'self %':>8}{'total %':>9}  function")
+        for name, self_share, total_share in summary["functions"]:
+            lines.append(f"{self_share * 100:>7.1f}%{total_share * 100:>8.1f}%  {name}")
+    return "\n".join(lines)
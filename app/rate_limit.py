@@ -0,0 +1,386 @@
+"""
+Outbound rate limiting for the WhatsApp Cloud API.
+
+Meta caps throughput per business phone number and answers bursts over
+the cap with 429. Every Graph API send first takes a token from a bucket
+kept in SQLite (RATE_LIMIT_DB), so all gunicorn workers on a host share
+one budget:
+
+  priorities  RESULT (finished images) may drain the bucket; REPLY (text
+              answers) leaves a small reserve; NOTICE (progress notices,
+              read receipts) only sends while the bucket is comfortably
+              full; BULK (broadcasts) only takes what is left above that.
+              Under pressure, results go out first.
+  adaptive    Each 429 halves the refill rate (down to RATE_LIMIT_MIN);
+              every second of successful sends adds RATE_LIMIT_INCREASE
+              back, up to RATE_LIMIT_PER_SECOND (AIMD).
+  retry queue Sends that hit 429, a 5xx or a network error (and sends
+              that waited too long for a token) are queued in the same
+              database and re-sent by a background drainer with
+              exponential backoff, up to RATE_LIMIT_MAX_ATTEMPTS. start()
+              restarts the drainer at worker init if sends are still queued.
+
+Metrics: pichasafi_send_throttle_seconds{priority}, pichasafi_send_retry_queue_depth,
+pichasafi_send_rate, pichasafi_send_rate_limited_total, pichasafi_send_retries_total{result}.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RESULT = 0
+PRIORITY_REPLY = 1
+PRIORITY_NOTICE = 2
+PRIORITY_BULK = 3
+PRIORITY_NAMES = {
+    PRIORITY_RESULT: "result", PRIORITY_REPLY: "reply", PRIORITY_NOTICE: "notice", PRIORITY_BULK: "bulk",
+}
+# Fraction of the burst each priority must leave in the bucket
+RESERVE = {PRIORITY_RESULT: 0.0, PRIORITY_REPLY: 0.1, PRIORITY_NOTICE: 0.5, PRIORITY_BULK: 0.6}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+NOTICE_MAX_WAIT = 2.0  # a progress notice that can't go out soon isn't worth sending
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RETRY_LEASE = 30.0  # a claimed retry is re-offered if its sender dies
+POLL_INTERVAL = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    rate REAL NOT NULL,
+    updated REAL NOT NULL,
+    rate_changed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS retry_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_retry_due ON retry_queue(key, priority, not_before);
+"""
+
+_limiter: "RateLimiter" = None
+_limiter_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Cross-process token bucket with priorities, AIMD and a retry queue."""
+
+    def __init__(
+        self,
+        path: str,
+        key: str,
+        rate: float,
+        burst: float,
+        min_rate: float,
+        increase: float,
+        max_attempts: int,
+    ):
+        self.path = path
+        self.key = key
+        self.max_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._drainer: threading.Thread = None
+        self._drainer_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        now = time.time()
+        conn.execute(
+            "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?, ?)",
+            (key, burst, rate, now, now),
+        )
+
+    # --- Token bucket ---
+
+    def try_acquire(self, priority: int = PRIORITY_REPLY) -> float:
+        """Take a token if this priority may. Returns 0 on success, else seconds to wait."""
+        floor = 1 + RESERVE.get(priority, 0.0) * self.burst
+        with self._transaction() as conn:
+            tokens, rate, updated = conn.execute(
+                "SELECT tokens, rate, updated FROM buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * rate)
+            if tokens >= floor:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (floor - tokens) / rate
+            conn.execute(
+                "UPDATE buckets SET tokens = ?, updated = ? WHERE key = ?", (tokens, now, self.key)
+            )
+        return wait
+
+    def acquire(self, priority: int = PRIORITY_REPLY, timeout: float = None) -> bool:
+        """Block until a token is taken (True) or `timeout` seconds pass (False)."""
+        timeout = Config.RATE_LIMIT_MAX_WAIT if timeout is None else timeout
+        started = time.perf_counter()
+        deadline = started + timeout
+        while True:
+            wait = self.try_acquire(priority)
+            if wait == 0:
+                self._observe_throttle(priority, time.perf_counter() - started)
+                return True
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self._observe_throttle(priority, time.perf_counter() - started)
+                return False
+            time.sleep(min(wait, remaining, 0.25))
+
+    async def acquire_async(self, priority: int = PRIORITY_REPLY, timeout: float = None) -> bool:
+        """acquire() for the event loop: the SQLite step runs in a thread, waits with asyncio.sleep."""
+        import asyncio
+
+        timeout = Config.RATE_LIMIT_MAX_WAIT if timeout is None else timeout
+        started = time.perf_counter()
+        deadline = started + timeout
+        while True:
+            # BEGIN IMMEDIATE can wait on other workers' locks; keep that off the loop
+            wait = await asyncio.to_thread(self.try_acquire, priority)
+            if wait == 0:
+                self._observe_throttle(priority, time.perf_counter() - started)
+                return True
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self._observe_throttle(priority, time.perf_counter() - started)
+                return False
+            await asyncio.sleep(min(wait, remaining, 0.25))
+
+    # --- Adaptive rate ---
+
+    def on_throttled(self) -> float:
+        """A 429 came back: halve the rate. Returns the new rate."""
+        metrics.inc("pichasafi_send_rate_limited_total")
+        with self._transaction() as conn:
+            (rate,) = conn.execute("SELECT rate FROM buckets WHERE key = ?", (self.key,)).fetchone()
+            rate = max(self.min_rate, rate / 2)
+            # Drop the burst too, or the next requests would go straight out
+            conn.execute(
+                "UPDATE buckets SET rate = ?, rate_changed = ?, tokens = MIN(tokens, 0) WHERE key = ?",
+                (rate, time.time(), self.key),
+            )
+        metrics.set_gauge("pichasafi_send_rate", rate)
+        logger.warning(f"WhatsApp API rate limited; send rate lowered to {rate:.1f}/s")
+        return rate
+
+    def on_success(self) -> None:
+        """Add the rate back gradually (at most one step per second)."""
+        now = time.time()
+        with self._transaction() as conn:
+            rate, changed = conn.execute(
+                "SELECT rate, rate_changed FROM buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            if rate >= self.max_rate or now - changed < 1.0:
+                return
+            rate = min(self.max_rate, rate + self.increase * (now - changed))
+            conn.execute(
+                "UPDATE buckets SET rate = ?, rate_changed = ? WHERE key = ?", (rate, now, self.key)
+            )
+        metrics.set_gauge("pichasafi_send_rate", rate)
+
+    def record(self, status: int) -> str:
+        """Feed a Graph API response status back into the rate. Returns ok | retry | fail."""
+        if status == 429:
+            self.on_throttled()
+            return "retry"
+        if status < 400:
+            self.on_success()
+            return "ok"
+        return "retry" if is_retryable(status) else "fail"
+
+    def current_rate(self) -> float:
+        (rate,) = self._conn().execute(
+            "SELECT rate FROM buckets WHERE key = ?", (self.key,)
+        ).fetchone()
+        return rate
+
+    # --- Retry queue ---
+
+    def enqueue(self, payload: dict, priority: int, attempts: int = 0) -> None:
+        """Queue a send for the drainer (after backoff for `attempts` tries)."""
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempts)
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO retry_queue (key, priority, payload, attempts, not_before, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key, priority, json.dumps(payload), attempts, now + delay, now),
+            )
+        metrics.set_gauge("pichasafi_send_retry_queue_depth", self.queue_depth())
+        self._ensure_drainer()
+
+    def claim_due(self, limit: int = 10) -> list[tuple[int, int, dict, int]]:
+        """Lease due retries, best priority first: [(id, priority, payload, attempts)]."""
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, priority, payload, attempts FROM retry_queue "
+                "WHERE key = ? AND not_before <= ? ORDER BY priority, not_before LIMIT ?",
+                (self.key, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE retry_queue SET not_before = ? WHERE id = ?",
+                [(now + RETRY_LEASE, row[0]) for row in rows],
+            )
+        return [(row_id, priority, json.loads(payload), attempts) for row_id, priority, payload, attempts in rows]
+
+    def complete(self, row_id: int) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM retry_queue WHERE id = ?", (row_id,))
+
+    def reschedule(self, row_id: int, attempts: int) -> bool:
+        """Back off a failed retry. Returns False (and drops it) when out of attempts."""
+        with self._transaction() as conn:
+            if attempts >= self.max_attempts:
+                conn.execute("DELETE FROM retry_queue WHERE id = ?", (row_id,))
+                return False
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempts)
+            conn.execute(
+                "UPDATE retry_queue SET attempts = ?, not_before = ? WHERE id = ?",
+                (attempts, time.time() + delay, row_id),
+            )
+        return True
+
+    def queue_depth(self) -> int:
+        (depth,) = self._conn().execute(
+            "SELECT COUNT(*) FROM retry_queue WHERE key = ?", (self.key,)
+        ).fetchone()
+        return depth
+
+    def drain_once(self, send) -> int:
+        """
+        Re-send due retries with `send(payload) -> "ok" | "retry" | "fail"`.
+        Returns how many were delivered.
+        """
+        delivered = 0
+        for row_id, priority, payload, attempts in self.claim_due():
+            if not self.acquire(priority, timeout=RETRY_BASE_DELAY):
+                self.reschedule(row_id, attempts)
+                continue
+            outcome = send(payload)
+            if outcome == "ok":
+                self.complete(row_id)
+                delivered += 1
+                metrics.inc("pichasafi_send_retries_total", result="delivered")
+            elif outcome == "retry" and self.reschedule(row_id, attempts + 1):
+                metrics.inc("pichasafi_send_retries_total", result="rescheduled")
+            else:
+                self.complete(row_id)
+                metrics.inc("pichasafi_send_retries_total", result="dropped")
+                logger.error(f"Dropping WhatsApp send after {attempts + 1} attempts")
+        metrics.set_gauge("pichasafi_send_retry_queue_depth", self.queue_depth())
+        return delivered
+
+    # --- Internals ---
+
+    def _ensure_drainer(self) -> None:
+        if self._drainer is not None and self._drainer.is_alive():
+            return
+        with self._drainer_lock:
+            if self._drainer is None or not self._drainer.is_alive():
+                self._drainer = threading.Thread(target=self._drain_loop, name="send-retry", daemon=True)
+                self._drainer.start()
+
+    def _drain_loop(self) -> None:
+        from app import messenger
+
+        while True:
+            try:
+                self.drain_once(messenger.resend_queued)
+                if self.queue_depth() == 0:
+                    return
+            except Exception as e:
+                logger.error(f"Send retry drainer error: {e}", exc_info=True)
+            time.sleep(RETRY_BASE_DELAY / 2)
+
+    def _observe_throttle(self, priority: int, seconds: float) -> None:
+        metrics.observe(
+            "pichasafi_send_throttle_seconds", seconds, priority=PRIORITY_NAMES.get(priority, "other")
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so read-modify-write is atomic across processes."""
+
+    __slots__ = ("conn",)
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def enabled() -> bool:
+    return Config.RATE_LIMIT_ENABLED
+
+
+def wait_for(priority: int) -> float:
+    """How long a send of this priority may wait for a token."""
+    return NOTICE_MAX_WAIT if priority == PRIORITY_NOTICE else Config.RATE_LIMIT_MAX_WAIT
+
+
+def is_retryable(status: int | None) -> bool:
+    """429s, 5xx and network errors (no status) are worth sending again."""
+    return status is None or status in RETRYABLE_STATUS
+
+
+def get_limiter() -> RateLimiter:
+    """Process-wide limiter for this WhatsApp phone number."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(
+                    Config.RATE_LIMIT_DB,
+                    Config.WHATSAPP_PHONE_NUMBER_ID or "default",
+                    Config.RATE_LIMIT_PER_SECOND,
+                    Config.RATE_LIMIT_BURST,
+                    Config.RATE_LIMIT_MIN,
+                    Config.RATE_LIMIT_INCREASE,
+                    Config.RATE_LIMIT_MAX_ATTEMPTS,
+                )
+    return _limiter
+
+
+def start() -> None:
+    """Resume sends left in the retry queue by a previous process (worker startup)."""
+    if enabled() and get_limiter().queue_depth():
+        get_limiter()._ensure_drainer()
@@ -0,0 +1,182 @@
+"""
+Weighted fair scheduling of render jobs across merchants.
+
+A plain executor queue is FIFO, so one merchant bulk-sending forty
+photos puts everyone who messages after them forty renders back,
+paying tiers included. FairScheduler sits in front of the render
+workers instead. It keeps one queue per merchant (keyed by phone) and
+hands free workers out by start-time fair queueing:
+
+  - each job gets a virtual start tag, max(virtual clock, that merchant's
+    previous finish tag), and advances the merchant's finish tag by
+    1 / weight of their subscription_tier (TIER_WEIGHTS)
+  - a free worker takes the queued job with the lowest tag, so busy
+    merchants take turns, and a business merchant gets about four renders
+    for each one a free merchant gets while both have work queued
+  - a merchant never has more than RENDER_MAX_PER_USER renders running;
+    the rest wait in their queue while other merchants are served
+
+An idle merchant's next job starts at the current virtual clock, so
+quiet periods don't bank credit.
+
+Where the work runs:
+
+  run(...)          sync app: RENDER_WORKERS threads per process; with 0
+                    (the default, one request per gunicorn sync worker)
+                    the render stays inline on the request thread
+  FairScheduler(executor=...)  ASGI: in front of the CPU executor, with
+                    ASYNC_CPU_WORKERS slots (see app/asgi.py)
+
+Metrics: pichasafi_render_queue_wait_seconds{tier} (histogram),
+pichasafi_render_queue_depth (gauge).
+"""
+from __future__ import annotations
+
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Share of render workers per merchant while several have work queued
+TIER_WEIGHTS = {"free": 1, "starter": 2, "pro": 3, "business": 4}
+DEFAULT_WEIGHT = 1
+
+_scheduler: "FairScheduler" = None
+_scheduler_lock = threading.Lock()
+
+
+class _Job:
+    __slots__ = ("fn", "args", "future", "tier", "tag", "seq", "enqueued")
+
+    def __init__(self, fn, args: tuple, tier: str, tag: float, seq: int):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+        self.tier = tier
+        self.tag = tag
+        self.seq = seq
+        self.enqueued = time.perf_counter()
+
+
+class FairScheduler:
+    """Start-time fair queueing of jobs per key, weighted by tier."""
+
+    def __init__(self, workers: int, max_per_user: int = 1, executor: Executor = None):
+        self.workers = max(1, workers)
+        self.max_per_user = max(1, max_per_user)
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="render"
+        )
+        self._lock = threading.Lock()
+        self._queues: dict[str, deque] = {}
+        self._finish: dict[str, float] = {}
+        self._in_flight: dict[str, int] = {}
+        self._running = 0
+        self._queued = 0
+        self._clock = 0.0
+        self._seq = itertools.count()
+
+    def submit(self, key: str, tier: str, fn, *args) -> Future:
+        """Queue fn(*args) for `key` (a phone number). Returns its Future."""
+        weight = TIER_WEIGHTS.get(tier, DEFAULT_WEIGHT)
+        with self._lock:
+            tag = max(self._clock, self._finish.get(key, 0.0))
+            self._finish[key] = tag + 1.0 / weight
+            job = _Job(fn, args, tier, tag, next(self._seq))
+            self._queues.setdefault(key, deque()).append(job)
+            self._queued += 1
+        self._dispatch()
+        return job.future
+
+    def depth(self) -> int:
+        """Jobs waiting for a worker."""
+        return self._queued
+
+    def _next(self) -> tuple[str, _Job] | None:
+        """Pop the lowest-tagged job whose merchant is under the cap (lock held)."""
+        best = None
+        for key, queue in self._queues.items():
+            if queue and self._in_flight.get(key, 0) < self.max_per_user:
+                head = queue[0]
+                if best is None or (head.tag, head.seq) < (best[1].tag, best[1].seq):
+                    best = (key, head)
+        if best is not None:
+            key, job = best
+            self._queues[key].popleft()
+            if not self._queues[key]:
+                del self._queues[key]
+            self._queued -= 1
+        return best
+
+    def _dispatch(self) -> None:
+        started = []
+        with self._lock:
+            while self._running < self.workers:
+                picked = self._next()
+                if picked is None:
+                    break
+                key, job = picked
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self._running += 1
+                self._in_flight[key] = self._in_flight.get(key, 0) + 1
+                self._clock = max(self._clock, job.tag)
+                started.append((key, job))
+            depth = self._queued
+        metrics.set_gauge("pichasafi_render_queue_depth", depth)
+
+        for key, job in started:
+            metrics.observe(
+                "pichasafi_render_queue_wait_seconds", time.perf_counter() - job.enqueued, tier=job.tier
+            )
+            try:
+                inner = self.executor.submit(job.fn, *job.args)
+            except Exception as e:
+                self._finished(key, job, None, e)
+                continue
+            inner.add_done_callback(lambda f, key=key, job=job: self._finished(key, job, f))
+
+    def _finished(self, key: str, job: _Job, inner: Future | None, error: BaseException = None) -> None:
+        with self._lock:
+            self._running -= 1
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+                if key not in self._queues:
+                    # Idle merchants restart at the clock; don't keep their tag
+                    self._finish.pop(key, None)
+        if inner is not None:
+            error = inner.exception()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(inner.result())
+        self._dispatch()
+
+
+def get_scheduler() -> FairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = FairScheduler(Config.RENDER_WORKERS, Config.RENDER_MAX_PER_USER)
+    return _scheduler
+
+
+def run(phone: str, tier: str, fn, *args):
+    """
+    Render for `phone` through the fair queue and wait for the result
+    (inline when RENDER_WORKERS is 0). Exceptions from fn are re-raised.
+    """
+    if Config.RENDER_WORKERS <= 0:
+        return fn(*args)
+    # Carry the trace and log context into the render thread
+    future = get_scheduler().submit(phone, tier, contextvars.copy_context().run, fn, *args)
+    return future.result()
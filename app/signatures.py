@@ -0,0 +1,86 @@
+"""
+HMAC-SHA256 request signatures, checked against the raw body.
+
+Both signed endpoints use the same scheme. The sender puts the hex
+HMAC-SHA256 of the exact bytes it sent, keyed with a shared secret, in a
+header (a "sha256=" prefix is accepted):
+
+  POST /webhook            X-Hub-Signature-256, keyed with WHATSAPP_APP_SECRET
+                           (the Meta app's App Secret)
+  POST /payments/callback  X-Payment-Signature, keyed with PAYMENT_WEBHOOK_SECRET
+
+The check runs on the bytes as received, before any JSON parsing, and
+compares digests in constant time. check_webhook() turns junk and forged
+WhatsApp webhook POSTs away before mark_as_read, database lookups or
+media downloads. A header that can't be a SHA-256 hex digest is rejected
+without hashing the body. Without WHATSAPP_APP_SECRET every POST is
+accepted as before, and a warning is logged once.
+
+Metrics: pichasafi_webhook_rejected_total{reason}.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+WHATSAPP_HEADER = "X-Hub-Signature-256"
+PREFIX = "sha256="
+HEX_LENGTH = 64
+
+_warned = False
+
+
+def sign(secret: str, raw_body: bytes) -> str:
+    """The header value for raw_body ("sha256=<hex>")."""
+    return PREFIX + hmac.new(secret.encode(), raw_body, hashlib.sha256).hexdigest()
+
+
+def _digest(signature: str) -> str | None:
+    """The hex digest from a header value, or None if it can't be one."""
+    if signature.startswith(PREFIX):
+        signature = signature[len(PREFIX):]
+    signature = signature.strip().lower()
+    return signature if len(signature) == HEX_LENGTH else None
+
+
+def valid(secret: str, raw_body: bytes, signature: str | None) -> bool:
+    """True if `signature` is the HMAC-SHA256 of raw_body under secret."""
+    if not secret or not signature:
+        return False
+    digest = _digest(signature)
+    if digest is None:
+        return False
+    expected = hmac.new(secret.encode(), raw_body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected.encode(), digest.encode())
+
+
+def check_webhook(raw_body: bytes, signature: str | None) -> bool:
+    """
+    True if a WhatsApp webhook POST may be processed: its signature is
+    valid, or verification is off (no WHATSAPP_APP_SECRET).
+    """
+    global _warned
+    secret = Config.WHATSAPP_APP_SECRET
+    if not secret:
+        if not _warned:
+            _warned = True
+            logger.warning("WHATSAPP_APP_SECRET is not set; webhook signatures are not verified")
+        return True
+
+    if not signature:
+        reason = "missing"
+    elif _digest(signature) is None:
+        reason = "malformed"
+    elif valid(secret, raw_body, signature):
+        return True
+    else:
+        reason = "mismatch"
+    metrics.inc("pichasafi_webhook_rejected_total", reason=reason)
+    # The counter is the signal; a flood of junk shouldn't flood the logs too
+    logger.debug(f"Rejected webhook POST: {reason} signature")
+    return False
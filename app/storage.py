@@ -0,0 +1,355 @@
+"""
+Object storage for originals, logos and generated images.
+
+Every object read or write goes through get_storage(), a TieredStorage:
+
+  local disk tier   Recently written and read objects live under
+                    STORAGE_CACHE_DIR, evicted least-recently-used once
+                    the tier exceeds STORAGE_CACHE_MAX_MB. Reads are
+                    served from here without a network round trip.
+  backend           Supabase Storage (bucket "pichasafi") in production,
+                    or a plain directory (STORAGE_BACKEND=local) for tests
+                    and local development.
+
+Writes land on disk first and are copied to the backend by a small
+thread pool. put(wait=True) blocks until the backend has the object —
+use it for anything WhatsApp will fetch by URL. Objects not yet written
+back are never evicted, and a marker file per pending object means a
+worker that dies mid-upload has it re-queued on the next start.
+
+Gunicorn workers share STORAGE_CACHE_DIR. Each marker records the pid
+that owns the upload, and a starting worker only takes over markers
+whose owner is dead, claiming each one under an flock so two workers
+booting together don't both upload it. Eviction skips any object with a
+marker on disk, not just this worker's own pending uploads.
+"""
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+BUCKET = "pichasafi"
+WRITE_BACK_ATTEMPTS = 3
+
+_storage: "TieredStorage" = None
+_storage_lock = threading.Lock()
+
+
+class SupabaseBackend:
+    """Supabase Storage bucket, via the service role client."""
+
+    def __init__(self, bucket: str = BUCKET):
+        self.bucket = bucket
+
+    def _bucket(self):
+        from app import database as db
+
+        return db.get_service_client().storage.from_(self.bucket)
+
+    def put(self, path: str, data: bytes, content_type: str) -> None:
+        self._bucket().upload(
+            path=path,
+            file=data,
+            file_options={"content-type": content_type, "upsert": "true"},
+        )
+
+    def get(self, path: str) -> bytes:
+        return self._bucket().download(path)
+
+    def public_url(self, path: str) -> str:
+        return self._bucket().get_public_url(path)
+
+
+class LocalBackend:
+    """A directory standing in for the bucket (tests, local development)."""
+
+    def __init__(self, root: str, base_url: str = None):
+        self.root = root
+        self.base_url = (base_url or f"file://{root}").rstrip("/")
+
+    def _full_path(self, path: str) -> str:
+        full = os.path.normpath(os.path.join(self.root, path))
+        if not full.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Object path escapes storage root: {path}")
+        return full
+
+    def put(self, path: str, data: bytes, content_type: str) -> None:
+        _atomic_write(self._full_path(path), data)
+
+    def get(self, path: str) -> bytes:
+        with open(self._full_path(path), "rb") as f:
+            return f.read()
+
+    def public_url(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+
+class TieredStorage:
+    """Size-bounded local disk LRU in front of a backend, with async write-back."""
+
+    def __init__(self, backend, cache_dir: str, max_bytes: int, writer_threads: int = 2):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._objects_dir = os.path.join(cache_dir, "objects")
+        self._pending_dir = os.path.join(cache_dir, "pending")
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._pending_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # path -> size, oldest first
+        self._size = 0
+        self._dirty: dict[str, Future] = {}
+        self._writer = ThreadPoolExecutor(max_workers=writer_threads, thread_name_prefix="storage")
+
+        self._load_index()
+        self._requeue_pending()
+
+    # --- Public interface ---
+
+    def put(self, path: str, data: bytes, content_type: str = "image/jpeg", wait: bool = False) -> str:
+        """Store an object. Returns its public URL (valid once written back)."""
+        local = self._local_path(path)
+        _atomic_write(local, data)
+        marker = self._pending_marker(path)
+        _atomic_write(
+            marker, json.dumps({"path": path, "content_type": content_type, "pid": os.getpid()}).encode()
+        )
+
+        with self._lock:
+            self._add(path, len(data))
+            future = self._writer.submit(self._write_back, path, local, marker, content_type)
+            self._dirty[path] = future
+            self._evict()
+
+        if wait:
+            future.result()
+        return self.backend.public_url(path)
+
+    def get(self, path: str) -> bytes:
+        """Object bytes, from the disk tier when present."""
+        local = self._local_path(path)
+        with self._lock:
+            cached = path in self._index
+            if cached:
+                self._index.move_to_end(path)
+        if cached:
+            try:
+                with open(local, "rb") as f:
+                    data = f.read()
+                metrics.inc("pichasafi_storage_cache_total", result="hit")
+                return data
+            except FileNotFoundError:
+                # Evicted by another worker sharing the directory
+                with self._lock:
+                    self._discard(path)
+
+        metrics.inc("pichasafi_storage_cache_total", result="miss")
+        with metrics.stage("storage_fetch"):
+            data = self.backend.get(path)
+        _atomic_write(local, data)
+        with self._lock:
+            self._add(path, len(data))
+            self._evict()
+        return data
+
+    def public_url(self, path: str) -> str:
+        return self.backend.public_url(path)
+
+    def flush(self, timeout: float = None) -> None:
+        """Block until every pending write-back has finished."""
+        with self._lock:
+            pending = list(self._dirty.values())
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass  # already logged by _write_back
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._dirty)
+
+    def cached_bytes(self) -> int:
+        with self._lock:
+            return self._size
+
+    # --- Write-back ---
+
+    def _write_back(self, path: str, local: str, marker: str, content_type: str) -> None:
+        try:
+            with open(local, "rb") as f:
+                data = f.read()
+            for attempt in range(1, WRITE_BACK_ATTEMPTS + 1):
+                try:
+                    with metrics.stage("storage_write_back"):
+                        self.backend.put(path, data, content_type)
+                    break
+                except Exception as e:
+                    if attempt == WRITE_BACK_ATTEMPTS:
+                        raise
+                    logger.warning(f"Storage write-back of {path} failed (attempt {attempt}): {e}")
+                    time.sleep(0.5 * attempt)
+            try:
+                os.remove(marker)
+            except FileNotFoundError:
+                pass  # another worker wrote the same path back
+        except Exception as e:
+            metrics.inc("pichasafi_storage_write_back_errors_total")
+            logger.error(f"Storage write-back failed for {path}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._dirty.pop(path, None)
+                self._evict()
+
+    def _requeue_pending(self) -> None:
+        """Re-submit write-backs left behind by dead processes."""
+        for name in os.listdir(self._pending_dir):
+            if not name.endswith(".json"):
+                continue
+            marker = os.path.join(self._pending_dir, name)
+            entry = _claim_marker(marker)
+            if entry is None:
+                continue
+            path = entry["path"]
+            local = self._local_path(path)
+            if not os.path.exists(local):
+                logger.warning(f"Dropping pending upload with no local copy: {path}")
+                os.remove(marker)
+                continue
+            logger.info(f"Re-queueing interrupted upload: {path}")
+            with self._lock:
+                self._dirty[path] = self._writer.submit(
+                    self._write_back, path, local, marker, entry.get("content_type", "image/jpeg")
+                )
+
+    # --- Disk tier bookkeeping (call with _lock held) ---
+
+    def _local_path(self, path: str) -> str:
+        full = os.path.normpath(os.path.join(self._objects_dir, path))
+        if not full.startswith(self._objects_dir + os.sep):
+            raise ValueError(f"Object path escapes storage cache: {path}")
+        return full
+
+    def _pending_marker(self, path: str) -> str:
+        return os.path.join(self._pending_dir, hashlib.sha1(path.encode()).hexdigest() + ".json")
+
+    def _load_index(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self._objects_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                full = os.path.join(root, name)
+                stat = os.stat(full)
+                entries.append((stat.st_mtime, os.path.relpath(full, self._objects_dir), stat.st_size))
+        for _, path, size in sorted(entries):
+            self._add(path, size)
+
+    def _add(self, path: str, size: int) -> None:
+        self._size += size - self._index.pop(path, 0)
+        self._index[path] = size
+        metrics.set_gauge("pichasafi_storage_cache_bytes", self._size)
+
+    def _discard(self, path: str) -> None:
+        self._size -= self._index.pop(path, 0)
+
+    def _evict(self) -> None:
+        if self._size <= self.max_bytes:
+            return
+        for path in list(self._index):
+            if self._size <= self.max_bytes:
+                break
+            # Pending here, or in a sibling worker sharing the directory
+            if path in self._dirty or os.path.exists(self._pending_marker(path)):
+                continue
+            self._discard(path)
+            try:
+                os.remove(self._local_path(path))
+            except FileNotFoundError:
+                pass
+            metrics.inc("pichasafi_storage_evictions_total")
+        metrics.set_gauge("pichasafi_storage_cache_bytes", self._size)
+
+
+def _pid_alive(pid) -> bool:
+    if not pid or pid == os.getpid():
+        return False  # no owner recorded, or a previous process with a reused pid
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _claim_marker(marker: str) -> dict | None:
+    """
+    Take over a pending marker whose owner is dead: stamp it with our pid
+    while holding its flock. Returns the entry, or None if it isn't ours
+    to re-queue (owner alive, being claimed by a sibling, gone, corrupt).
+    """
+    try:
+        fd = os.open(marker, os.O_RDWR)
+    except FileNotFoundError:
+        return None
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        # Rewritten in place, so a sibling that opens it next sees our pid
+        with os.fdopen(os.dup(fd), "r+") as f:
+            try:
+                entry = json.load(f)
+            except ValueError:
+                return None
+            if _pid_alive(entry.get("pid")):
+                return None
+            entry["pid"] = os.getpid()
+            f.seek(0)
+            f.truncate()
+            json.dump(entry, f)
+        return entry
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def get_storage() -> TieredStorage:
+    """Lazy process-wide storage, configured from STORAGE_* settings."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if Config.STORAGE_BACKEND == "local":
+                    backend = LocalBackend(Config.STORAGE_LOCAL_DIR, Config.STORAGE_LOCAL_URL)
+                else:
+                    backend = SupabaseBackend()
+                _storage = TieredStorage(
+                    backend,
+                    Config.STORAGE_CACHE_DIR,
+                    Config.STORAGE_CACHE_MAX_MB * 1024 * 1024,
+                    Config.STORAGE_WRITE_BACK_THREADS,
+                )
+    return _storage
@@ -0,0 +1,132 @@
+"""
+Background downgrade of expired subscriptions.
+
+Nothing on the message path looks at users.subscription_expires_at:
+that would be one more comparison (and, where the row isn't already in
+hand, one more read) on every request. Instead each worker runs a
+sweeper thread that calls run_due() every SUBSCRIPTION_SWEEP_INTERVAL
+seconds. sweep() pages through expired paid users via the
+idx_users_subscription_expiry partial index (only non-free rows, so it
+stays as small as the paying user base) and moves them to the free tier
+and FREE_IMAGE_LIMIT, SUBSCRIPTION_SWEEP_BATCH users per update. The
+change lands in the users row every message already fetches, so
+billing.check_usage stays an in-memory decision on that row.
+
+Workers on a host share SUBSCRIPTION_SWEEP_LOCK: one sweep runs at a
+time, and a worker skips its turn when another finished a sweep less
+than an interval ago (the time is kept in the lock file).
+
+    flask --app run sweep-subscriptions
+
+Metrics: pichasafi_subscriptions_downgraded_total,
+pichasafi_subscription_sweep_seconds, pichasafi_subscription_sweep_errors_total.
+"""
+from __future__ import annotations
+
+import fcntl
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from app.config import Config
+from app import database as db
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_thread: threading.Thread = None
+_thread_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def sweep(now: datetime = None, batch_size: int = None) -> dict:
+    """
+    Downgrade every subscription expired at `now` (default: now).
+    Returns {"downgraded", "batches", "seconds"}.
+    """
+    cutoff = (now or datetime.now(timezone.utc)).isoformat()
+    batch_size = batch_size or Config.SUBSCRIPTION_SWEEP_BATCH
+    started = time.perf_counter()
+    downgraded = batches = 0
+
+    while True:
+        expired = db.list_expired_subscriptions(cutoff, batch_size)
+        if not expired:
+            break
+        batches += 1
+        changed = db.downgrade_subscriptions(
+            [user["id"] for user in expired], cutoff, Config.FREE_IMAGE_LIMIT
+        )
+        downgraded += len(changed)
+        metrics.inc("pichasafi_subscriptions_downgraded_total", len(changed))
+        if not changed:
+            # Listed but not updatable: stop rather than list the same rows forever
+            logger.warning(f"Subscription sweep could not downgrade {len(expired)} expired users")
+            break
+        if len(expired) < batch_size:
+            break
+
+    seconds = time.perf_counter() - started
+    metrics.observe("pichasafi_subscription_sweep_seconds", seconds, buckets=SWEEP_BUCKETS)
+    if downgraded:
+        logger.info(f"Downgraded {downgraded} expired subscriptions in {batches} batches ({seconds:.2f}s)")
+    return {"downgraded": downgraded, "batches": batches, "seconds": round(seconds, 3)}
+
+
+def run_due(force: bool = False) -> dict | None:
+    """
+    sweep() unless another worker is sweeping or swept less than an
+    interval ago. Returns sweep()'s result, or None when skipped.
+    """
+    with open(Config.SUBSCRIPTION_SWEEP_LOCK, "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        f.seek(0)
+        try:
+            last = float(f.read().strip() or 0)
+        except ValueError:
+            last = 0.0
+        if not force and time.time() - last < Config.SUBSCRIPTION_SWEEP_INTERVAL:
+            return None
+        result = sweep()
+        f.seek(0)
+        f.truncate()
+        f.write(str(time.time()))
+        return result
+
+
+def start() -> threading.Thread | None:
+    """Start this process's sweeper thread (no-op when SUBSCRIPTION_SWEEP_INTERVAL is 0)."""
+    global _thread
+    if Config.SUBSCRIPTION_SWEEP_INTERVAL <= 0:
+        return None
+    if _thread is None or not _thread.is_alive():
+        with _thread_lock:
+            if _thread is None or not _thread.is_alive():
+                _stop.clear()
+                _thread = threading.Thread(target=_run, name="subscription-sweeper", daemon=True)
+                _thread.start()
+    return _thread
+
+
+def stop() -> None:
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+        _thread = None
+
+
+def _run() -> None:
+    # Waking every interval is enough: a worker that slept through another's
+    # sweep just skips, so there is about one sweep per interval per host
+    while not _stop.wait(Config.SUBSCRIPTION_SWEEP_INTERVAL):
+        try:
+            run_due()
+        except Exception as e:
+            metrics.inc("pichasafi_subscription_sweep_errors_total")
+            logger.error(f"Subscription sweep failed: {e}", exc_info=True)
@@ -0,0 +1,250 @@
+"""
+Poster templates, compiled once and hot-reloaded without a restart.
+
+Every *.json file in TEMPLATES_DIR (template_config.json today) maps
+template names to specs. compile_templates() checks each spec and turns
+it into a Template: tuples for the canvas and zones, and the fonts
+already loaded, so a render only does lookups.
+
+The compiled set is one immutable snapshot, replaced as a whole by a
+single assignment. A render reads current() once and uses that snapshot
+all the way through, so it never mixes two versions. The version is a
+hash of the file contents: every worker that loads the same files gets
+the same version, and touching a file without changing it keeps the
+version. Render caches put the version in their keys (see
+assets.get_gradient_layer), and a swap drops entries from older
+versions, so a stale layer is never served.
+
+A watcher thread (start()) polls the files' mtimes every
+TEMPLATE_RELOAD_INTERVAL seconds and reloads when they change. A file
+that doesn't parse or compile is logged and ignored, and the running
+version stays in place.
+
+Metrics: pichasafi_template_reloads_total{result}, pichasafi_templates_loaded (gauge).
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from app.config import Config
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+FONT_WEIGHTS = ("regular", "semibold", "bold")
+ANCHORS = ("left", "center", "right")
+
+_snapshot: "Snapshot" = None
+_lock = threading.Lock()
+_fingerprint: tuple = None
+_listeners: list = []
+_thread: threading.Thread = None
+_stop = threading.Event()
+
+
+class TemplateError(ValueError):
+    """A template file or spec that can't be compiled."""
+
+
+class Template:
+    """A compiled template: validated geometry and loaded fonts."""
+
+    __slots__ = ("name", "version", "canvas_size", "zones", "fonts", "spec")
+
+    def __init__(self, name: str, version: str, spec: dict):
+        self.name = name
+        self.version = version
+        self.spec = spec
+        self.canvas_size = _size(spec.get("canvas_size"), f"{name}.canvas_size")
+        self.zones = {
+            key: _zone(value, f"{name}.{key}") for key, value in spec.items() if key.endswith("_zone")
+        }
+        self.fonts = {role: _font(value, f"{name}.fonts.{role}") for role, value in spec.get("fonts", {}).items()}
+
+    def zone(self, name: str) -> dict:
+        return self.zones[f"{name}_zone"]
+
+    def font(self, role: str):
+        """The loaded ImageFont for a text role (e.g. "price")."""
+        return self.fonts[role]
+
+
+class Snapshot:
+    """One compiled version of every template."""
+
+    __slots__ = ("version", "templates")
+
+    def __init__(self, version: str, templates: dict[str, Template]):
+        self.version = version
+        self.templates = templates
+
+    def get(self, name: str) -> Template:
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise TemplateError(f"Unknown template: {name}") from None
+
+    def specs(self) -> dict:
+        return {name: template.spec for name, template in self.templates.items()}
+
+
+def _size(value, where: str) -> tuple:
+    if not (isinstance(value, list) and len(value) == 2 and all(isinstance(v, int) and v > 0 for v in value)):
+        raise TemplateError(f"{where} must be [width, height] in pixels")
+    return tuple(value)
+
+
+def _zone(value, where: str) -> dict:
+    if not isinstance(value, dict):
+        raise TemplateError(f"{where} must be an object")
+    for key in ("x", "y", "w", "h"):
+        if key in value and not (isinstance(value[key], int) and value[key] >= 0):
+            raise TemplateError(f"{where}.{key} must be a non-negative integer")
+    if "x" not in value or "y" not in value:
+        raise TemplateError(f"{where} needs x and y")
+    if value.get("anchor", "left") not in ANCHORS:
+        raise TemplateError(f"{where}.anchor must be one of {', '.join(ANCHORS)}")
+    return dict(value)
+
+
+def _font(value, where: str):
+    from app import assets
+
+    if not isinstance(value, dict) or not isinstance(value.get("size"), int) or value["size"] <= 0:
+        raise TemplateError(f"{where} needs a positive integer size")
+    weight = value.get("weight", "regular")
+    if weight not in FONT_WEIGHTS:
+        raise TemplateError(f"{where}.weight must be one of {', '.join(FONT_WEIGHTS)}")
+    return assets.get_font(weight, value["size"])
+
+
+# --- Loading ---
+
+
+def _files(directory: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(directory, "*.json")))
+
+
+def _stat_fingerprint(paths: list[str]) -> tuple:
+    fingerprint = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(fingerprint)
+
+
+def compile_templates(directory: str = None) -> Snapshot:
+    """Read and compile every template file. Raises TemplateError."""
+    directory = directory or Config.TEMPLATES_DIR
+    digest = hashlib.sha256()
+    specs = {}
+    for path in _files(directory):
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest.update(os.path.basename(path).encode() + b"\0" + raw + b"\0")
+        try:
+            loaded = json.loads(raw)
+        except ValueError as e:
+            raise TemplateError(f"{os.path.basename(path)}: {e}") from None
+        if not isinstance(loaded, dict):
+            raise TemplateError(f"{os.path.basename(path)} must map template names to specs")
+        for name in loaded:
+            if name in specs:
+                raise TemplateError(f"Template {name} is defined twice")
+        specs.update(loaded)
+    if not specs:
+        raise TemplateError(f"No templates found in {directory}")
+
+    version = digest.hexdigest()[:12]
+    return Snapshot(version, {name: Template(name, version, spec) for name, spec in specs.items()})
+
+
+def reload(force: bool = False) -> bool:
+    """
+    Recompile if the template files changed since the last load (always
+    with force). Returns True if a new version was swapped in.
+    """
+    global _snapshot, _fingerprint
+    with _lock:
+        fingerprint = _stat_fingerprint(_files(Config.TEMPLATES_DIR))
+        if not force and _snapshot is not None and fingerprint == _fingerprint:
+            return False
+        try:
+            snapshot = compile_templates()
+        except (OSError, TemplateError) as e:
+            metrics.inc("pichasafi_template_reloads_total", result="error")
+            if _snapshot is None:
+                raise
+            # Don't retry the same broken files every poll
+            _fingerprint = fingerprint
+            logger.error(f"Template reload failed, keeping version {_snapshot.version}: {e}")
+            return False
+        _fingerprint = fingerprint
+        if _snapshot is not None and snapshot.version == _snapshot.version:
+            return False
+        previous, _snapshot = _snapshot, snapshot
+    metrics.inc("pichasafi_template_reloads_total", result="ok")
+    metrics.set_gauge("pichasafi_templates_loaded", len(snapshot.templates))
+    if previous is not None:
+        logger.info(f"Templates reloaded: version {previous.version} -> {snapshot.version}")
+        for listener in list(_listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Template reload listener failed: {e}", exc_info=True)
+    return True
+
+
+def current() -> Snapshot:
+    """The live snapshot (compiled on first use)."""
+    if _snapshot is None:
+        reload()
+    return _snapshot
+
+
+def get(name: str) -> Template:
+    return current().get(name)
+
+
+def version() -> str:
+    return current().version
+
+
+def on_reload(listener) -> None:
+    """Call `listener(snapshot)` after each hot swap (not on the first load)."""
+    _listeners.append(listener)
+
+
+# --- Watcher ---
+
+
+def start() -> threading.Thread | None:
+    """Start this process's watcher thread (no-op when TEMPLATE_RELOAD_INTERVAL is 0)."""
+    global _thread
+    if Config.TEMPLATE_RELOAD_INTERVAL <= 0:
+        return None
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _stop.clear()
+            _thread = threading.Thread(target=_watch, name="template-watcher", daemon=True)
+            _thread.start()
+    return _thread
+
+
+def stop() -> None:
+    _stop.set()
+
+
+def _watch() -> None:
+    while not _stop.wait(Config.TEMPLATE_RELOAD_INTERVAL):
+        try:
+            reload()
+        except Exception as e:
+            logger.error(f"Template watcher error: {e}", exc_info=True)
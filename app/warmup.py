@@ -0,0 +1,220 @@
+"""
+Worker warm-up and readiness.
+
+run() front-loads everything the first message would otherwise pay for
+lazily: Supabase clients, fonts, template config, the imaging stack and
+keep-alive connections to Graph API and Supabase. gunicorn.conf.py runs
+it in post_worker_init, before the worker starts accepting connections,
+so a cold worker never takes traffic. /ready reports the warm-up state
+plus dependency probe latency, cached for READY_PROBE_TTL seconds so
+frequent health checks don't hammer Supabase. A failed warm-up (e.g.
+Supabase briefly unreachable at deploy) is retried in the background
+from /ready with exponential backoff, so the worker recovers on its own.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state = {
+    "state": "pending",  # pending | warming | ready | failed
+    "steps": {},
+    "error": None,
+    "started_at": None,
+    "finished_at": None,
+    "requested": tuple(),  # steps of the last run(), re-run on retry
+    "failures": 0,
+    "retry_at": None,
+}
+_probe_cache = {"checked_at": 0.0, "results": None}
+
+
+def _step_supabase() -> None:
+    from app import database as db
+
+    db.get_client()
+    db.get_service_client()
+
+
+def _step_templates() -> None:
+    from app import template_registry
+
+    template_registry.current()
+
+
+def _step_fonts() -> None:
+    from app import assets
+
+    assets.preload_fonts()
+
+
+def _step_imaging() -> None:
+    # Importing the processor pulls in PIL and its codec plugins
+    from PIL import Image
+    from app import image_processor  # noqa: F401
+
+    Image.init()
+
+
+def _step_http_pools() -> None:
+    """Open keep-alive connections so the first reply skips TCP/TLS setup."""
+    from app import messenger
+
+    try:
+        messenger.get_session().get(Config.WHATSAPP_GRAPH_URL, timeout=5)
+    except Exception as e:
+        logger.warning(f"Warm-up could not pre-connect to Graph API: {e}")
+    probe_dependencies(force=True)
+
+
+STEPS = {
+    "supabase": _step_supabase,
+    "templates": _step_templates,
+    "fonts": _step_fonts,
+    "imaging": _step_imaging,
+    "http_pools": _step_http_pools,
+}
+
+
+def preload_modules() -> dict:
+    """
+    Import the heavy, fork-safe modules (no sockets, threads or clients)
+    in the gunicorn master so every forked worker inherits them instead
+    of paying the import on boot. Returns seconds spent per module group.
+    """
+    timings = {}
+    started = time.perf_counter()
+    import supabase  # noqa: F401
+    timings["supabase"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    _step_imaging()
+    timings["imaging"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    from app import assets
+
+    assets.preload_shared()
+    timings["assets"] = round(time.perf_counter() - started, 3)
+
+    logger.info(f"Preloaded modules in master: {timings}")
+    return timings
+
+
+def run(steps: tuple = tuple(STEPS)) -> dict:
+    """Run warm-up steps in order (blocking). Returns the readiness status."""
+    with _lock:
+        _state.update(
+            state="warming", error=None, started_at=time.time(), steps={}, requested=tuple(steps)
+        )
+
+    for name in steps:
+        started = time.perf_counter()
+        try:
+            STEPS[name]()
+        except Exception as e:
+            logger.error(f"Warm-up step {name} failed: {e}", exc_info=True)
+            with _lock:
+                _state["failures"] += 1
+                delay = min(
+                    Config.WARMUP_RETRY_DELAY * 2 ** (_state["failures"] - 1),
+                    Config.WARMUP_RETRY_MAX,
+                )
+                _state.update(
+                    state="failed",
+                    error=f"{name}: {e}",
+                    finished_at=time.time(),
+                    retry_at=time.monotonic() + delay,
+                )
+            return status()
+        with _lock:
+            _state["steps"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+    with _lock:
+        _state.update(state="ready", finished_at=time.time(), failures=0, retry_at=None)
+    logger.info(f"Worker warm-up complete: {_state['steps']}")
+    return status()
+
+
+def start(steps: tuple = tuple(STEPS)) -> threading.Thread:
+    """Run warm-up in a background thread (dev server / ASGI startup)."""
+    thread = threading.Thread(target=run, args=(steps,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_ready() -> None:
+    """Declare readiness without warm-up (tests, or a server that warms itself)."""
+    with _lock:
+        _state.update(state="ready", error=None, finished_at=time.time(), failures=0, retry_at=None)
+
+
+def is_ready() -> bool:
+    return _state["state"] == "ready"
+
+
+def probe_dependencies(force: bool = False) -> dict:
+    """
+    Time a minimal Supabase query. Results are cached for READY_PROBE_TTL
+    seconds. Returns {"supabase": {"ok": bool, "latency_ms": float}}.
+    """
+    now = time.monotonic()
+    cached = _probe_cache["results"]
+    if not force and cached is not None and now - _probe_cache["checked_at"] < Config.READY_PROBE_TTL:
+        return cached
+
+    from app import database as db
+
+    started = time.perf_counter()
+    try:
+        db.get_client().table("users").select("id").limit(1).execute()
+        result = {"ok": True}
+    except Exception as e:
+        result = {"ok": False, "error": str(e)[:200]}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    results = {"supabase": result}
+    _probe_cache.update(checked_at=now, results=results)
+    return results
+
+
+def status() -> dict:
+    with _lock:
+        return {
+            "state": _state["state"],
+            "steps_ms": dict(_state["steps"]),
+            "error": _state["error"],
+            "failures": _state["failures"],
+            "warmup_s": (
+                round(_state["finished_at"] - _state["started_at"], 3)
+                if _state["finished_at"] and _state["started_at"]
+                else None
+            ),
+        }
+
+
+def _retry_due() -> bool:
+    """Claim a failed warm-up for re-running once its backoff has elapsed."""
+    with _lock:
+        if _state["state"] != "failed" or time.monotonic() < (_state["retry_at"] or 0):
+            return False
+        _state["state"] = "warming"
+        return True
+
+
+def readiness() -> tuple[dict, bool]:
+    """(body, ready) for /ready: warm and every probed dependency reachable."""
+    if _retry_due():
+        logger.info(f"Retrying worker warm-up (attempt {_state['failures'] + 1})")
+        start(_state["requested"])
+    body = status()
+    if body["state"] != "ready":
+        return body, False
+    probes = probe_dependencies()
+    body["dependencies"] = probes
+    return body, all(p["ok"] for p in probes.values())
@@ -1,23 +1,95 @@
+from __future__ import annotations
+
 import logging
+import time
 from datetime import datetime, timezone
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from app.config import Config
+from app import audit_log
+from app import brand_kit
 from app import database as db
+from app import history
+from app import logs
 from app import messenger
 from app import onboarding
+from app import prefetch
 from app import billing
-from app.image_processor import process_product_photo
+from app import commands
+from app import metrics
+from app import profiling
+from app import render_queue
+from app import signatures
+from app import warmup
+from app.rate_limit import PRIORITY_NOTICE
 
 logger = logging.getLogger(__name__)
 webhook_bp = Blueprint("webhook", __name__)
 
+SUPPORTED_TYPES = ("text", "image", "interactive")
+
+UNSUPPORTED_TYPE_MESSAGE = (
+    "I can only process text messages and images for now. "
+    "Send a product photo or type *help*."
+)
+
+PROCESSING_MESSAGE = "Processing your image...\nThis may take 15-30 seconds."
+
+PROCESSING_FAILED_MESSAGE = (
+    "Sorry, something went wrong processing your image.\n"
+    "Please try again with a different photo.\n\n"
+    "Tips for best results:\n"
+    "- Use good lighting\n"
+    "- Place product on a plain background\n"
+    "- Make sure the product fills most of the frame"
+)
+
+UNKNOWN_COMMAND_MESSAGE = (
+    'I didn\'t understand "{message_body}".\n\n'
+    "Send me a *product photo* to enhance it, "
+    "or type *help* to see available commands."
+)
+
+HELP_MESSAGE = (
+    "*PichaSafi Help*\n\n"
+    "Send a *product photo* — I'll enhance it with a professional background\n\n"
+    "Add a caption to make a poster:\n"
+    "- *poster 85000* — price label\n"
+    "- *sale 30%* — discount badge\n"
+    "- *new white* — NEW badge on a white background\n\n"
+    "*Commands:*\n"
+    "- *help* — Show this message\n"
+    "- *status* — See your usage this month\n"
+    "- *history* — See and re-send your recent images\n"
+    "- *edit* — Update your brand profile\n\n"
+    "Tips for best photos:\n"
+    "- Good lighting\n"
+    "- Plain background\n"
+    "- Product fills the frame\n\n"
+    "More features coming soon!"
+)
+
 
 @webhook_bp.route("/health", methods=["GET"])
 def health():
-    """Simple health endpoint for Railway healthcheck."""
+    """Liveness only. Railway's healthcheck uses /ready."""
     return "ok", 200
 
 
+@webhook_bp.route("/ready", methods=["GET"])
+def ready():
+    """Readiness: 200 only once this worker is warm and Supabase answers."""
+    body, is_ready = warmup.readiness()
+    return jsonify(body), 200 if is_ready else 503
+
+
+@webhook_bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (all workers merged). 404 when disabled."""
+    if not metrics.enabled():
+        return "metrics disabled", 404
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 @webhook_bp.route("/webhook", methods=["GET"])
 def verify():
     """WhatsApp webhook verification (called once during Meta setup)."""
@@ -37,66 +109,114 @@ def verify():
 def handle_message():
     """
     Main webhook handler for all incoming WhatsApp messages.
-    Always returns 200 to prevent WhatsApp retries.
+    Returns 200 to prevent WhatsApp retries, except for a bad signature
+    (401, before the body is parsed).
     """
-    body = request.get_json()
+    if not signatures.check_webhook(request.get_data(), request.headers.get(signatures.WHATSAPP_HEADER)):
+        return jsonify({"error": "invalid signature"}), 401
+    with logs.correlate(), profiling.profile_request("webhook"):
+        return _handle_message(request.get_json())
 
-    if not body:
-        return jsonify({"status": "ok"}), 200
 
-    try:
-        entry = body.get("entry", [{}])[0]
-        changes = entry.get("changes", [{}])[0]
-        value = changes.get("value", {})
-        messages = value.get("messages", [])
+def _handle_message(body: dict):
+    started = time.perf_counter()
+    message_type = "none"
+    media = None
 
-        if not messages:
+    try:
+        parsed = parse_message(body)
+        if not parsed:
             return jsonify({"status": "ok"}), 200
 
-        message = messages[0]
-        phone = message["from"]
-        message_id = message["id"]
-        message_type = message["type"]
-
-        messenger.mark_as_read(message_id)
-
-        message_body = None
-        media_id = None
-        caption = None
-
-        if message_type == "text":
-            message_body = message["text"]["body"]
-        elif message_type == "image":
-            media_id = message["image"]["id"]
-            caption = message["image"].get("caption", "")
-        elif message_type == "interactive":
-            interactive = message["interactive"]
-            if interactive["type"] == "button_reply":
-                message_body = interactive["button_reply"]["id"]
-            elif interactive["type"] == "list_reply":
-                message_body = interactive["list_reply"]["id"]
-        else:
-            messenger.send_text(
-                phone,
-                "I can only process text messages and images for now. "
-                "Send a product photo or type *help*.",
-            )
+        phone = parsed["phone"]
+        message_type = parsed["message_type"]
+        # The download only needs the media id; run it alongside routing
+        media = prefetch.start(parsed["media_id"], messenger.download_media)
+        messenger.mark_as_read(parsed["message_id"])
+
+        if message_type not in SUPPORTED_TYPES:
+            messenger.send_text(phone, UNSUPPORTED_TYPE_MESSAGE)
             return jsonify({"status": "ok"}), 200
 
-        _route_message(phone, message_type, message_body, media_id, caption)
+        _route_message(
+            phone,
+            message_type,
+            parsed["message_body"],
+            parsed["media_id"],
+            parsed["caption"],
+            media,
+        )
 
     except Exception as e:
+        metrics.inc("pichasafi_webhook_errors_total")
         logger.error(f"Webhook processing error: {e}", exc_info=True)
 
+    finally:
+        if media is not None:
+            media.cancel()  # no-op if the render used it
+        metrics.observe(
+            "pichasafi_webhook_seconds", time.perf_counter() - started, type=message_type
+        )
+        metrics.inc("pichasafi_messages_total", type=message_type)
+        metrics.flush()
+
     return jsonify({"status": "ok"}), 200
 
 
+def parse_message(body: dict) -> dict | None:
+    """
+    Extract the first message from a webhook payload.
+    Returns None for empty payloads and status updates. Unsupported
+    message types are returned with no body/media so callers can reply.
+    Shared by the Flask and ASGI entry points.
+    """
+    if not body:
+        return None
+
+    entry = body.get("entry", [{}])[0]
+    changes = entry.get("changes", [{}])[0]
+    value = changes.get("value", {})
+    messages = value.get("messages", [])
+
+    if not messages:
+        return None
+
+    message = messages[0]
+    message_type = message["type"]
+
+    message_body = None
+    media_id = None
+    caption = None
+
+    if message_type == "text":
+        message_body = message["text"]["body"]
+    elif message_type == "image":
+        media_id = message["image"]["id"]
+        caption = message["image"].get("caption", "")
+    elif message_type == "interactive":
+        interactive = message["interactive"]
+        if interactive["type"] == "button_reply":
+            message_body = interactive["button_reply"]["id"]
+        elif interactive["type"] == "list_reply":
+            message_body = interactive["list_reply"]["id"]
+
+    return {
+        "phone": message["from"],
+        "message_id": message["id"],
+        "message_type": message_type,
+        "message_body": message_body,
+        "media_id": media_id,
+        "caption": caption,
+    }
+
+
 def _route_message(
     phone: str,
     message_type: str,
     message_body: str,
     media_id: str,
     caption: str,
+    media: prefetch.MediaPrefetch = None,
 ) -> None:
     """
     Core routing logic:
@@ -111,11 +231,17 @@ def _route_message(
         logger.info(f"New user created: {phone}")
 
     if user["onboarding_step"] != "complete":
+        if media is not None:
+            media.cancel()
         onboarding.handle_onboarding(
             phone, user, message_type, message_body, media_id
         )
         return
 
+    if message_type == "interactive" and history.is_history_reply(message_body):
+        history.handle_reply(phone, user, message_body)
+        return
+
     if message_type == "text" and message_body:
         command = message_body.strip().lower()
 
@@ -125,6 +251,9 @@ def _route_message(
         if command == "status":
             messenger.send_text(phone, billing.get_usage_message(phone))
             return
+        if command == "history":
+            history.send_history(phone, user)
+            return
         if command in ("edit", "edit brand", "edit profile"):
             db.update_user(phone, {"onboarding_step": "new"})
             onboarding.handle_onboarding(
@@ -136,90 +265,134 @@ def _route_message(
             return
 
         messenger.send_text(
-            phone,
-            f'I didn\'t understand "{message_body}".\n\n'
-            "Send me a *product photo* to enhance it, "
-            "or type *help* to see available commands.",
+            phone, UNKNOWN_COMMAND_MESSAGE.format(message_body=message_body)
         )
         return
 
     if message_type == "image" and media_id:
-        _handle_product_image(phone, user, media_id, caption)
+        _handle_product_image(phone, user, media_id, caption, media)
         return
 
 
 def _handle_product_image(
-    phone: str, user: dict, media_id: str, caption: str
+    phone: str, user: dict, media_id: str, caption: str, media: prefetch.MediaPrefetch = None
 ) -> None:
-    """Download, process, and send back an enhanced product photo."""
-    usage = billing.check_usage(phone)
+    """Download (or collect the prefetch), process, and send back an enhanced product photo."""
+    usage = billing.check_usage(phone, user)
     if not usage["allowed"]:
+        if media is not None:
+            media.cancel()
         messenger.send_text(phone, billing.get_limit_reached_message())
         return
 
-    messenger.send_text(phone, "Processing your image...\nThis may take 15-30 seconds.")
+    messenger.send_text(phone, PROCESSING_MESSAGE, priority=PRIORITY_NOTICE)
 
-    try:
-        image_bytes = messenger.download_media(media_id)
+    # PIL loads on first render (or in the gunicorn master via preload_modules)
+    from app import image_guard
+    from app.image_processor import process_product_photo
 
-        result_bytes = process_product_photo(
+    trace = metrics.begin_trace()
+    try:
+        with metrics.stage("download_media"):
+            # With a prefetch this is only the part routing didn't overlap
+            image_bytes = media.result() if media is not None else messenger.download_media(media_id)
+
+        # Header only: reject or plan a downscale before any pixels are decoded
+        with metrics.stage("inspect_image"):
+            checked = image_guard.inspect(image_bytes)
+
+        options = commands.parse_caption(caption)
+        # Queued fairly against other merchants' renders when RENDER_WORKERS > 0
+        render_started = time.perf_counter()
+        result_bytes = render_queue.run(
+            phone,
+            user.get("subscription_tier") or "free",
+            process_product_photo,
             image_bytes,
-            bg_color=user.get("brand_color_bg") or "#1A1A2E",
+            user.get("brand_color_bg") or "#1A1A2E",
+            options,
+            brand_kit.for_user(user),
         )
+        render_seconds = time.perf_counter() - render_started
 
         ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        original_url = db.upload_to_storage(
-            f"originals/{phone}/{ts}.jpg", image_bytes
-        )
-        result_url = db.upload_to_storage(
-            f"generated/{phone}/{ts}.jpg", result_bytes
-        )
+        with metrics.stage("upload_original"):
+            # Nothing fetches the original by URL; write it back in the background
+            original_url = db.upload_to_storage(
+                f"originals/{phone}/{ts}.jpg", image_bytes, wait=False
+            )
+        with metrics.stage("upload_result"):
+            result_url = db.upload_to_storage(
+                f"generated/{phone}/{ts}.jpg", result_bytes
+            )
 
-        db.save_generated_image(
-            user_id=user["id"],
-            image_type="product_enhance",
-            original_url=original_url,
-            result_url=result_url,
-        )
+        # Journaled locally and inserted in batches off the reply path
+        with metrics.stage("save_generated_image"):
+            audit_log.record_generated_image(
+                user_id=user["id"],
+                image_type="poster" if options["template"] else "product_enhance",
+                original_url=original_url,
+                result_url=result_url,
+                template_used=options["template"],
+                metadata=image_metadata(
+                    caption, image_bytes, result_bytes, render_seconds, checked["downscale"]
+                ),
+            )
 
-        billing.record_usage(phone)
-        usage = billing.check_usage(phone)
+        updated = billing.record_usage(phone)
+        usage = billing.check_usage(phone, updated or user)
 
-        messenger.send_image(
-            phone,
-            result_url,
-            caption=(
-                f"Here's your enhanced product photo!\n"
-                f"Images remaining: {usage['remaining']}/{usage['limit']}"
-            ),
-        )
+        note = f"\n{image_guard.IMAGE_DOWNSCALED_NOTE}" if checked["downscale"] else ""
+        with metrics.stage("send_image"):
+            messenger.send_image(
+                phone,
+                result_url,
+                caption=(
+                    f"Here's your enhanced product photo!\n"
+                    f"Images remaining: {usage['remaining']}/{usage['limit']}{note}"
+                ),
+            )
+        metrics.inc("pichasafi_images_processed_total")
+        if trace is not None:
+            timings = metrics.format_trace(metrics.end_trace(trace))
+            trace = None
+            logger.info(f"Image pipeline for {phone}: {timings}")
+
+    except image_guard.ImageTooLarge:
+        metrics.end_trace(trace)
+        messenger.send_text(phone, image_guard.IMAGE_TOO_LARGE_MESSAGE)
 
     except Exception as e:
-        logger.error(f"Image processing failed for {phone}: {e}", exc_info=True)
-        messenger.send_text(
-            phone,
-            "Sorry, something went wrong processing your image.\n"
-            "Please try again with a different photo.\n\n"
-            "Tips for best results:\n"
-            "- Use good lighting\n"
-            "- Place product on a plain background\n"
-            "- Make sure the product fills most of the frame",
+        metrics.inc("pichasafi_images_failed_total")
+        timings = metrics.format_trace(metrics.end_trace(trace))
+        logger.error(
+            f"Image processing failed for {phone}: {e} {timings}", exc_info=True
         )
+        messenger.send_text(phone, PROCESSING_FAILED_MESSAGE)
+
+
+def image_metadata(
+    caption: str | None, image_bytes: bytes, result_bytes: bytes, render_seconds: float, downscaled: bool
+) -> dict:
+    """
+    generated_images.metadata: the caption, plus the render time (queue
+    wait included), sizes and stage timings read by analytics exports.
+    """
+    metadata = {
+        "render_ms": round(render_seconds * 1000),
+        "input_bytes": len(image_bytes),
+        "output_bytes": len(result_bytes),
+    }
+    if caption:
+        metadata["caption"] = caption
+    if downscaled:
+        metadata["downscaled"] = True
+    stages = metrics.current_trace()
+    if stages:
+        metadata["stages_ms"] = {name: round(seconds * 1000) for name, seconds in stages.items()}
+    return metadata
 
 
 def _send_help(phone: str) -> None:
     """Send help message with available commands."""
-    messenger.send_text(
-        phone,
-        "*PichaSafi Help*\n\n"
-        "Send a *product photo* — I'll enhance it with a professional background\n\n"
-        "*Commands:*\n"
-        "- *help* — Show this message\n"
-        "- *status* — See your usage this month\n"
-        "- *edit* — Update your brand profile\n\n"
-        "Tips for best photos:\n"
-        "- Good lighting\n"
-        "- Plain background\n"
-        "- Product fills the frame\n\n"
-        "More features coming soon!",
-    )
+    messenger.send_text(phone, HELP_MESSAGE)
@@ -0,0 +1,35 @@
+"""
+Async entry point: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+Serves the same routes as run.py (gunicorn/Flask) for deployments that
+spend most of their request time waiting on Graph API and Supabase.
+"""
+import logging
+from app import logs
+
+logs.setup()
+
+try:
+    from app.asgi import create_asgi_app
+    app = create_asgi_app()
+except Exception as e:
+    logging.error(f"FATAL: Failed to create ASGI app: {e}", exc_info=True)
+
+    # Minimal fallback so the error is visible in logs. It reports
+    # unhealthy so Railway keeps the previous deployment.
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["path"] in ("/health", "/ready"):
+            status, body = 503, b"degraded - app failed to start"
+        else:
+            status, body = 500, b"App failed to start - check logs"
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", port=5000, reload=True)
@@ -0,0 +1,466 @@
+"""
+Local stand-ins for the WhatsApp Graph API and Supabase (PostgREST +
+Storage), for capacity testing without touching Meta or Supabase.
+
+Each fake runs a ThreadingHTTPServer on 127.0.0.1 in a daemon thread,
+injects configurable latency and errors per service, and records the
+server-side time of every call so load reports can break request time
+down by dependency stage.
+
+    graph = FakeGraphAPI(latency=LatencyProfile(mean_ms=120, error_rate=0.01))
+    supa = FakeSupabase(latency=LatencyProfile(mean_ms=40))
+    graph.start(); supa.start()
+    os.environ["WHATSAPP_GRAPH_URL"] = graph.graph_url
+    os.environ["SUPABASE_URL"] = supa.url
+"""
+from __future__ import annotations
+
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+
+class LatencyProfile:
+    """Injected delay (mean ± uniform jitter) and error behaviour for one service."""
+
+    def __init__(
+        self,
+        mean_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+    ):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self) -> None:
+        ms = self.mean_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class StageRecorder:
+    """Thread-safe per-stage latency samples (seconds) and error counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def record(self, stage: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+            if failed:
+                self.errors[stage] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.samples.clear()
+            self.errors.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                stage: (list(samples), self.errors.get(stage, 0))
+                for stage, samples in self.samples.items()
+            }
+
+
+class _FakeServer:
+    """Shared start/stop plumbing; subclasses provide a handler class."""
+
+    service = "fake"
+
+    def __init__(self, latency: LatencyProfile = None, port: int = 0):
+        self.latency = latency or LatencyProfile()
+        self.recorder = StageRecorder()
+        self._port = port
+        self._httpd: ThreadingHTTPServer = None
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "_FakeServer":
+        handler = self._make_handler()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", self._port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name=f"fake-{self.service}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self):
+                started = time.perf_counter()
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stage = fake.stage_for(self.command, self.path)
+                profile = fake.profile_for(stage)
+                profile.delay()
+                if profile.should_fail():
+                    status, payload, ctype = (
+                        profile.error_status,
+                        json.dumps({"error": {"message": "injected failure"}}).encode(),
+                        "application/json",
+                    )
+                else:
+                    status, payload, ctype = fake.handle(
+                        self.command, self.path, self.headers, body
+                    )
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                fake.recorder.record(
+                    stage, time.perf_counter() - started, status >= 400
+                )
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+        return Handler
+
+    def stage_for(self, method: str, path: str) -> str:
+        raise NotImplementedError
+
+    def profile_for(self, stage: str) -> LatencyProfile:
+        return self.latency
+
+    def handle(self, method: str, path: str, headers, body: bytes) -> tuple:
+        raise NotImplementedError
+
+
+def _json(status: int, data) -> tuple:
+    return status, json.dumps(data).encode(), "application/json"
+
+
+def make_test_jpeg(size: tuple = (1200, 1600), seed: int = 0) -> bytes:
+    """A product-photo-sized JPEG with some structure so encoders do real work."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, (rng.randint(180, 240),) * 3)
+    draw = ImageDraw.Draw(img)
+    w, h = size
+    draw.ellipse(
+        (w // 4, h // 4, 3 * w // 4, 3 * h // 4),
+        fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)),
+    )
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+class FakeGraphAPI(_FakeServer):
+    """
+    WhatsApp Cloud API stand-in:
+      POST /v21.0/{phone_number_id}/messages  -> message id (records payload)
+      GET  /v21.0/{media_id}                  -> {"url": .../media/{media_id}}
+      GET  /media/{media_id}                  -> JPEG bytes
+    """
+
+    service = "graph"
+
+    def __init__(self, latency: LatencyProfile = None, media_bytes: bytes = None, port: int = 0):
+        super().__init__(latency, port)
+        self.media_bytes = media_bytes
+        self.sent: list[dict] = []
+        self._sent_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    @property
+    def graph_url(self) -> str:
+        return f"{self.url}/v21.0"
+
+    def stage_for(self, method: str, path: str) -> str:
+        if path.startswith("/media/"):
+            return "graph.media_download"
+        if method == "POST":
+            return "graph.messages"
+        return "graph.media_lookup"
+
+    def handle(self, method, path, headers, body):
+        if path.startswith("/media/"):
+            if self.media_bytes is None:
+                self.media_bytes = make_test_jpeg()
+            return 200, self.media_bytes, "image/jpeg"
+
+        if method == "POST" and path.endswith("/messages"):
+            payload = json.loads(body or b"{}")
+            with self._sent_lock:
+                self.sent.append(payload)
+            return _json(200, {
+                "messaging_product": "whatsapp",
+                "messages": [{"id": f"wamid.fake{next(self._ids)}"}],
+            })
+
+        media_id = path.rsplit("/", 1)[-1]
+        return _json(200, {"url": f"{self.url}/media/{media_id}", "id": media_id})
+
+
+# PostgREST filter operators understood by the fake
+_OPERATORS = {
+    "eq": lambda a, b: a is not None and str(a) == b,
+    "neq": lambda a, b: a is None or str(a) != b,
+    "lt": lambda a, b: a is not None and _cmp(a) < _cmp(b),
+    "lte": lambda a, b: a is not None and _cmp(a) <= _cmp(b),
+    "gt": lambda a, b: a is not None and _cmp(a) > _cmp(b),
+    "gte": lambda a, b: a is not None and _cmp(a) >= _cmp(b),
+    "is": lambda a, b: (a is None) if b == "null" else str(a).lower() == b,
+}
+
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _cmp(value):
+    """Compare numbers numerically and everything else (ISO timestamps, uuids) as text."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _match(row: dict, column: str, expr: str) -> bool:
+    if column in ("or", "and"):
+        # Strip exactly one pair: the group may end with a nested "...)"
+        return _match_group(row, column, expr[1:-1] if expr.startswith("(") else expr)
+    negate = expr.startswith("not.")
+    if negate:
+        expr = expr[4:]
+    op, _, value = expr.partition(".")
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        value = value[1:-1]  # PostgREST's quoted form, used for timestamps in or=()
+    if op == "in":
+        result = str(row.get(column)) in value.strip("()").split(",")
+    else:
+        result = _OPERATORS[op](row.get(column), value)
+    return not result if negate else result
+
+
+def _match_group(row: dict, kind: str, body: str) -> bool:
+    """Evaluate or=(a.eq.1,and(b.lt.2,c.eq.3)) style groups."""
+    parts, depth, current = [], 0, ""
+    for ch in body:
+        if ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        current += ch
+    parts.append(current)
+
+    results = []
+    for part in parts:
+        nested = re.match(r"^(and|or)\((.*)\)$", part)
+        if nested:
+            results.append(_match_group(row, nested.group(1), nested.group(2)))
+        else:
+            column, _, expr = part.partition(".")
+            results.append(_match(row, column, expr))
+    return any(results) if kind == "or" else all(results)
+
+
+class FakeSupabase(_FakeServer):
+    """
+    Supabase stand-in covering what the app uses:
+      /rest/v1/{table}   GET (filters, order, limit), POST (insert), PATCH (update)
+      /storage/v1/object/{bucket}/{path}          POST upload (multipart)
+      /storage/v1/object/{bucket}/{path}          GET authenticated download
+      /storage/v1/object/public/{bucket}/{path}   GET public download
+    Rows get the column defaults from schema.sql that the app relies on.
+    """
+
+    service = "supabase"
+
+    TABLE_DEFAULTS = {
+        "users": {
+            "brand_color_primary": "#FF6B00",
+            "brand_color_secondary": "#FFFFFF",
+            "brand_color_bg": "#1A1A2E",
+            "template_style": "modern",
+            "subscription_tier": "free",
+            "subscription_expires_at": None,
+            "images_created_this_month": 0,
+            "monthly_limit": 3,
+            "onboarding_step": "new",
+        },
+        "generated_images": {"metadata": {}},
+        "transactions": {"status": "pending"},
+    }
+
+    def __init__(
+        self,
+        latency: LatencyProfile = None,
+        storage_latency: LatencyProfile = None,
+        port: int = 0,
+    ):
+        super().__init__(latency, port)
+        self.storage_latency = storage_latency or self.latency
+        self.tables: dict[str, list[dict]] = defaultdict(list)
+        self.objects: dict[str, bytes] = {}
+        self.unique: dict[str, tuple] = {
+            "transactions": ("transaction_ref",),
+            "generated_images": ("id",),
+        }
+        self._lock = threading.Lock()
+
+    def stage_for(self, method: str, path: str) -> str:
+        if path.startswith("/storage/"):
+            return "storage.download" if method == "GET" else "storage.upload"
+        table = urlsplit(path).path.rsplit("/", 1)[-1]
+        verb = {"GET": "select", "POST": "insert", "PATCH": "update"}.get(method, method.lower())
+        return f"db.{table}.{verb}"
+
+    def profile_for(self, stage: str) -> LatencyProfile:
+        return self.storage_latency if stage.startswith("storage.") else self.latency
+
+    def seed(self, table: str, rows: list[dict]) -> list[dict]:
+        """Insert rows directly (with defaults), bypassing HTTP."""
+        with self._lock:
+            return [self._insert_row(table, row) for row in rows]
+
+    def _insert_row(self, table: str, row: dict) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        full = {
+            "id": str(uuid.uuid4()),
+            **self.TABLE_DEFAULTS.get(table, {}),
+            "created_at": now,
+            **row,
+        }
+        if table == "users":
+            full.setdefault("updated_at", now)
+        for column in self.unique.get(table, ()):
+            if full.get(column) is not None and any(
+                r.get(column) == full[column] for r in self.tables[table]
+            ):
+                raise ValueError(f"duplicate key value violates unique constraint ({column})")
+        self.tables[table].append(full)
+        return full
+
+    def handle(self, method, path, headers, body):
+        parts = urlsplit(path)
+        if parts.path.startswith("/storage/v1/object/"):
+            return self._handle_storage(method, unquote(parts.path), headers, body)
+        if parts.path.startswith("/rest/v1/"):
+            table = parts.path[len("/rest/v1/"):]
+            params = parse_qsl(parts.query, keep_blank_values=True)
+            return self._handle_rest(method, table, params, headers, body)
+        return _json(404, {"message": "not found"})
+
+    def _handle_rest(self, method, table, params, headers, body):
+        filters = [(k, v) for k, v in params if k not in _RESERVED_PARAMS]
+        options = dict((k, v) for k, v in params if k in _RESERVED_PARAMS)
+
+        with self._lock:
+            if method == "POST":
+                data = json.loads(body or b"[]")
+                rows = data if isinstance(data, list) else [data]
+                ignore = "ignore-duplicates" in (headers.get("Prefer") or "")
+                inserted = []
+                for row in rows:
+                    try:
+                        inserted.append(self._insert_row(table, row))
+                    except ValueError as e:
+                        if not ignore:
+                            return _json(409, {"code": "23505", "message": str(e)})
+                return _json(201, inserted)
+
+            matched = [
+                row for row in self.tables[table]
+                if all(_match(row, col, expr) for col, expr in filters)
+            ]
+
+            if method == "PATCH":
+                updates = json.loads(body or b"{}")
+                for row in matched:
+                    row.update(updates)
+                    if table == "users":
+                        row["updated_at"] = datetime.now(timezone.utc).isoformat()
+                return _json(200, [dict(r) for r in matched])
+
+            if method == "DELETE":
+                self.tables[table] = [r for r in self.tables[table] if r not in matched]
+                return _json(200, matched)
+
+            for clause in reversed((options.get("order") or "").split(",")):
+                if not clause:
+                    continue
+                column, _, direction = clause.partition(".")
+                matched.sort(
+                    key=lambda r: (r.get(column) is None, _cmp(r.get(column))),
+                    reverse=direction.startswith("desc"),
+                )
+            offset = int(options.get("offset") or 0)
+            if "limit" in options:
+                matched = matched[offset: offset + int(options["limit"])]
+            elif offset:
+                matched = matched[offset:]
+            return _json(200, [dict(r) for r in matched])
+
+    def _handle_storage(self, method, path, headers, body):
+        public_prefix = "/storage/v1/object/public/"
+        if method == "GET" and path.startswith(public_prefix):
+            key = path[len(public_prefix):]
+            data = self.objects.get(key)
+            if data is None:
+                return _json(404, {"message": "Object not found"})
+            return 200, data, "application/octet-stream"
+
+        key = path[len("/storage/v1/object/"):]
+        if method == "GET":
+            data = self.objects.get(key)
+            if data is None:
+                return _json(404, {"message": "Object not found"})
+            return 200, data, "application/octet-stream"
+        if method in ("POST", "PUT"):
+            self.objects[key] = _multipart_file(headers.get("Content-Type", ""), body)
+            return _json(200, {"Key": key})
+        if method == "DELETE":
+            self.objects.pop(key, None)
+            return _json(200, {})
+        return _json(405, {"message": "method not allowed"})
+
+
+def _multipart_file(content_type: str, body: bytes) -> bytes:
+    """Pull the first file part out of a multipart/form-data body."""
+    match = re.search(r"boundary=([^;]+)", content_type)
+    if not match:
+        return body
+    boundary = b"--" + match.group(1).strip('"').encode()
+    for part in body.split(boundary):
+        head, sep, content = part.partition(b"\r\n\r\n")
+        if sep and b'name="file"' in head:
+            return content[:-2] if content.endswith(b"\r\n") else content
+    return body
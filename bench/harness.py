@@ -0,0 +1,296 @@
+"""
+End-to-end capacity benchmark against local Graph API / Supabase fakes.
+
+Starts bench.fakes servers with the requested latency and error
+injection, boots the app (sync Flask or async ASGI) in-process pointed
+at them, and drives /webhook with a realistic mix of onboarding
+conversations, text commands and product photos:
+
+    python -m bench.harness --server sync --scenarios 200 --concurrency 16 \\
+        --graph-latency 150 --db-latency 40 --storage-latency 80 \\
+        --mix onboarding=0.1,text=0.6,image=0.3 --json results.json
+
+The report has client-observed p50/p95/p99 latency and throughput per
+message kind, plus a server-side breakdown by dependency stage taken
+from the fakes (graph.messages, graph.media_download, db.users.select,
+storage.upload, ...). Use --server url=http://host:port to drive an
+already-running deployment that is configured against the fakes.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from bench.fakes import FakeGraphAPI, FakeSupabase, LatencyProfile
+from bench.load_test import image_payload, percentile, text_payload
+
+ONBOARDING_SCRIPT = [
+    "hi",
+    "Mama Asha Boutique",
+    "skip",
+    "Kariakoo, Dar es Salaam",
+    "+255 712 345 678",
+    "2",
+    "1",
+]
+
+TEXT_COMMANDS = ["help", "status", "bei gani?"]
+
+
+def start_fakes(args) -> tuple[FakeGraphAPI, FakeSupabase]:
+    """Start both fakes and point the app's config at them via environment."""
+    graph = FakeGraphAPI(LatencyProfile(
+        args.graph_latency, args.jitter, args.graph_error_rate, args.graph_error_status
+    )).start()
+    supabase = FakeSupabase(
+        LatencyProfile(args.db_latency, args.jitter, args.db_error_rate),
+        storage_latency=LatencyProfile(args.storage_latency, args.jitter, args.db_error_rate),
+    ).start()
+
+    os.environ.setdefault("WHATSAPP_VERIFY_TOKEN", "bench_verify_token")
+    os.environ.setdefault("WHATSAPP_ACCESS_TOKEN", "bench_access_token")
+    os.environ.setdefault("WHATSAPP_PHONE_NUMBER_ID", "100000000000001")
+    os.environ.setdefault("SUPABASE_KEY", "bench_anon_key")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "bench_service_key")
+    os.environ.setdefault("METRICS_ENABLED", "1")
+    os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="pichasafi-bench-metrics-"))
+    os.environ.setdefault("STORAGE_CACHE_DIR", tempfile.mkdtemp(prefix="pichasafi-bench-storage-"))
+    os.environ.setdefault("AUDIT_JOURNAL_DIR", tempfile.mkdtemp(prefix="pichasafi-bench-audit-"))
+    os.environ.setdefault(
+        "RATE_LIMIT_DB",
+        os.path.join(tempfile.mkdtemp(prefix="pichasafi-bench-ratelimit-"), "rate.sqlite3"),
+    )
+    os.environ["WHATSAPP_GRAPH_URL"] = graph.graph_url
+    os.environ["SUPABASE_URL"] = supabase.url
+    return graph, supabase
+
+
+def start_app(server: str) -> str:
+    """Boot the app in a background thread and return its base URL."""
+    if server.startswith("url="):
+        return server[len("url="):].rstrip("/")
+
+    if server == "async":
+        import uvicorn
+        from app.asgi import create_asgi_app
+
+        config = uvicorn.Config(
+            create_asgi_app(), host="127.0.0.1", port=0, log_level="warning", lifespan="on"
+        )
+        uv = uvicorn.Server(config)
+        threading.Thread(target=uv.run, name="bench-asgi", daemon=True).start()
+        while not uv.started:
+            time.sleep(0.05)
+        port = uv.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    httpd = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="bench-wsgi", daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+
+def build_scenarios(count: int, mix: dict, supabase: FakeSupabase, seed: int = 7) -> list:
+    """
+    Each scenario is one merchant's ordered conversation: a list of
+    (kind, payload). Onboarding uses fresh phones; text and image
+    scenarios use seeded, fully onboarded merchants.
+    """
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    scenarios = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "onboarding":
+            phone = f"25571{i:07d}"
+            scenarios.append([("onboarding", text_payload(phone, msg)) for msg in ONBOARDING_SCRIPT])
+            continue
+
+        phone = f"25575{i:07d}"
+        supabase.seed("users", [{
+            "phone_number": phone,
+            "business_name": f"Duka {i}",
+            "location": "Arusha",
+            "contact_phone": phone,
+            "onboarding_step": "complete",
+            "monthly_limit": 1_000_000,
+        }])
+        if kind == "image":
+            scenarios.append([("image", image_payload(phone, f"media_{i}"))])
+        else:
+            scenarios.append([("text", text_payload(phone, rng.choice(TEXT_COMMANDS)))])
+    return scenarios
+
+
+def run_scenarios(base_url: str, scenarios: list, concurrency: int, timeout: float = 120) -> dict:
+    """Run scenarios concurrently (messages within a scenario stay in order)."""
+    url = f"{base_url}/webhook"
+    samples: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    local = threading.local()
+
+    def play(scenario):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        for kind, payload in scenario:
+            started = time.perf_counter()
+            try:
+                ok = session.post(url, json=payload, timeout=timeout).status_code == 200
+            except requests.RequestException:
+                ok = False
+            took = time.perf_counter() - started
+            with lock:
+                if ok:
+                    samples[kind].append(took)
+                else:
+                    errors[kind] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(play, scenarios))
+    elapsed = time.perf_counter() - started
+
+    return {"elapsed": elapsed, "samples": dict(samples), "errors": dict(errors)}
+
+
+def scrape_app_stages(base_url: str) -> dict:
+    """Mean seconds per pipeline stage from the app's own /metrics, if enabled."""
+    try:
+        resp = requests.get(f"{base_url}/metrics", timeout=10)
+    except requests.RequestException:
+        return {}
+    if resp.status_code != 200:
+        return {}
+    sums, counts = {}, {}
+    pattern = re.compile(r'^pichasafi_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+    for line in resp.text.splitlines():
+        match = pattern.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            (sums if kind == "sum" else counts)[stage] = float(value)
+    return {
+        stage: {"count": int(counts[stage]), "mean_ms": round(sums[stage] / counts[stage] * 1000, 1)}
+        for stage in sums
+        if counts.get(stage)
+    }
+
+
+def _dist(samples: list[float]) -> dict:
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+    }
+
+
+def build_report(run: dict, graph: FakeGraphAPI, supabase: FakeSupabase) -> dict:
+    all_samples = [s for kind in run["samples"].values() for s in kind]
+    total = len(all_samples)
+    report = {
+        "elapsed_s": round(run["elapsed"], 3),
+        "messages": total + sum(run["errors"].values()),
+        "errors": sum(run["errors"].values()),
+        "throughput_rps": round(total / run["elapsed"], 2) if run["elapsed"] else 0.0,
+        "overall": _dist(all_samples),
+        "by_kind": {
+            kind: {**_dist(s), "errors": run["errors"].get(kind, 0)}
+            for kind, s in sorted(run["samples"].items())
+        },
+        "stages": {},
+    }
+    for fake in (graph, supabase):
+        for stage, (samples, failed) in sorted(fake.recorder.snapshot().items()):
+            report["stages"][stage] = {**_dist(samples), "errors": failed}
+    return report
+
+
+def print_report(report: dict, out=sys.stdout) -> None:
+    print(
+        f"{report['messages']} messages in {report['elapsed_s']}s "
+        f"({report['throughput_rps']} msg/s, {report['errors']} errors)",
+        file=out,
+    )
+    header = f"{'':<34}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(header, file=out)
+    rows = [("overall", {**report["overall"], "errors": report["errors"]})]
+    rows += [(f"kind:{k}", v) for k, v in report["by_kind"].items()]
+    rows += [(f"stage:{k}", v) for k, v in report["stages"].items()]
+    for name, d in rows:
+        print(
+            f"{name:<34}{d['count']:>7}{d['p50_ms']:>10}{d['p95_ms']:>10}"
+            f"{d['p99_ms']:>10}{d['errors']:>8}",
+            file=out,
+        )
+    if report.get("app_stages"):
+        print(f"{'app pipeline stage':<34}{'count':>7}{'mean ms':>10}", file=out)
+        for name, d in report["app_stages"].items():
+            print(f"{name:<34}{d['count']:>7}{d['mean_ms']:>10}", file=out)
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="PichaSafi end-to-end load benchmark")
+    parser.add_argument("--server", default="sync", help="sync, async or url=http://...")
+    parser.add_argument("--scenarios", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("onboarding=0.1,text=0.6,image=0.3"))
+    parser.add_argument("--graph-latency", type=float, default=120, help="ms")
+    parser.add_argument("--db-latency", type=float, default=30, help="ms")
+    parser.add_argument("--storage-latency", type=float, default=60, help="ms")
+    parser.add_argument("--jitter", type=float, default=10, help="± ms on every call")
+    parser.add_argument("--graph-error-rate", type=float, default=0.0)
+    parser.add_argument("--graph-error-status", type=int, default=500)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep app request logs")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.basicConfig(level=logging.WARNING)
+        for name in ("httpx", "werkzeug", "app"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    graph, supabase = start_fakes(args)
+    base_url = start_app(args.server)
+    scenarios = build_scenarios(args.scenarios, args.mix, supabase)
+    graph.recorder.reset()
+    supabase.recorder.reset()
+
+    run = run_scenarios(base_url, scenarios, args.concurrency)
+    report = build_report(run, graph, supabase)
+    report["app_stages"] = scrape_app_stages(base_url)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    graph.stop()
+    supabase.stop()
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+History query benchmark: latency by page depth for a merchant with a
+large generated_images set.
+
+Builds an SQLite copy of generated_images (ROWS_PER_USER rows for each
+of --users merchants) and times fetching one history page at several
+depths with three strategies:
+
+  offset     idx on (user_id) only, ORDER BY ... LIMIT/OFFSET
+             (the old index; sorts the merchant's whole set per page)
+  keyset     idx on (user_id) only, keyset cursor on (created_at, id)
+  composite  idx_images_user_created + keyset cursor (what history uses)
+
+    python -m bench.history_bench
+    python -m bench.history_bench --rows 100000 --users 3 --json out.json
+
+SQLite's planner makes the same index choices Postgres does here; the
+EXPLAIN line printed per strategy shows whether a sort step is needed.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+PAGE_SIZE = 10
+DEPTHS = (0, 10, 100, 1000, 5000)  # pages into the history
+
+SCHEMA = """
+CREATE TABLE generated_images (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    image_type TEXT NOT NULL,
+    template_used TEXT,
+    result_image_url TEXT,
+    created_at TEXT NOT NULL
+);
+"""
+
+INDEXES = {
+    "user_only": "CREATE INDEX idx_images_user ON generated_images(user_id)",
+    "composite": (
+        "CREATE INDEX idx_images_user_created "
+        "ON generated_images(user_id, created_at DESC, id DESC)"
+    ),
+}
+
+COLUMNS = "id, created_at, image_type, template_used, result_image_url"
+OFFSET_SQL = (
+    f"SELECT {COLUMNS} FROM generated_images {{hint}} WHERE user_id = ? "
+    "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+)
+KEYSET_SQL = (
+    f"SELECT {COLUMNS} FROM generated_images {{hint}} WHERE user_id = ? "
+    "AND created_at <= ? AND (created_at < ? OR id < ?) "
+    "ORDER BY created_at DESC, id DESC LIMIT ?"
+)
+FIRST_PAGE_SQL = (
+    f"SELECT {COLUMNS} FROM generated_images {{hint}} WHERE user_id = ? "
+    "ORDER BY created_at DESC, id DESC LIMIT ?"
+)
+
+STRATEGIES = {
+    "offset": "INDEXED BY idx_images_user",
+    "keyset": "INDEXED BY idx_images_user",
+    "composite": "INDEXED BY idx_images_user_created",
+}
+
+
+def build(rows_per_user: int, users: int, seed: int = 7) -> tuple[sqlite3.Connection, list[str]]:
+    """In-memory table with both indexes. Returns (conn, user_ids)."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(users)]
+    for user_id in user_ids:
+        conn.executemany(
+            "INSERT INTO generated_images VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    str(uuid.UUID(int=rng.getrandbits(128))),
+                    user_id,
+                    "product_enhance",
+                    None,
+                    f"https://cdn.test/generated/{user_id}/{n}.jpg",
+                    # Bursts share a timestamp, so the id tie-break matters
+                    (start + timedelta(seconds=n // 3)).isoformat(),
+                )
+                for n in range(rows_per_user)
+            ),
+        )
+    for sql in INDEXES.values():
+        conn.execute(sql)
+    conn.execute("ANALYZE")
+    conn.commit()
+    return conn, user_ids
+
+
+def cursor_at(conn: sqlite3.Connection, user_id: str, depth: int) -> tuple | None:
+    """(created_at, id) of the last row before page `depth`."""
+    if depth == 0:
+        return None
+    row = conn.execute(
+        OFFSET_SQL.format(hint=STRATEGIES["composite"]),
+        (user_id, 1, depth * PAGE_SIZE - 1),
+    ).fetchone()
+    return row[1], row[0]
+
+
+def fetch_page(conn, strategy: str, user_id: str, depth: int, cursor: tuple | None) -> list:
+    hint = STRATEGIES[strategy]
+    if strategy == "offset":
+        return conn.execute(
+            OFFSET_SQL.format(hint=hint), (user_id, PAGE_SIZE, depth * PAGE_SIZE)
+        ).fetchall()
+    if cursor is None:
+        return conn.execute(FIRST_PAGE_SQL.format(hint=hint), (user_id, PAGE_SIZE)).fetchall()
+    created_at, image_id = cursor
+    return conn.execute(
+        KEYSET_SQL.format(hint=hint), (user_id, created_at, created_at, image_id, PAGE_SIZE)
+    ).fetchall()
+
+
+def plan(conn, strategy: str) -> str:
+    hint = STRATEGIES[strategy]
+    if strategy == "offset":
+        sql, params = OFFSET_SQL.format(hint=hint), ("u", PAGE_SIZE, 0)
+    else:
+        sql, params = KEYSET_SQL.format(hint=hint), ("u", "t", "t", "i", PAGE_SIZE)
+    return "; ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def run(rows_per_user: int, users: int, repeats: int) -> dict:
+    started = time.perf_counter()
+    conn, user_ids = build(rows_per_user, users)
+    result = {
+        "rows_per_user": rows_per_user,
+        "users": users,
+        "build_s": round(time.perf_counter() - started, 2),
+        "plans": {s: plan(conn, s) for s in STRATEGIES},
+        "p50_ms": {s: {} for s in STRATEGIES},
+    }
+    depths = [d for d in DEPTHS if d * PAGE_SIZE < rows_per_user]
+    for depth in depths:
+        cursors = {u: cursor_at(conn, u, depth) for u in user_ids}
+        expected = {u: fetch_page(conn, "composite", u, depth, cursors[u]) for u in user_ids}
+        for strategy in STRATEGIES:
+            samples = []
+            for _ in range(repeats):
+                for user_id in user_ids:
+                    t0 = time.perf_counter()
+                    page = fetch_page(conn, strategy, user_id, depth, cursors[user_id])
+                    samples.append((time.perf_counter() - t0) * 1000)
+                    assert page == expected[user_id], f"{strategy} returned a different page"
+            result["p50_ms"][strategy][depth] = round(statistics.median(samples), 3)
+    return result
+
+
+def report(result: dict) -> str:
+    depths = sorted({d for by_depth in result["p50_ms"].values() for d in by_depth})
+    lines = [
+        f"{result['users']} users x {result['rows_per_user']} images "
+        f"(built in {result['build_s']}s), page size {PAGE_SIZE}, p50 ms per page",
+        "",
+        f"{'strategy':<12}" + "".join(f"{'page ' + str(d):>12}" for d in depths),
+    ]
+    for strategy, by_depth in result["p50_ms"].items():
+        lines.append(f"{strategy:<12}" + "".join(f"{by_depth[d]:>12.3f}" for d in depths))
+    lines.append("")
+    for strategy, text in result["plans"].items():
+        lines.append(f"{strategy:<12}{text}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--rows", type=int, default=100_000, help="images per user")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="also write the raw result to this file")
+    args = parser.parse_args()
+
+    result = run(args.rows, args.users, args.repeats)
+    print(report(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
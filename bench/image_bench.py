@@ -0,0 +1,220 @@
+"""
+image_processor benchmark over the bench/image_corpus.py cases.
+
+For each case, renders it --repeats times (after one warm-up render)
+and records:
+
+  ms           p50 wall time per image, total and per pipeline stage
+               (decode_image, enhance_image, create_gradient_background,
+               place_product, draw_overlays, to_jpeg_bytes)
+  peak_rss_kb  growth of the process high-water mark during a render
+               (memory.track_peak; each case runs in a fresh process,
+               and the warm-up render counts)
+  output_bytes size of the JPEG sent to the user
+  golden       perceptual diff against tests/golden (bench/image_corpus.py)
+
+    python -m bench.image_bench --json results.json
+    python -m bench.image_bench --baseline results.json --fail-on-regression
+    python -m bench.image_bench --update-golden
+
+With --baseline, each case is compared against a saved run. A stage or
+total that got slower by more than --tolerance (and MIN_MS_DELTA), a
+peak RSS that grew by more than --tolerance (and MIN_RSS_DELTA_KB), an
+output more than OUTPUT_BYTES_TOLERANCE larger, or a render outside the
+golden tolerance is reported as a regression.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+MIN_MS_DELTA = 2.0
+MIN_RSS_DELTA_KB = 8 * 1024
+OUTPUT_BYTES_TOLERANCE = 0.02
+
+
+def _enable_stage_timings() -> None:
+    from app.config import Config
+
+    Config.METRICS_ENABLED = True
+    Config.METRICS_DIR = tempfile.mkdtemp(prefix="pichasafi-image-bench-")
+
+
+def bench_case(name: str, repeats: int) -> dict:
+    """Measure one case. Run in a fresh process so peak RSS isn't hidden by earlier cases."""
+    from app import memory, metrics
+    from bench import image_corpus as corpus
+
+    _enable_stage_timings()
+    peaks = []
+    # Warm-up (gradient layer, fonts, template config); counts towards peak RSS only
+    with memory.track_peak() as peak:
+        corpus.render(name)
+    if peak:
+        peaks.append(peak["growth_kb"])
+
+    totals, stages = [], {}
+    output = None
+    for _ in range(repeats):
+        trace = metrics.begin_trace()
+        started = time.perf_counter()
+        with memory.track_peak() as peak:
+            output = corpus.render(name)
+        totals.append((time.perf_counter() - started) * 1000)
+        for stage, seconds in metrics.end_trace(trace).items():
+            stages.setdefault(stage, []).append(seconds * 1000)
+        if peak:
+            peaks.append(peak["growth_kb"])
+
+    golden = corpus.load_golden(name)
+    case = corpus.CASES[name]
+    return {
+        "input": {"size": list(case["size"]), "mode": case["mode"], "format": case["format"]},
+        "ms": {
+            "total": round(statistics.median(totals), 2),
+            "stages": {stage: round(statistics.median(v), 2) for stage, v in stages.items()},
+        },
+        "peak_rss_kb": max(peaks) if peaks else None,
+        "output_bytes": len(output),
+        "golden": corpus.diff(output, golden) if golden is not None else None,
+    }
+
+
+def run(names: list[str], repeats: int) -> dict:
+    import multiprocessing
+    import PIL
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1
+    ) as pool:
+        cases = {name: pool.submit(bench_case, name, repeats).result() for name in names}
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "repeats": repeats,
+        },
+        "cases": cases,
+        "ms_per_image": round(statistics.mean(c["ms"]["total"] for c in cases.values()), 2),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Differences worth reporting: [{"case", "metric", "baseline", "current", "regression"}]."""
+    from bench import image_corpus as corpus
+
+    findings = []
+
+    def check(case, metric, old, new, min_delta):
+        if old is None or new is None:
+            return
+        if new > old * (1 + tolerance) and new - old > min_delta:
+            findings.append({"case": case, "metric": metric, "baseline": old, "current": new, "regression": True})
+        elif new < old * (1 - tolerance) and old - new > min_delta:
+            findings.append({"case": case, "metric": metric, "baseline": old, "current": new, "regression": False})
+
+    for name, current in result["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            continue
+        check(name, "ms.total", base["ms"]["total"], current["ms"]["total"], MIN_MS_DELTA)
+        for stage, ms in current["ms"]["stages"].items():
+            check(name, f"ms.{stage}", base["ms"]["stages"].get(stage), ms, MIN_MS_DELTA)
+        check(name, "peak_rss_kb", base.get("peak_rss_kb"), current.get("peak_rss_kb"), MIN_RSS_DELTA_KB)
+        old_bytes, new_bytes = base["output_bytes"], current["output_bytes"]
+        if abs(new_bytes - old_bytes) > old_bytes * OUTPUT_BYTES_TOLERANCE:
+            findings.append({
+                "case": name, "metric": "output_bytes", "baseline": old_bytes,
+                "current": new_bytes, "regression": new_bytes > old_bytes,
+            })
+        if current["golden"] is not None and not corpus.within_tolerance(current["golden"]):
+            findings.append({
+                "case": name, "metric": "golden", "baseline": None,
+                "current": current["golden"], "regression": True,
+            })
+    return findings
+
+
+def report(result: dict, findings: list[dict] = None) -> str:
+    stages = sorted({s for c in result["cases"].values() for s in c["ms"]["stages"]})
+    short = {s: s.replace("create_gradient_background", "background").replace("_image", "") for s in stages}
+    header = f"{'case':<22}{'total':>8}" + "".join(f"{short[s][:10]:>11}" for s in stages)
+    lines = [
+        f"p50 ms per image, {result['meta']['repeats']} repeats "
+        f"(Pillow {result['meta']['pillow']}, Python {result['meta']['python']})",
+        "",
+        header + f"{'rss MB':>8}{'out kB':>8}{'golden':>14}",
+    ]
+    for name, case in result["cases"].items():
+        golden = case["golden"]
+        golden_text = f"{golden['mean']:.2f}/{golden['block_max']:.0f}" if golden else "missing"
+        rss = f"{case['peak_rss_kb'] / 1024:.0f}" if case["peak_rss_kb"] is not None else "-"
+        lines.append(
+            f"{name:<22}{case['ms']['total']:>8.1f}"
+            + "".join(f"{case['ms']['stages'].get(s, 0):>11.1f}" for s in stages)
+            + f"{rss:>8}{case['output_bytes'] / 1024:>8.1f}{golden_text:>14}"
+        )
+    lines.append(f"\nmean {result['ms_per_image']} ms/image")
+    if findings is not None:
+        lines.append("")
+        if not findings:
+            lines.append("No changes beyond tolerance against the baseline.")
+        for f in findings:
+            label = "REGRESSION" if f["regression"] else "improved"
+            lines.append(f"{label:<11}{f['case']:<22}{f['metric']:<32}{f['baseline']} -> {f['current']}")
+    return "\n".join(lines)
+
+
+def update_golden(names: list[str]) -> None:
+    from bench import image_corpus as corpus
+
+    for name in names:
+        print(f"wrote {corpus.save_golden(name, corpus.render(name))}")
+
+
+def main() -> None:
+    from bench import image_corpus as corpus
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cases", help="comma-separated case names (default: all)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against a saved --json result")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change allowed")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--update-golden", action="store_true", help="re-render tests/golden and exit")
+    args = parser.parse_args()
+
+    names = args.cases.split(",") if args.cases else list(corpus.CASES)
+    unknown = [n for n in names if n not in corpus.CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    if args.update_golden:
+        update_golden(names)
+        return
+
+    result = run(names, args.repeats)
+    findings = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            findings = compare(result, json.load(f), args.tolerance)
+        result["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "findings": findings}
+    print(report(result, findings))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.fail_on_regression and findings and any(f["regression"] for f in findings):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
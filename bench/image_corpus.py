@@ -0,0 +1,193 @@
+"""
+Product-photo corpus and perceptual diff for image_processor.
+
+The corpus is synthetic and deterministic: each case is generated from
+its name, so nothing binary is checked in except the golden renders in
+tests/golden/ (the pipeline output downscaled to GOLDEN_SIZE, as PNG).
+Cases cover phone-sized JPEGs with EXIF orientations, transparent PNG
+cut-outs, grayscale, palette and CMYK inputs, caption options (poster
+overlays, solid background) and an input over the decode pixel budget.
+
+diff() compares two renders the way a person would notice a change:
+both are reduced to GOLDEN_SIZE, then
+
+  mean       mean absolute difference over all pixels and channels (0-255)
+  block_max  worst mean difference over any BLOCK x BLOCK block, which
+             catches a local change (a missing badge, a shifted product)
+             that the global mean would average away
+
+Used by tests/test_golden_images.py and bench/image_bench.py. To accept
+an intended output change: python -m bench.image_bench --update-golden
+"""
+from __future__ import annotations
+
+import io
+import os
+import random
+import zlib
+from PIL import Image, ImageDraw, ImageOps
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "golden")
+GOLDEN_SIZE = (270, 270)  # 1/4 of the 1080x1080 output
+BLOCK = 15
+
+# Perceptual tolerance for golden comparisons
+MAX_MEAN_DIFF = 1.5
+MAX_BLOCK_DIFF = 8.0
+
+# EXIF orientation -> transpose that turns the upright photo into what
+# the camera stored (exif_transpose undoes it)
+_STORED_AS = {1: None, 3: Image.ROTATE_180, 6: Image.ROTATE_90, 8: Image.ROTATE_270}
+
+CASES = {
+    "phone_portrait_exif6": {"size": (1200, 1600), "mode": "RGB", "format": "JPEG", "orientation": 6},
+    "phone_landscape": {"size": (1600, 1200), "mode": "RGB", "format": "JPEG"},
+    "upside_down_exif3": {"size": (900, 1200), "mode": "RGB", "format": "JPEG", "orientation": 3},
+    "rotated_exif8": {"size": (1000, 750), "mode": "RGB", "format": "JPEG", "orientation": 8},
+    "cutout_png_rgba": {"size": (600, 600), "mode": "RGBA", "format": "PNG"},
+    "grayscale_jpeg": {"size": (800, 800), "mode": "L", "format": "JPEG"},
+    "palette_png": {"size": (640, 480), "mode": "P", "format": "PNG"},
+    "cmyk_jpeg": {"size": (1000, 1000), "mode": "CMYK", "format": "JPEG"},
+    "tiny_thumbnail": {"size": (160, 120), "mode": "RGB", "format": "JPEG"},
+    "poster_sale": {
+        "size": (1200, 1200), "mode": "RGB", "format": "JPEG",
+        "options": {"template": "sale_promo", "price": 85000, "currency": "TZS", "discount": 30},
+    },
+    "poster_new_solid": {
+        "size": (900, 1200), "mode": "RGB", "format": "JPEG", "bg_color": "#FF6B00",
+        "options": {"template": "new_arrival", "background": "solid", "color": "#FFFFFF"},
+    },
+    # Config overrides apply while the case renders
+    "over_pixel_budget": {
+        "size": (2400, 1800), "mode": "RGB", "format": "JPEG", "config": {"IMAGE_MAX_PIXELS": 1_000_000},
+    },
+}
+
+
+def render(name: str) -> bytes:
+    """Run process_product_photo on a case (with its config overrides)."""
+    from app.config import Config
+    from app.image_processor import process_product_photo
+
+    overrides = CASES[name].get("config", {})
+    saved = {key: getattr(Config, key) for key in overrides}
+    for key, value in overrides.items():
+        setattr(Config, key, value)
+    try:
+        return process_product_photo(*render_args(name))
+    finally:
+        for key, value in saved.items():
+            setattr(Config, key, value)
+
+
+def render_args(name: str) -> tuple[bytes, str, dict]:
+    """(image_bytes, bg_color, options) for process_product_photo."""
+    case = CASES[name]
+    return make_input(name), case.get("bg_color", "#1A1A2E"), dict(case.get("options", {}))
+
+
+def make_input(name: str) -> bytes:
+    """
+    The encoded input photo for a case (deterministic). "size" is the
+    upright size; with an EXIF orientation the pixels are stored rotated,
+    as phone cameras do.
+    """
+    case = CASES[name]
+    width, height = case["size"]
+    orientation = case.get("orientation", 1)
+    transpose = _STORED_AS[orientation]
+    upright, mask = _photo((width, height), name)
+    mode = case["mode"]
+    if mode == "RGBA":
+        upright = upright.convert("RGBA")
+        upright.putalpha(mask)  # a cut-out: everything but the product transparent
+    elif mode == "P":
+        upright = upright.quantize(64)
+    else:
+        upright = upright.convert(mode)
+    stored = upright.transpose(transpose) if transpose is not None else upright
+
+    buf = io.BytesIO()
+    kwargs = {"quality": 88} if case["format"] == "JPEG" else {}
+    if orientation != 1:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        kwargs["exif"] = exif
+    stored.save(buf, format=case["format"], **kwargs)
+    return buf.getvalue()
+
+
+def golden_path(name: str) -> str:
+    return os.path.join(GOLDEN_DIR, f"{name}.png")
+
+
+def reduce(rendered: bytes | Image.Image) -> Image.Image:
+    """A render at GOLDEN_SIZE, RGB."""
+    img = rendered if isinstance(rendered, Image.Image) else Image.open(io.BytesIO(rendered))
+    return img.convert("RGB").resize(GOLDEN_SIZE, Image.BOX)
+
+
+def load_golden(name: str) -> Image.Image | None:
+    path = golden_path(name)
+    if not os.path.exists(path):
+        return None
+    with Image.open(path) as img:
+        return img.convert("RGB")
+
+
+def save_golden(name: str, rendered: bytes) -> str:
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    path = golden_path(name)
+    reduce(rendered).save(path, format="PNG", optimize=True)
+    return path
+
+
+def diff(a: bytes | Image.Image, b: bytes | Image.Image) -> dict:
+    """{"mean", "block_max"} perceptual difference (see module docstring)."""
+    from PIL import ImageChops, ImageStat
+
+    delta = ImageChops.difference(reduce(a), reduce(b))
+    mean = sum(ImageStat.Stat(delta).mean) / 3
+    blocks = delta.resize((GOLDEN_SIZE[0] // BLOCK, GOLDEN_SIZE[1] // BLOCK), Image.BOX)
+    block_max = max(high for _, high in blocks.getextrema())
+    return {"mean": round(mean, 3), "block_max": float(block_max)}
+
+
+def within_tolerance(result: dict) -> bool:
+    return result["mean"] <= MAX_MEAN_DIFF and result["block_max"] <= MAX_BLOCK_DIFF
+
+
+# --- Synthetic photos ---
+
+
+def _photo(size: tuple, name: str) -> tuple[Image.Image, Image.Image]:
+    """A product on a tabletop: soft backdrop, lit body, label, detail lines. Returns (photo, product mask)."""
+    rng = random.Random(zlib.crc32(name.encode()))
+    width, height = size
+    photo = ImageOps.colorize(
+        Image.linear_gradient("L").resize(size), (rng.randint(170, 200),) * 3, (rng.randint(225, 245),) * 3
+    )
+    mask = Image.new("L", size, 0)
+    draw, mask_draw = ImageDraw.Draw(photo), ImageDraw.Draw(mask)
+
+    body = (rng.randint(40, 220), rng.randint(40, 220), rng.randint(40, 220))
+    box = (width * 0.28, height * 0.2, width * 0.72, height * 0.85)
+    shadow = (box[0] + 8, box[3] - height * 0.05, box[2] + 8, box[3] + height * 0.04)
+    radius = int(min(width, height) * 0.08)
+    draw.ellipse(shadow, fill=(120, 120, 120))
+    draw.rounded_rectangle(box, radius=radius, fill=body)
+    mask_draw.ellipse(shadow, fill=255)
+    mask_draw.rounded_rectangle(box, radius=radius, fill=255)
+
+    label = (width * 0.34, height * 0.45, width * 0.66, height * 0.62)
+    draw.rectangle(label, fill=(245, 245, 240))
+    for _ in range(40):
+        x = rng.uniform(label[0], label[2])
+        y = rng.uniform(label[1], label[3])
+        draw.line((x, y, x + rng.uniform(5, width * 0.05), y), fill=(30, 30, 30), width=max(1, height // 400))
+    highlight = tuple(min(255, c + 60) for c in body)
+    draw.ellipse(
+        (box[0] + width * 0.04, box[1] + height * 0.04, box[0] + width * 0.1, box[1] + height * 0.2),
+        fill=highlight,
+    )
+    return photo, mask
@@ -0,0 +1,87 @@
+"""
+Import-time report for worker boot.
+
+Runs `python -X importtime` on the same code path a gunicorn worker
+executes (import run -> create_app) in a clean interpreter and lists the
+slowest top-level packages and individual modules:
+
+    python -m bench.import_report --top 15
+    python -m bench.import_report --target "import asgi"
+
+Modules listed under --heavy (supabase, PIL, rembg by default) are
+flagged if they load during boot; they are meant to load on first use
+or in the gunicorn master via warmup.preload_modules().
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_TARGET = "from app import create_app; create_app()"
+
+DUMMY_ENV = {
+    "WHATSAPP_VERIFY_TOKEN": "import_report",
+    "WHATSAPP_ACCESS_TOKEN": "import_report",
+    "WHATSAPP_PHONE_NUMBER_ID": "1",
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_KEY": "import_report",
+    "SUPABASE_SERVICE_KEY": "import_report",
+}
+
+
+def measure(target: str = DEFAULT_TARGET) -> list[tuple[str, int, int]]:
+    """Return [(module, self_us, cumulative_us)] in import order."""
+    env = {**os.environ, **{k: os.environ.get(k) or v for k, v in DUMMY_ENV.items()}}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", target],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def report(rows: list, top: int, heavy: list[str]) -> str:
+    packages: dict[str, int] = {}
+    for name, self_us, _ in rows:
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + self_us
+    total_us = sum(packages.values())
+
+    lines = [f"Total import time: {total_us / 1000:.1f} ms across {len(rows)} modules", ""]
+    lines.append(f"{'package':<30}{'ms':>10}{'share':>8}")
+    for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+        lines.append(f"{name:<30}{us / 1000:>10.1f}{us / total_us * 100:>7.1f}%")
+
+    lines += ["", f"{'slowest modules (self)':<50}{'ms':>10}"]
+    for name, self_us, _ in sorted(rows, key=lambda r: -r[1])[:top]:
+        lines.append(f"{name:<50}{self_us / 1000:>10.1f}")
+
+    loaded = sorted({h for h in heavy if h in packages})
+    lines.append("")
+    if loaded:
+        lines.append(f"WARNING: heavy modules imported at boot: {', '.join(loaded)}")
+    else:
+        lines.append(f"OK: none of {', '.join(heavy)} imported at boot")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Worker boot import-time report")
+    parser.add_argument("--target", default=DEFAULT_TARGET, help="Python code to time")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--heavy", default="supabase,PIL,rembg")
+    args = parser.parse_args()
+    print(report(measure(args.target), args.top, args.heavy.split(",")))
+
+
+if __name__ == "__main__":
+    main()
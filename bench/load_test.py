@@ -0,0 +1,162 @@
+"""
+Concurrent-message capacity test for the webhook server.
+
+Fires WhatsApp-shaped webhook POSTs at one or more running deployments
+and reports throughput and latency percentiles, so the sync gunicorn
+deployment (run.py) and the async one (asgi.py) can be compared under
+the same load:
+
+    python -m bench.load_test \\
+        --target sync=http://localhost:5000 \\
+        --target async=http://localhost:8000 \\
+        --concurrency 50 --messages 500
+
+Point both servers at stand-in Graph API / Supabase endpoints (see
+bench/fakes.py) rather than production, or every message will reach
+real merchants.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+_counter = itertools.count()
+
+
+def text_payload(phone: str, body: str) -> dict:
+    return _wrap({
+        "from": phone,
+        "id": f"wamid.load{next(_counter)}",
+        "type": "text",
+        "text": {"body": body},
+    })
+
+
+def image_payload(phone: str, media_id: str, caption: str = "") -> dict:
+    return _wrap({
+        "from": phone,
+        "id": f"wamid.load{next(_counter)}",
+        "type": "image",
+        "image": {"id": media_id, "caption": caption},
+    })
+
+
+def _wrap(message: dict) -> dict:
+    return {"entry": [{"changes": [{"value": {"messages": [message]}}]}]}
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples (0 for an empty list)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    """Latency/throughput summary in milliseconds and messages/second."""
+    return {
+        "messages": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+    }
+
+
+def run_load(
+    base_url: str,
+    payloads: list[dict],
+    concurrency: int,
+    timeout: float = 120,
+    headers_for=None,
+) -> dict:
+    """
+    POST every payload to {base_url}/webhook with `concurrency` in flight.
+    headers_for(raw_body) may add per-request headers (e.g. signatures).
+    """
+    url = f"{base_url.rstrip('/')}/webhook"
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def post(payload: dict) -> None:
+        nonlocal errors
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        raw = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json"}
+        if headers_for:
+            headers.update(headers_for(raw))
+        started = time.perf_counter()
+        try:
+            resp = session.post(url, data=raw, headers=headers, timeout=timeout)
+            ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        took = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(took)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, payloads))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def build_mixed_payloads(count: int, image_ratio: float = 0.3) -> list[dict]:
+    """Onboarded-merchant traffic: mostly commands, some product photos."""
+    payloads = []
+    every = max(1, round(1 / image_ratio)) if image_ratio else 0
+    for i in range(count):
+        phone = f"2557{i % 1000:08d}"
+        if every and i % every == 0:
+            payloads.append(image_payload(phone, f"media_{i}"))
+        else:
+            payloads.append(text_payload(phone, "help" if i % 2 else "status"))
+    return payloads
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--target", action="append", required=True,
+        help="name=base_url, repeat to compare deployments",
+    )
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--image-ratio", type=float, default=0.3)
+    args = parser.parse_args()
+
+    payloads = build_mixed_payloads(args.messages, args.image_ratio)
+    results = {}
+    for target in args.target:
+        name, _, url = target.partition("=")
+        results[name] = run_load(url, payloads, args.concurrency)
+        print(f"{name:>10}: {json.dumps(results[name])}")
+
+    if len(results) > 1:
+        base_name, base = next(iter(results.items()))
+        for name, result in list(results.items())[1:]:
+            if base["throughput_rps"]:
+                ratio = result["throughput_rps"] / base["throughput_rps"]
+                print(f"{name} vs {base_name}: {ratio:.2f}x throughput")
+
+
+if __name__ == "__main__":
+    main()
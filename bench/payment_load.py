@@ -0,0 +1,285 @@
+"""
+Payment-callback load test: bursts of signed callbacks from a stub
+provider against /payments/callback.
+
+Starts the bench.fakes Supabase/Graph API servers, seeds merchants,
+boots the app (sync Flask or async ASGI) against them and replays
+provider-style bursts: each burst is --burst-size callbacks fired at
+--concurrency, --duplicate-rate of them re-deliveries of callbacks
+already sent (as providers do when an acknowledgement is slow), and
+--failure-rate of them failed payments.
+
+    python -m bench.payment_load --server sync --bursts 5 --burst-size 200 \\
+        --concurrency 32 --duplicate-rate 0.2 --db-latency 20 --json results.json
+
+Reported:
+  ack       client-observed latency of the callback response (p50/p95/p99)
+            and response codes; this is what the provider's timeout sees
+  settle    time from a payment's first acknowledgement until its
+            transactions row left "pending" (p50/p95/p99), and until the
+            queue was empty after the last burst
+  checks    one transactions row per unique ref, every unique payment
+            settled, one merchant notification per unique payment, and
+            each merchant's expiry extended once per successful payment
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from argparse import Namespace
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from bench.harness import start_app, start_fakes
+from bench.load_test import percentile
+
+SECRET = "bench_payment_secret"
+PLAN_PRICES = {"starter": 15000, "pro": 35000, "business": 75000}
+
+
+class StubProvider:
+    """Generates and delivers signed mobile-money callbacks, like a provider's retrying notifier."""
+
+    def __init__(self, base_url: str, phones: list[str], seed: int = 11):
+        self.url = f"{base_url}/payments/callback"
+        self.phones = phones
+        self.rng = random.Random(seed)
+        self.sent: dict[str, bytes] = {}  # ref -> body, for re-delivery
+        self.first_ack: dict[str, float] = {}
+        self.outcomes: dict[str, str] = {}  # ref -> "success" | "failed"
+        self.latencies: list[float] = []
+        self.statuses: Counter = Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def burst(self, size: int, concurrency: int, duplicate_rate: float, failure_rate: float) -> None:
+        bodies = []
+        for _ in range(size):
+            if self.sent and self.rng.random() < duplicate_rate:
+                bodies.append(self.rng.choice(list(self.sent.values())))
+            else:
+                bodies.append(self._new_callback(failure_rate))
+        # Re-deliveries can also race the original inside a burst
+        self.rng.shuffle(bodies)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self._deliver, bodies))
+
+    def _new_callback(self, failure_rate: float) -> bytes:
+        self._next += 1
+        ref = f"BENCH{self._next:07d}"
+        plan = self.rng.choice(list(PLAN_PRICES))
+        status = "failed" if self.rng.random() < failure_rate else "success"
+        body = json.dumps({
+            "transaction_ref": ref,
+            "phone": self.rng.choice(self.phones),
+            "amount": PLAN_PRICES[plan],
+            "currency": "TZS",
+            "status": status,
+            "provider": "stub",
+        }).encode()
+        self.sent[ref] = body
+        self.outcomes[ref] = status
+        return body
+
+    def _deliver(self, body: bytes) -> None:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        signature = "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+        started = time.perf_counter()
+        try:
+            resp = session.post(
+                self.url, data=body, timeout=30,
+                headers={"Content-Type": "application/json", "X-Payment-Signature": signature},
+            )
+            status = resp.status_code
+        except requests.RequestException:
+            status = "error"
+        elapsed = time.perf_counter() - started
+        ref = json.loads(body)["transaction_ref"]
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.statuses[status] += 1
+            if status in (200, 202):
+                self.first_ack.setdefault(ref, time.time())
+
+
+def seed_merchants(supabase, count: int) -> list[str]:
+    phones = [f"25576{i:07d}" for i in range(count)]
+    supabase.seed("users", [
+        {"phone_number": phone, "business_name": f"Duka {i}", "onboarding_step": "complete"}
+        for i, phone in enumerate(phones)
+    ])
+    return phones
+
+
+def wait_settled(supabase, provider: StubProvider, timeout: float) -> dict:
+    """Poll the fake until every acknowledged ref left pending; returns ref -> settle time."""
+    settled = {}
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with supabase._lock:
+            rows = [(r["transaction_ref"], r["status"]) for r in supabase.tables["transactions"]]
+        now = time.time()
+        for ref, status in rows:
+            if status != "pending" and ref not in settled:
+                settled[ref] = now
+        if len(settled) >= len(provider.first_ack):
+            break
+        time.sleep(0.05)
+    return settled
+
+
+def _notifications(graph) -> list[dict]:
+    return [m for m in graph.sent if m.get("type") == "text"]
+
+
+def wait_notified(graph, provider: StubProvider, timeout: float = 10.0) -> None:
+    """The row is marked completed just before the merchant is told; give the last sends a moment."""
+    deadline = time.time() + timeout
+    while len(_notifications(graph)) < len(provider.first_ack) and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def check(supabase, graph, provider: StubProvider) -> dict:
+    rows = supabase.tables["transactions"]
+    refs = Counter(r["transaction_ref"] for r in rows)
+    acked = set(provider.first_ack)
+    notices = _notifications(graph)
+    successes = Counter(
+        json.loads(provider.sent[ref])["phone"]
+        for ref in acked if provider.outcomes[ref] == "success"
+    )
+    # Every merchant started on free with no expiry, so n successful
+    # payments must put the expiry n periods out (give or take the run)
+    from app.billing import PLAN_PERIOD_DAYS
+
+    now = datetime.now(timezone.utc)
+    wrong_expiry = 0
+    for user in supabase.tables["users"]:
+        n = successes.get(user["phone_number"], 0)
+        if not n:
+            continue
+        days = (datetime.fromisoformat(user["subscription_expires_at"]) - now).total_seconds() / 86400
+        if abs(days - n * PLAN_PERIOD_DAYS) > 1:
+            wrong_expiry += 1
+    return {
+        "unique_refs": len(acked),
+        "rows": len(rows),
+        "duplicate_rows": sum(n - 1 for n in refs.values() if n > 1),
+        "unsettled": sum(1 for r in rows if r["status"] == "pending"),
+        "statuses": dict(Counter(r["status"] for r in rows)),
+        "notifications": len(notices),
+        "merchants_with_wrong_expiry": wrong_expiry,
+        "ok": (
+            len(rows) == len(acked)
+            and all(r["status"] != "pending" for r in rows)
+            and len(notices) == len(acked)
+            and wrong_expiry == 0
+        ),
+    }
+
+
+def run(args) -> dict:
+    graph, supabase = start_fakes(Namespace(
+        graph_latency=args.graph_latency, db_latency=args.db_latency, storage_latency=0,
+        jitter=args.jitter, graph_error_rate=0.0, graph_error_status=500, db_error_rate=0.0,
+    ))
+    os.environ["PAYMENT_WEBHOOK_SECRET"] = SECRET
+    os.environ["PAYMENT_QUEUE_DB"] = os.path.join(
+        tempfile.mkdtemp(prefix="pichasafi-bench-payments-"), "payments.sqlite3"
+    )
+    os.environ["PAYMENT_WORKERS"] = str(args.workers)
+    os.environ.setdefault("SUBSCRIPTION_SWEEP_INTERVAL", "0")
+    base_url = start_app(args.server)
+
+    provider = StubProvider(base_url, seed_merchants(supabase, args.merchants))
+    started = time.perf_counter()
+    for i in range(args.bursts):
+        provider.burst(args.burst_size, args.concurrency, args.duplicate_rate, args.failure_rate)
+        if i < args.bursts - 1:
+            time.sleep(args.pause)
+    sent_elapsed = time.perf_counter() - started
+    last_ack = max(provider.first_ack.values(), default=time.time())
+
+    settled = wait_settled(supabase, provider, args.timeout)
+    wait_notified(graph, provider)
+    lags = [settled[ref] - acked for ref, acked in provider.first_ack.items() if ref in settled]
+    ms = lambda s: round(s * 1000, 1)  # noqa: E731
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "ack": {
+            "callbacks": len(provider.latencies),
+            "per_second": round(len(provider.latencies) / sent_elapsed, 1),
+            "p50_ms": ms(percentile(provider.latencies, 50)),
+            "p95_ms": ms(percentile(provider.latencies, 95)),
+            "p99_ms": ms(percentile(provider.latencies, 99)),
+            "max_ms": ms(max(provider.latencies, default=0)),
+            "status": {str(k): v for k, v in sorted(provider.statuses.items(), key=str)},
+        },
+        "settle": {
+            "p50_ms": ms(percentile(lags, 50)),
+            "p95_ms": ms(percentile(lags, 95)),
+            "p99_ms": ms(percentile(lags, 99)),
+            "drain_after_last_burst_s": round(max(settled.values(), default=last_ack) - last_ack, 2),
+        },
+        "checks": check(supabase, graph, provider),
+    }
+
+
+def report(result: dict) -> str:
+    ack, settle, checks = result["ack"], result["settle"], result["checks"]
+    return "\n".join([
+        f"{ack['callbacks']} callbacks at {ack['per_second']}/s "
+        f"({result['config']['server']} server, {result['config']['workers']} payment workers)",
+        f"ack     p50 {ack['p50_ms']} ms  p95 {ack['p95_ms']} ms  p99 {ack['p99_ms']} ms  "
+        f"max {ack['max_ms']} ms  status {ack['status']}",
+        f"settle  p50 {settle['p50_ms']} ms  p95 {settle['p95_ms']} ms  p99 {settle['p99_ms']} ms  "
+        f"queue empty {settle['drain_after_last_burst_s']} s after the last burst",
+        f"checks  {checks['unique_refs']} unique refs -> {checks['rows']} rows "
+        f"({checks['duplicate_rows']} duplicates, {checks['unsettled']} pending) {checks['statuses']}, "
+        f"{checks['notifications']} notifications, "
+        f"{checks['merchants_with_wrong_expiry']} merchants with a wrong expiry: "
+        + ("OK" if checks["ok"] else "FAILED"),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", default="sync", help="sync | async | url=http://host:port")
+    parser.add_argument("--merchants", type=int, default=50)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pause", type=float, default=1.0, help="seconds between bursts")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=4, help="PAYMENT_WORKERS")
+    parser.add_argument("--db-latency", type=float, default=20.0, help="ms per Supabase call")
+    parser.add_argument("--graph-latency", type=float, default=50.0, help="ms per Graph API call")
+    parser.add_argument("--jitter", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for the queue to drain")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(report(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if not result["checks"]["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
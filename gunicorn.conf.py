@@ -0,0 +1,34 @@
+# Picked up automatically by gunicorn from the working directory.
+# Command-line flags in Procfile / railway.json still take precedence.
+import gc
+
+
+def when_ready(server):
+    """
+    Runs once in the master before workers are forked: import supabase/PIL
+    and load fonts, templates and static layers here so workers inherit
+    them copy-on-write.
+    """
+    from app import warmup
+
+    warmup.preload_modules()
+    # Move everything allocated so far out of the collector's reach so GC
+    # passes in the workers don't write to (and un-share) those pages.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Warm each worker before its accept loop starts, so cold workers take no traffic."""
+    from app import audit_log
+    from app import payments
+    from app import rate_limit
+    from app import subscriptions
+    from app import template_registry
+    from app import warmup
+
+    warmup.run()
+    subscriptions.start()
+    payments.start()
+    rate_limit.start()
+    audit_log.start()
+    template_registry.start()
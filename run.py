@@ -1,29 +1,41 @@
 import logging
-import sys
+from app import logs
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    stream=sys.stderr,
-)
+logs.setup()
 
 try:
     from app import create_app
     app = create_app()
 except Exception as e:
     logging.error(f"FATAL: Failed to create app: {e}", exc_info=True)
-    # Create a minimal fallback app so Railway healthcheck passes
-    # and we can see the error in logs
+    # Create a minimal fallback app so the error is visible in logs.
+    # It reports unhealthy so Railway keeps the previous deployment.
     from flask import Flask
     app = Flask(__name__)
 
     @app.route("/health", methods=["GET"])
     def health():
-        return "ok (degraded)", 200
+        return "degraded - app failed to start", 503
+
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        return "degraded - app failed to start", 503
 
     @app.route("/webhook", methods=["GET", "POST"])
     def webhook():
         return "App failed to start - check logs", 500
 
 if __name__ == "__main__":
+    from app import audit_log
+    from app import payments
+    from app import rate_limit
+    from app import subscriptions
+    from app import template_registry
+    from app import warmup
+    warmup.start()
+    subscriptions.start()
+    payments.start()
+    rate_limit.start()
+    audit_log.start()
+    template_registry.start()
     app.run(debug=True, port=5000)
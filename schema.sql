@@ -13,8 +13,12 @@ CREATE TABLE users (
     brand_color_primary VARCHAR(7) DEFAULT '#FF6B00',
     brand_color_secondary VARCHAR(7) DEFAULT '#FFFFFF',
     brand_color_bg VARCHAR(7) DEFAULT '#1A1A2E',
+    brand_kit JSONB,         -- palette derived from the brand colors (app/brand_kit.py)
     template_style VARCHAR(50) DEFAULT 'modern',
     logo_url TEXT,
+    logo_original_key TEXT,  -- storage key of the upload as received
+    logo_key TEXT,           -- normalized RGBA PNG
+    logo_zone_key TEXT,      -- pre-fitted to the template logo_zone
     subscription_tier VARCHAR(20) DEFAULT 'free',
     subscription_expires_at TIMESTAMPTZ,
     images_created_this_month INTEGER DEFAULT 0,
@@ -26,6 +30,11 @@ CREATE TABLE users (
 
 CREATE INDEX idx_users_phone ON users(phone_number);
 
+-- Expired-subscription sweep (app/subscriptions.py): only paid rows are
+-- indexed, so the index stays as small as the paying user base
+CREATE INDEX idx_users_subscription_expiry ON users(subscription_expires_at)
+    WHERE subscription_tier <> 'free';
+
 -- Generated images table
 CREATE TABLE generated_images (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -38,9 +47,11 @@ CREATE TABLE generated_images (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
-CREATE INDEX idx_images_user ON generated_images(user_id);
+-- Newest-first history pages per user (keyset on created_at, id); also
+-- serves plain user_id lookups
+CREATE INDEX idx_images_user_created ON generated_images(user_id, created_at DESC, id DESC);
 
--- Transactions table (for Phase 3, created now for schema completeness)
+-- Transactions table: one row per mobile-money payment callback (app/payments.py)
 CREATE TABLE transactions (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
     user_id UUID REFERENCES users(id) ON DELETE CASCADE,
@@ -49,9 +60,37 @@ CREATE TABLE transactions (
     transaction_ref VARCHAR(255),
     transaction_type VARCHAR(50),
     status VARCHAR(20) DEFAULT 'pending',
+    plan VARCHAR(20),
+    period_end TIMESTAMPTZ,  -- subscription end this payment buys, fixed on first apply
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Provider callbacks are delivered at least once; the ref dedupes them
+CREATE UNIQUE INDEX idx_transactions_ref ON transactions(transaction_ref);
+
+-- Migration for databases created before logo derivatives
+ALTER TABLE users ADD COLUMN IF NOT EXISTS logo_original_key TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS logo_key TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS logo_zone_key TEXT;
+
+-- Migration for databases created before brand kits (rows without one are
+-- rebuilt in memory at render time until their colors next change)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS brand_kit JSONB;
+
+-- Migration for databases created with the single-column index
+CREATE INDEX IF NOT EXISTS idx_images_user_created
+    ON generated_images(user_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_images_user;
+
+-- Migration for databases created before the subscription sweeper
+CREATE INDEX IF NOT EXISTS idx_users_subscription_expiry ON users(subscription_expires_at)
+    WHERE subscription_tier <> 'free';
+
+-- Migration for databases created before payment callbacks
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS plan VARCHAR(20);
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS period_end TIMESTAMPTZ;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_ref ON transactions(transaction_ref);
+
 -- Auto-update updated_at on users table
 CREATE OR REPLACE FUNCTION update_updated_at()
 RETURNS TRIGGER AS $$
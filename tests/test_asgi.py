@@ -0,0 +1,213 @@
+import asyncio
+import io
+import json
+from unittest.mock import patch, AsyncMock
+from app.asgi import create_asgi_app
+
+
+def _call(method, path, body=b"", query_string=b""):
+    """Drive the ASGI app once and return (status, body)."""
+    app = create_asgi_app()
+    sent = []
+    incoming = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(event):
+        sent.append(event)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+
+def _text_message(body):
+    return json.dumps({
+        "entry": [{"changes": [{"value": {"messages": [{
+            "from": "255712345678",
+            "id": "msg_001",
+            "type": "text",
+            "text": {"body": body},
+        }]}}]}]
+    }).encode()
+
+
+def test_asgi_health():
+    assert _call("GET", "/health") == (200, b"ok")
+
+
+def test_asgi_wrong_method_is_405_on_every_route():
+    for path in ("/health", "/ready", "/metrics", "/webhook", "/payments/callback"):
+        assert _call("PUT", path) == (405, b"Method Not Allowed"), path
+    assert _call("GET", "/nope")[0] == 404
+
+
+def test_asgi_webhook_verification():
+    status, body = _call(
+        "GET",
+        "/webhook",
+        query_string=b"hub.mode=subscribe&hub.verify_token=test_verify_token&hub.challenge=abc",
+    )
+    assert status == 200
+    assert body == b"abc"
+
+
+def test_asgi_rejects_bad_token():
+    status, _ = _call(
+        "GET", "/webhook", query_string=b"hub.mode=subscribe&hub.verify_token=nope"
+    )
+    assert status == 403
+
+
+@patch("app.asgi.amessenger")
+@patch("app.asgi.adb")
+def test_asgi_help_command(mock_adb, mock_messenger):
+    mock_adb.get_user_by_phone = AsyncMock(return_value={
+        "id": "test-uuid",
+        "phone_number": "255712345678",
+        "onboarding_step": "complete",
+    })
+    mock_messenger.mark_as_read = AsyncMock()
+    mock_messenger.send_text = AsyncMock()
+
+    status, _ = _call("POST", "/webhook", _text_message("help"))
+
+    assert status == 200
+    mock_messenger.mark_as_read.assert_awaited_once_with("msg_001")
+    assert "PichaSafi Help" in mock_messenger.send_text.call_args[0][1]
+
+
+@patch("app.asgi.amessenger")
+@patch("app.asgi.adb")
+def test_asgi_bad_json_still_returns_200(mock_adb, mock_messenger):
+    status, _ = _call("POST", "/webhook", b"{not json")
+    assert status == 200
+
+
+def _image_message():
+    return json.dumps({
+        "entry": [{"changes": [{"value": {"messages": [{
+            "from": "255712345678",
+            "id": "msg_002",
+            "type": "image",
+            "image": {"id": "media_123"},
+        }]}}]}]
+    }).encode()
+
+
+def _jpeg(size=(64, 48)):
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", size, "gray").save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+ORIGINAL_JPEG = _jpeg()
+
+COMPLETE_USER = {
+    "id": "test-uuid",
+    "phone_number": "255712345678",
+    "onboarding_step": "complete",
+    "subscription_tier": "starter",
+    "monthly_limit": 30,
+    "images_created_this_month": 3,
+}
+
+
+@patch("app.asgi.audit_log")
+@patch("app.image_processor.process_product_photo", return_value=b"result")
+@patch("app.asgi.amessenger")
+@patch("app.asgi.adb")
+def test_asgi_image_success(mock_adb, mock_messenger, mock_process, mock_audit):
+    mock_adb.get_user_by_phone = AsyncMock(return_value=COMPLETE_USER)
+    mock_adb.upload_to_storage = AsyncMock(side_effect=lambda path, data, wait=True: f"https://cdn/{path}")
+    mock_adb.increment_image_count = AsyncMock(
+        return_value={**COMPLETE_USER, "images_created_this_month": 4}
+    )
+    mock_messenger.mark_as_read = AsyncMock()
+    mock_messenger.send_text = AsyncMock()
+    mock_messenger.download_media = AsyncMock(return_value=ORIGINAL_JPEG)
+    mock_messenger.send_image = AsyncMock()
+
+    status, _ = _call("POST", "/webhook", _image_message())
+
+    assert status == 200
+    assert mock_process.call_args[0][:2] == (ORIGINAL_JPEG, "#1A1A2E")
+    assert mock_process.call_args[0][2]["template"] is None
+    mock_adb.increment_image_count.assert_awaited_once_with("255712345678")
+    mock_audit.record_generated_image.assert_called_once()
+    url = mock_messenger.send_image.call_args[0][1]
+    assert url.startswith("https://cdn/generated/255712345678/")
+    assert "26/30" in mock_messenger.send_image.call_args.kwargs["caption"]
+    mock_messenger.send_text.assert_awaited_once()
+
+
+@patch("app.asgi.amessenger")
+@patch("app.asgi.adb")
+def test_asgi_image_failure_settles_notice(mock_adb, mock_messenger):
+    notice_done = []
+
+    async def send_text(phone, text, priority=None):
+        await asyncio.sleep(0.01)
+        notice_done.append(text)
+
+    mock_adb.get_user_by_phone = AsyncMock(return_value=COMPLETE_USER)
+    mock_adb.increment_image_count = AsyncMock()
+    mock_messenger.mark_as_read = AsyncMock()
+    mock_messenger.send_text = AsyncMock(side_effect=send_text)
+    mock_messenger.download_media = AsyncMock(side_effect=RuntimeError("graph down"))
+    mock_messenger.send_image = AsyncMock()
+
+    status, _ = _call("POST", "/webhook", _image_message())
+
+    assert status == 200
+    mock_messenger.send_image.assert_not_awaited()
+    mock_adb.increment_image_count.assert_not_awaited()
+    # Processing notice first, then the failure message
+    assert len(notice_done) == 2
+    assert notice_done[1].startswith("Sorry")
+
+
+def test_increment_image_count_retries_on_conflict():
+    from unittest.mock import MagicMock
+    from app import async_database as adb
+
+    rows = [
+        {"phone_number": "255700000000", "images_created_this_month": 3},
+        {"phone_number": "255700000000", "images_created_this_month": 4},
+    ]
+    client = MagicMock()
+    query = client.table.return_value.update.return_value.eq.return_value.eq.return_value
+    query.execute = AsyncMock(side_effect=[
+        MagicMock(data=[]),  # another image won the race
+        MagicMock(data=[{"images_created_this_month": 5}]),
+    ])
+
+    with patch.object(adb, "get_client", AsyncMock(return_value=client)), \
+            patch.object(adb, "get_user_by_phone", AsyncMock(side_effect=rows)):
+        updated = asyncio.run(adb.increment_image_count("255700000000"))
+
+    assert updated == {"images_created_this_month": 5}
+    updates = [c.args[0] for c in client.table.return_value.update.call_args_list]
+    assert updates == [{"images_created_this_month": 4}, {"images_created_this_month": 5}]
+
+
+def test_asgi_fallback_reports_unhealthy_when_startup_fails():
+    import importlib
+    import sys
+
+    sys.modules.pop("asgi", None)
+    with patch("app.config.Config.validate", side_effect=ValueError("missing env")):
+        fallback = importlib.import_module("asgi").app
+    sys.modules.pop("asgi", None)
+
+    for path, expected in (("/health", 503), ("/ready", 503), ("/webhook", 500)):
+        sent = []
+
+        async def send(event):
+            sent.append(event)
+
+        asyncio.run(fallback({"type": "http", "method": "GET", "path": path}, None, send))
+        assert sent[0]["status"] == expected
@@ -0,0 +1,75 @@
+import os
+import pytest
+from unittest.mock import patch
+from app import assets, memory
+from app.config import Config
+
+
+@pytest.fixture(autouse=True)
+def reset_layers():
+    assets._layers.clear()
+    assets._pinned_layers.clear()
+    yield
+    assets._layers.clear()
+    assets._pinned_layers.clear()
+
+
+def test_gradient_layer_is_cached_and_immutable():
+    first = assets.get_gradient_layer((20, 10), "#ff0000", "#000000")
+    second = assets.get_gradient_layer((20, 10), "#FF0000", "#000000")
+    assert first.size == (20, 10)
+    assert first.getpixel((0, 0))[0] > 200
+    assert len(assets._layers) == 1
+    assert first.tobytes() == second.tobytes()
+    # The caller gets its own image; the cached bytes never change
+    first.putpixel((0, 0), (0, 0, 0))
+    assert assets.get_gradient_layer((20, 10), "#ff0000", "#000000").getpixel((0, 0))[0] > 200
+
+
+def test_gradient_layer_lru_evicts_least_recent():
+    with patch.object(Config, "GRADIENT_CACHE_SIZE", 2):
+        assets.get_gradient_layer((4, 4), "#111111", "#000000")
+        assets.get_gradient_layer((4, 4), "#222222", "#000000")
+        assets.get_gradient_layer((4, 4), "#111111", "#000000")  # touch
+        assets.get_gradient_layer((4, 4), "#333333", "#000000")
+    colors = [key[1] for key in assets._layers]
+    assert colors == ["#111111", "#333333"]
+
+
+def test_pinned_layers_survive_eviction():
+    with patch.object(Config, "PRELOAD_GRADIENTS", ["#1A1A2E"]), \
+            patch.object(Config, "GRADIENT_CACHE_SIZE", 1):
+        assert assets.preload_gradients() == 1
+        pinned = next(iter(assets._pinned_layers))
+        assets.get_gradient_layer((4, 4), "#111111", "#000000")
+        assets.get_gradient_layer((4, 4), "#222222", "#000000")
+    assert pinned in assets._layers
+    assert len(assets._layers) == 2
+
+
+def test_preload_shared(tmp_path):
+    model = tmp_path / "u2net.onnx"
+    model.write_bytes(b"weights" * 100)
+    with patch.object(Config, "PRELOAD_GRADIENTS", ["#FF6B00"]), \
+            patch.object(Config, "SHARED_MODEL_FILES", [str(model), str(tmp_path / "missing")]):
+        result = assets.preload_shared()
+    assert result["templates"] >= 1
+    assert result["fonts"] >= 1
+    assert result["gradients"] == 1
+    assert result["model_files"] == 1
+    assert assets.map_file(str(model))[:7] == b"weights"
+
+
+def test_font_loaded_once_per_size():
+    assert assets.get_font("bold", 30) is assets.get_font("bold", 30)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="needs Linux smaps_rollup")
+def test_memory_report_for_current_process():
+    result = memory.report(os.getpid())
+    master = result["master"]
+    assert master["pid"] == os.getpid()
+    assert master["unique_kb"] > 0
+    assert master["rss_kb"] >= master["unique_kb"]
+    assert result["total_pss_kb"] >= master["pss_kb"]
+    assert "Total PSS" in memory.format_report(result)
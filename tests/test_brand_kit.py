@@ -0,0 +1,77 @@
+import io
+import json
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from app import brand_kit, image_processor, onboarding
+from app.brand_kit import NEAR_BLACK, WHITE
+
+
+def test_contrast_ratio_matches_wcag():
+    assert brand_kit.contrast_ratio(WHITE, (0, 0, 0)) == pytest.approx(21.0)
+    assert brand_kit.contrast_ratio(WHITE, WHITE) == pytest.approx(1.0)
+    # WCAG reference value for #767676 on white
+    assert brand_kit.contrast_ratio((118, 118, 118), WHITE) == pytest.approx(4.54, abs=0.01)
+
+
+def test_picker_prefers_first_readable_candidate():
+    assert brand_kit.pick_text_color((26, 26, 46)) == WHITE
+    assert brand_kit.pick_text_color((255, 230, 0)) == NEAR_BLACK
+    # Must hold on every background it is drawn over
+    assert brand_kit.pick_text_color([(255, 255, 255), (40, 40, 40)], [WHITE, NEAR_BLACK, (0, 0, 0)]) == (0, 0, 0)
+    # Nothing passes: the best worst case wins
+    assert brand_kit.pick_text_color((128, 128, 128), [(140, 140, 140), NEAR_BLACK]) == NEAR_BLACK
+
+
+def test_kit_is_json_ready_and_safe():
+    kit = brand_kit.build("#ff6b00", "#FFD700", "#FAFAFA")
+    assert json.loads(json.dumps(kit)) == kit
+    assert kit["source"] == ["#FF6B00", "#FFD700", "#FAFAFA"]
+    assert kit["gradient"] == [[250, 250, 250], [175, 175, 175]]
+    # The yellow secondary is unreadable on a light background
+    assert kit["text_on_bg"] == list(NEAR_BLACK)
+    for stop in kit["gradient"]:
+        assert brand_kit.contrast_ratio(kit["text_on_bg"], stop) >= brand_kit.AA_CONTRAST
+
+
+def test_onboarding_stores_kit_with_color():
+    user = {"phone_number": "255700000001", "onboarding_step": "colors", "brand_color_bg": "#003300"}
+    with patch("app.onboarding.db") as db, patch("app.onboarding.messenger"):
+        onboarding.handle_onboarding("255700000001", user, "text", "#0066ff")
+    updates = db.update_user.call_args[0][1]
+    assert updates["brand_color_primary"] == "#0066FF"
+    assert updates["brand_kit"]["source"] == ["#0066FF", "#FFFFFF", "#003300"]
+    assert updates["onboarding_step"] == "style"
+
+
+def test_for_user_uses_row_kit_only_while_current():
+    user = {"brand_color_primary": "#0066FF", "brand_kit": brand_kit.build("#0066FF")}
+    kit = brand_kit.for_user(user)
+    assert kit["primary"] == (0, 102, 255) and isinstance(kit["gradient"][1], tuple)
+
+    # Colors changed outside onboarding: the stored kit is ignored
+    user["brand_color_bg"] = "#FFFFFF"
+    assert brand_kit.for_user(user)["bg"] == (255, 255, 255)
+    assert brand_kit.for_user({})["source"] == [
+        brand_kit.DEFAULT_PRIMARY, brand_kit.DEFAULT_SECONDARY, brand_kit.DEFAULT_BG
+    ]
+
+
+def test_render_takes_gradient_from_kit(monkeypatch):
+    seen = []
+    monkeypatch.setattr(image_processor, "OUTPUT_SIZE", (32, 32))
+    monkeypatch.setattr(image_processor.assets, "get_gradient_layer",
+                        lambda size, top, bottom, version: seen.append((top, bottom)) or Image.new("RGB", size))
+    photo = io.BytesIO()
+    Image.new("RGB", (16, 16), "red").save(photo, "JPEG")
+
+    kit = brand_kit.for_user({"brand_color_bg": "#335577"})
+    image_processor._render(photo.getvalue(), "#000000", {}, kit)
+    image_processor._render(photo.getvalue(), "#000000", {"color": "#335577"}, None)
+    assert seen == [((51, 85, 119), (35, 59, 83))] * 2
+
+    # Same pixels as the hex path the golden images were made with
+    assert image_processor.create_gradient_background((8, 8), *kit["gradient"]).tobytes() == \
+        image_processor.create_gradient_background(
+            (8, 8), "#335577", image_processor._darken_color("#335577", 0.7)
+        ).tobytes()
@@ -0,0 +1,146 @@
+import json
+import pytest
+import threading
+from unittest.mock import patch
+from app import broadcast
+from app.config import Config
+from app.rate_limit import PRIORITY_BULK
+
+USERS = [{"id": f"u{n:03d}", "phone_number": f"2557{n:08d}"} for n in range(23)]
+
+
+class FakeRecipients:
+    """users ordered by id, paged by keyset like list_broadcast_recipients."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda r: r["id"])
+        self.calls = []
+
+    def page(self, after_id=None, limit=500):
+        self.calls.append(after_id)
+        return [dict(r) for r in self.rows if after_id is None or r["id"] > after_id][:limit]
+
+
+@pytest.fixture
+def recipients():
+    fake = FakeRecipients(USERS)
+    with patch("app.broadcast.db") as mock_db:
+        mock_db.list_broadcast_recipients.side_effect = fake.page
+        yield fake
+
+
+class SendLog(list):
+    """send_text calls, plus scripted replies per phone."""
+
+    def __init__(self):
+        super().__init__()
+        self.replies = {}
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Recorded send_text calls; set sent.replies to script responses per phone."""
+    calls, lock = SendLog(), threading.Lock()
+
+    def send_text(to, message, priority=None):
+        with lock:
+            calls.append((to, message, priority))
+            replies = calls.replies.get(to)
+        return replies.pop(0) if replies else {"messages": [{"id": "wamid"}]}
+
+    monkeypatch.setattr(broadcast.messenger, "send_text", send_text)
+    monkeypatch.setattr(broadcast, "RETRY_BASE_DELAY", 0)
+    return calls
+
+
+def _journal(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sends_to_everyone_once_across_pages(recipients, sent, tmp_path):
+    job = broadcast.Broadcast("New templates!", journal_dir=str(tmp_path), concurrency=4, page_size=10)
+    stats = job.run()
+
+    assert sorted(to for to, _, _ in sent) == sorted(u["phone_number"] for u in USERS)
+    assert {(message, priority) for _, message, priority in sent} == {("New templates!", PRIORITY_BULK)}
+    assert (stats["sent"], stats["failed"], stats["unknown"], stats["finished"]) == (23, 0, 0, True)
+    # Keyset pages: start, after the 10th id, after the 20th
+    assert recipients.calls == [None, "u009", "u019"]
+    journal = _journal(job.path)
+    assert [e["id"] for e in journal if e["t"] == "cursor"] == ["u009", "u019", "u022"]
+    assert journal[-1] == {"t": "end"}
+
+
+def test_resume_skips_handled_and_uncertain_recipients(recipients, sent, tmp_path):
+    job = broadcast.Broadcast("Promo", journal_dir=str(tmp_path), page_size=10)
+    # A crash mid-way through the second page: u010 went out, u011 was in flight
+    with open(job.path, "w") as f:
+        for entry in [
+            *({"t": "pending", "phone": USERS[n]["phone_number"]} for n in range(10)),
+            *({"t": "sent", "phone": USERS[n]["phone_number"]} for n in range(10)),
+            {"t": "cursor", "id": "u009"},
+            {"t": "pending", "phone": USERS[10]["phone_number"]},
+            {"t": "sent", "phone": USERS[10]["phone_number"]},
+            {"t": "pending", "phone": USERS[11]["phone_number"]},
+        ]:
+            f.write(json.dumps(entry) + "\n")
+        f.write('{"t": "pend')  # torn write
+
+    resumed = broadcast.Broadcast("Promo", journal_dir=str(tmp_path), page_size=10)
+    stats = resumed.run()
+
+    assert recipients.calls[0] == "u009"
+    assert sorted(to for to, _, _ in sent) == [u["phone_number"] for u in USERS[12:]]
+    assert (stats["sent"], stats["unknown"], stats["finished"]) == (22, 1, True)
+
+
+def test_finished_broadcast_is_not_sent_again(recipients, sent, tmp_path):
+    broadcast.Broadcast("Promo", journal_dir=str(tmp_path)).run()
+    sent.clear()
+
+    again = broadcast.Broadcast("Promo", journal_dir=str(tmp_path))
+    assert again.finished
+    assert again.run()["sent"] == 23
+    assert sent == []
+    # A different message is a different broadcast
+    assert broadcast.Broadcast("Other", journal_dir=str(tmp_path)).id != again.id
+
+
+def test_only_throttled_sends_are_retried(recipients, sent, tmp_path):
+    throttled, broken = USERS[0]["phone_number"], USERS[1]["phone_number"]
+    sent.replies = {
+        throttled: [{"error": "rate limited", "queued": False},
+                    {"error": "429 Too Many Requests", "status": 429, "queued": False}],
+        broken: [{"error": "400 Bad Request", "status": 400, "queued": False}],
+    }
+    stats = broadcast.Broadcast("Promo", journal_dir=str(tmp_path), max_attempts=3).run()
+
+    assert [to for to, _, _ in sent].count(throttled) == 3
+    assert [to for to, _, _ in sent].count(broken) == 1
+    assert (stats["sent"], stats["failed"]) == (22, 1)
+
+
+def test_stopped_broadcast_resumes_unsent(recipients, sent, tmp_path):
+    job = broadcast.Broadcast("Promo", journal_dir=str(tmp_path), concurrency=1, page_size=10)
+    job.stop()
+    assert job.run()["finished"] is False
+    assert sent == []
+
+    assert broadcast.Broadcast("Promo", journal_dir=str(tmp_path), page_size=10).run()["sent"] == 23
+
+
+def test_broadcast_cli(app, recipients, sent, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BROADCAST_DIR", str(tmp_path))
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["broadcast", "--message", "Hi", "--dry-run"])
+    assert "Would send to 23 users" in result.output
+    assert sent == []
+
+    result = runner.invoke(args=["broadcast", "--message", "Hi", "--page-size", "5"])
+    assert result.exit_code == 0, result.output
+    assert "sent 23" in result.output and "Done." in result.output
+    result = runner.invoke(args=["broadcast", "--message", "Hi"])
+    assert "already finished" in result.output
+    assert len(sent) == 23
@@ -0,0 +1,72 @@
+import random
+import string
+import time
+import pytest
+from app.commands import DEFAULT_OPTIONS, parse_caption
+
+
+@pytest.mark.parametrize("caption, expected", [
+    ("poster 85000", {"template": "product_showcase", "price": 85000}),
+    ("sale 30%", {"template": "sale_promo", "discount": 30}),
+    ("Sale -30% off", {"template": "sale_promo", "discount": 30}),
+    ("ofa 20% tsh 15,000", {"template": "sale_promo", "discount": 20, "price": 15000, "currency": "TZS"}),
+    ("new white", {"template": "new_arrival", "background": "solid", "color": "#FFFFFF"}),
+    ("mpya #ff6b00", {"template": "new_arrival", "color": "#FF6B00"}),
+    ("85k", {"template": "product_showcase", "price": 85000}),
+    ("Bei 1.2m/=", {"price": 1_200_000, "unknown": ("bei",)}),
+    ("KSh.2,500", {"price": 2500, "currency": "KES"}),
+    ("tsh50", {"price": 50}),
+    ("85,000/=", {"price": 85000}),
+    ("shoes size 42", {"template": None, "price": None, "unknown": ("shoes", "size", "42")}),
+    ("sale 150%", {"discount": None, "unknown": ("150%",)}),
+    ("solid", {"template": None, "background": "solid"}),
+])
+def test_parse_caption(caption, expected):
+    options = parse_caption(caption)
+    for key, value in expected.items():
+        assert options[key] == value, key
+
+
+@pytest.mark.parametrize("caption", [None, "", "   ", "\n"])
+def test_empty_caption_returns_defaults(caption):
+    options = parse_caption(caption)
+    assert options == DEFAULT_OPTIONS
+    assert options is not DEFAULT_OPTIONS
+
+
+def test_fuzz_never_raises_and_stays_in_range():
+    rng = random.Random(1234)
+    alphabet = string.printable + "%#/=,.-kKmM€₹ñü🙂"
+    words = ["sale", "poster", "tsh", "ksh", "30%", "85,000", "1.2m", "#FF6B00", "/=", "new", "white",
+             "1e400", "9e9k", "1.5e3m", "inf", "nan", "9" * 309, "9" * 400 + "k", "1" + "0" * 500 + ".5m"]
+    for _ in range(5000):
+        if rng.random() < 0.5:
+            caption = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        else:
+            caption = " ".join(
+                rng.choice(words) if rng.random() < 0.6 else str(rng.randint(0, 10 ** rng.choice((7, 300, 600))))
+                for _ in range(rng.randint(1, 8))
+            )
+        options = parse_caption(caption)
+        assert set(options) == set(DEFAULT_OPTIONS)
+        assert options["price"] is None or 0 < options["price"] <= 1_000_000_000
+        assert options["discount"] is None or 0 < options["discount"] < 100
+        assert options["color"] is None or (len(options["color"]) == 7 and options["color"].startswith("#"))
+        assert options["background"] in ("gradient", "solid")
+        assert options["currency"] in ("TZS", "KES")
+
+
+@pytest.mark.parametrize("caption", ["poster " + "9" * 400, "tsh " + "9" * 309 + "m", "sale 30% " + "1" * 1000])
+def test_huge_numbers_are_not_prices(caption):
+    options = parse_caption(caption)
+    assert options["price"] is None and options["unknown"]
+
+
+def test_parser_speed():
+    captions = ["", "poster 85000", "sale 30% tsh 15,000", "New arrivals in store today, karibu!"] * 2500
+    started = time.perf_counter()
+    for caption in captions:
+        parse_caption(caption)
+    per_caption_us = (time.perf_counter() - started) / len(captions) * 1e6
+    # Typically ~3us; the bound only catches pathological regressions
+    assert per_caption_us < 100
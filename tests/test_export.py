@@ -0,0 +1,124 @@
+import csv
+import gzip
+import json
+import os
+import pytest
+from unittest.mock import patch
+from app import export, webhook
+from app.config import Config
+
+IMAGES = [
+    {
+        "id": f"i{n:03d}",
+        "user_id": f"u{n % 3}",
+        "image_type": "poster" if n % 2 else "product_enhance",
+        "template_used": None,
+        # Pairs share a timestamp, so the id breaks ties in the cursor
+        "created_at": f"2026-05-01T10:{n // 2:02d}:00+00:00",
+        "metadata": {"caption": "sale 30%", "render_ms": 900 + n, "input_bytes": 2_000_000,
+                     "output_bytes": 180_000, "stages_ms": {"enhance_image": 40, "remove_background": 800}},
+    }
+    for n in range(25)
+]
+USERS = [
+    {"id": f"u{n}", "phone_number": f"2557{n:08d}", "business_name": f"Duka {n}", "subscription_tier": "free",
+     "monthly_limit": 3, "created_at": f"2026-04-0{n + 1}T09:00:00+00:00"}
+    for n in range(3)
+]
+
+
+class FakeTables:
+    """Keyset pages in (created_at, id) order, like list_export_page."""
+
+    def __init__(self):
+        self.tables = {"generated_images": list(IMAGES), "users": list(USERS)}
+        self.pages = []
+
+    def page(self, table, columns, after=None, before=None, limit=1000):
+        rows = sorted(self.tables[table], key=lambda r: (r["created_at"], r["id"]))
+        rows = [r for r in rows if (after is None or (r["created_at"], r["id"]) > tuple(after))
+                and (before is None or r["created_at"] < before)][:limit]
+        self.pages.append((table, len(rows)))
+        return [dict(r) for r in rows]
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    monkeypatch.setattr(Config, "EXPORT_LAG", 0)
+    fake = FakeTables()
+    with patch("app.export.db") as mock_db:
+        mock_db.list_export_page.side_effect = fake.page
+        yield fake
+
+
+def _read(path):
+    with gzip.open(path, "rt", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_streams_pages_to_csv_with_metadata_columns(tables, tmp_path):
+    images, users = export.run(str(tmp_path), page_size=10)
+
+    assert [n for t, n in tables.pages if t == "generated_images"] == [10, 10, 5]
+    assert (images["rows"], users["rows"]) == (25, 3)
+    assert images["bytes"] == os.path.getsize(images["path"]) > 0
+    rows = _read(images["path"])
+    assert [r["id"] for r in rows] == [r["id"] for r in IMAGES]
+    assert rows[4]["render_ms"] == "904" and rows[4]["stage_enhance_image_ms"] == "40"
+    assert "caption" not in rows[0] and "phone_number" not in _read(users["path"])[0]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_incremental_run_starts_after_watermark(tables, tmp_path):
+    export.run(str(tmp_path), page_size=10)
+    assert export.load_state(str(tmp_path))["generated_images"] == [IMAGES[-1]["created_at"], "i024"]
+
+    tables.tables["generated_images"].append(dict(IMAGES[0], id="i999", created_at="2026-05-02T08:00:00+00:00"))
+    images, users = export.run(str(tmp_path), page_size=10, tables=None)
+    assert [r["id"] for r in _read(images["path"])] == ["i999"]
+    assert (users["rows"], users["path"]) == (0, None)
+
+    # --full starts over
+    images, _ = export.run(str(tmp_path), page_size=10, full=True)
+    assert images["rows"] == 26
+
+
+def test_failed_run_leaves_state_and_no_partial_file(tables, tmp_path):
+    def flaky(table, columns, after=None, **kwargs):
+        if after:
+            raise ConnectionError("supabase went away")
+        return tables.page(table, columns, after=after, **kwargs)
+
+    with patch("app.export.db") as mock_db:
+        mock_db.list_export_page.side_effect = flaky
+        with pytest.raises(ConnectionError):
+            export.run(str(tmp_path), page_size=10, tables=["generated_images"])
+    assert os.listdir(tmp_path) == []
+
+
+def test_recent_rows_wait_for_next_run(tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "EXPORT_LAG", 3600)
+    tables.tables["users"].append(dict(USERS[0], id="u9", created_at="2999-01-01T00:00:00+00:00"))
+    _, users = export.run(str(tmp_path))
+    assert users["rows"] == 3
+
+
+def test_parquet(tables, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    images, _ = export.run(str(tmp_path), fmt="parquet", page_size=10)
+    table = pq.read_table(images["path"])
+    assert table.num_rows == 25 and table.schema.field("created_at").type.tz == "UTC"
+
+
+def test_cli(app, tables, tmp_path):
+    result = app.test_cli_runner().invoke(args=["export-analytics", "--out", str(tmp_path), "--table", "users"])
+    assert result.exit_code == 0, result.output
+    assert "users: 3 rows" in result.output
+    assert json.loads((tmp_path / "export_state.json").read_text()).keys() == {"users"}
+
+
+def test_image_metadata_records_timing_and_sizes():
+    metadata = webhook.image_metadata("sale 30%", b"x" * 2048, b"y" * 512, 1.2345, downscaled=True)
+    assert metadata == {"render_ms": 1234, "input_bytes": 2048, "output_bytes": 512,
+                        "caption": "sale 30%", "downscaled": True}
+    assert "caption" not in webhook.image_metadata(None, b"", b"", 0.1, False)
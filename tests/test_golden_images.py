@@ -0,0 +1,56 @@
+import io
+import pytest
+from PIL import Image, ImageDraw
+from bench import image_corpus as corpus
+
+
+@pytest.mark.parametrize("name", sorted(corpus.CASES))
+def test_render_matches_golden(name):
+    golden = corpus.load_golden(name)
+    assert golden is not None, f"no golden for {name}; run python -m bench.image_bench --update-golden"
+    result = corpus.diff(corpus.render(name), golden)
+    assert corpus.within_tolerance(result), (
+        f"{name} drifted from its golden: {result} "
+        f"(limits mean {corpus.MAX_MEAN_DIFF}, block {corpus.MAX_BLOCK_DIFF})"
+    )
+
+
+def test_rendered_output_is_upright_1080_jpeg():
+    img = Image.open(io.BytesIO(corpus.render("phone_portrait_exif6")))
+    assert (img.format, img.size) == ("JPEG", (1080, 1080))
+
+
+def test_diff_catches_local_change():
+    golden = corpus.load_golden("poster_sale")
+    # A badge-sized blot: invisible in the global mean, caught per block
+    edited = golden.copy()
+    ImageDraw.Draw(edited).rectangle((10, 40, 40, 55), fill=(20, 20, 40))
+    result = corpus.diff(edited, golden)
+    assert result["mean"] < corpus.MAX_MEAN_DIFF
+    assert not corpus.within_tolerance(result)
+
+
+def test_diff_tolerates_reencoding():
+    rendered = corpus.render("phone_landscape")
+    buf = io.BytesIO()
+    Image.open(io.BytesIO(rendered)).save(buf, format="JPEG", quality=80)
+    assert corpus.within_tolerance(corpus.diff(buf.getvalue(), rendered))
+
+
+def test_bench_compare_flags_regressions():
+    from bench.image_bench import compare
+
+    def case(total, enhance, rss, out):
+        return {"ms": {"total": total, "stages": {"enhance_image": enhance}},
+                "peak_rss_kb": rss, "output_bytes": out, "golden": {"mean": 0.0, "block_max": 0.0}}
+
+    baseline = {"cases": {"a": case(100.0, 60.0, 20000, 30000), "b": case(50.0, 20.0, 20000, 30000)}}
+    current = {"cases": {"a": case(130.0, 61.0, 21000, 30100), "b": case(30.0, 8.0, 40000, 36000)}}
+    found = {(f["case"], f["metric"]): f["regression"] for f in compare(current, baseline, 0.15)}
+    assert found == {
+        ("a", "ms.total"): True,
+        ("b", "ms.total"): False,
+        ("b", "ms.enhance_image"): False,
+        ("b", "peak_rss_kb"): True,
+        ("b", "output_bytes"): True,
+    }
@@ -0,0 +1,96 @@
+from unittest.mock import patch
+from app import history
+from bench import history_bench
+
+USER = {"id": "user-1", "phone_number": "255712345678", "onboarding_step": "complete"}
+
+
+def _rows(n):
+    return [
+        {
+            "id": f"img-{i}",
+            "created_at": f"2026-10-19T10:{59 - i:02d}:00+00:00",
+            "image_type": "product_enhance",
+            "template_used": None,
+            "result_image_url": f"https://cdn/generated/{i}.jpg",
+        }
+        for i in range(n)
+    ]
+
+
+def _webhook_message(msg):
+    return {"entry": [{"changes": [{"value": {"messages": [
+        {"from": "255712345678", "id": "msg_1", **msg}
+    ]}}]}]}
+
+
+@patch("app.history.messenger")
+@patch("app.history.db")
+def test_history_page_with_cursor_row(mock_db, mock_messenger):
+    mock_db.list_generated_images.return_value = _rows(history.PAGE_SIZE + 1)
+    history.send_history("255712345678", USER)
+
+    mock_db.list_generated_images.assert_called_once_with("user-1", history.PAGE_SIZE + 1, before=None)
+    rows = mock_messenger.send_list.call_args[0][3][0]["rows"]
+    assert len(rows) == 10
+    assert rows[0] == {"id": "resend:img-0", "title": "19 Oct 2026, 10:59", "description": "Product photo"}
+    last = _rows(history.PAGE_SIZE)[-1]
+    assert rows[-1]["id"] == f"history:{last['created_at']}|{last['id']}"
+    assert all(len(r["title"]) <= 24 and len(r["id"]) <= 200 for r in rows)
+
+
+@patch("app.history.messenger")
+@patch("app.history.db")
+def test_last_page_has_no_cursor_row(mock_db, mock_messenger):
+    mock_db.list_generated_images.return_value = _rows(3)
+    history.send_history("255712345678", USER)
+    rows = mock_messenger.send_list.call_args[0][3][0]["rows"]
+    assert [r["id"] for r in rows] == ["resend:img-0", "resend:img-1", "resend:img-2"]
+
+
+@patch("app.history.messenger")
+@patch("app.history.db")
+def test_next_page_reply_uses_keyset_cursor(mock_db, mock_messenger):
+    mock_db.list_generated_images.return_value = []
+    history.handle_reply("255712345678", USER, "history:2026-10-19T10:51:00+00:00|img-8")
+    mock_db.list_generated_images.assert_called_once_with(
+        "user-1", history.PAGE_SIZE + 1, before=("2026-10-19T10:51:00+00:00", "img-8")
+    )
+    assert mock_messenger.send_text.call_args[0][1] == history.NO_MORE_MESSAGE
+
+
+@patch("app.history.messenger")
+@patch("app.history.db")
+def test_resend_sends_stored_url_scoped_to_user(mock_db, mock_messenger):
+    mock_db.get_generated_image.return_value = _rows(1)[0]
+    history.handle_reply("255712345678", USER, "resend:img-0")
+    mock_db.get_generated_image.assert_called_once_with("user-1", "img-0")
+    assert mock_messenger.send_image.call_args[0][1] == "https://cdn/generated/0.jpg"
+
+    mock_db.get_generated_image.return_value = None
+    history.handle_reply("255712345678", USER, "resend:someone-elses")
+    assert mock_messenger.send_text.call_args[0][1] == history.IMAGE_NOT_FOUND_MESSAGE
+
+
+@patch("app.webhook.history")
+@patch("app.webhook.messenger")
+@patch("app.webhook.db")
+def test_webhook_routes_history_command_and_replies(mock_db, mock_messenger, mock_history, client):
+    mock_db.get_user_by_phone.return_value = USER
+    mock_history.is_history_reply.side_effect = history.is_history_reply
+
+    client.post("/webhook", json=_webhook_message({"type": "text", "text": {"body": "History"}}))
+    mock_history.send_history.assert_called_once_with("255712345678", USER)
+
+    client.post("/webhook", json=_webhook_message({
+        "type": "interactive",
+        "interactive": {"type": "list_reply", "list_reply": {"id": "resend:img-3", "title": "x"}},
+    }))
+    mock_history.handle_reply.assert_called_once_with("255712345678", USER, "resend:img-3")
+
+
+def test_history_bench_strategies_agree():
+    # run() asserts every strategy returns the same page at every depth
+    result = history_bench.run(rows_per_user=300, users=2, repeats=1)
+    assert set(result["p50_ms"]["composite"]) == {0, 10}
+    assert "TEMP B-TREE" not in result["plans"]["composite"]
@@ -0,0 +1,117 @@
+import io
+import struct
+import zlib
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from app import image_guard, memory
+from app.config import Config
+from app.image_processor import process_product_photo
+from tests.test_prefetch import IMAGE_MESSAGE
+
+
+def _encode(img, fmt="JPEG", **kwargs):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def _png_header(width, height):
+    """A tiny PNG that claims width x height (the pixel data is truncated)."""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", ihdr)
+        + _chunk(b"IDAT", zlib.compress(b"\0" * 1024))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def test_normal_photo_is_untouched():
+    data = _encode(Image.new("RGB", (400, 300), "red"))
+    assert image_guard.inspect(data) == {
+        "format": "JPEG", "size": (400, 300), "pixels": 120000, "downscale": False,
+    }
+    img, downscaled = image_guard.decode(data)
+    assert (img.size, img.mode, downscaled) == ((400, 300), "RGBA", False)
+
+
+def test_large_jpeg_is_drafted_to_budget(monkeypatch):
+    monkeypatch.setattr(Config, "IMAGE_MAX_PIXELS", 20000)
+    data = _encode(Image.new("RGB", (800, 600), "blue"))
+    assert image_guard.inspect(data)["downscale"] is True
+    img, downscaled = image_guard.decode(data)
+    assert downscaled
+    assert img.size[0] * img.size[1] <= 20000
+    assert img.size[0] / img.size[1] == pytest.approx(4 / 3, rel=0.02)
+
+
+def test_large_png_is_reduced_after_decode(monkeypatch):
+    monkeypatch.setattr(Config, "IMAGE_MAX_PIXELS", 20000)
+    img, downscaled = image_guard.decode(_encode(Image.new("RGB", (800, 600)), "PNG"))
+    assert downscaled and img.size[0] * img.size[1] <= 20000
+
+
+@pytest.mark.parametrize("side", [10000, 30000])  # our budget / PIL's own bomb check
+def test_decompression_bomb_rejected_from_header(side):
+    bomb = _png_header(side, side)
+    with pytest.raises(image_guard.ImageTooLarge):
+        image_guard.inspect(bomb)
+    with pytest.raises(image_guard.ImageTooLarge):
+        image_guard.decode(bomb)
+
+
+def test_png_over_decode_budget_rejected(monkeypatch):
+    monkeypatch.setattr(Config, "IMAGE_MAX_DECODE_MB", 1)
+    with pytest.raises(image_guard.ImageTooLarge, match="MB to decode"):
+        image_guard.inspect(_encode(Image.new("RGB", (600, 600)), "PNG"))
+
+
+def test_oversized_upload_rejected(monkeypatch):
+    monkeypatch.setattr(Config, "IMAGE_MAX_BYTES", 100)
+    with pytest.raises(image_guard.ImageTooLarge):
+        image_guard.inspect(_encode(Image.new("RGB", (64, 64))))
+
+
+def test_exif_orientation_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 CW
+    data = _encode(Image.new("RGB", (400, 300)), exif=exif)
+    img, _ = image_guard.decode(data)
+    assert img.size == (300, 400)
+
+
+def test_track_peak_reports_growth():
+    with memory.track_peak() as peak:
+        block = bytearray(32 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])  # touch every page
+    if not peak:
+        pytest.skip("/proc/self/status not available")
+    assert peak["peak_kb"] >= peak["start_kb"]
+    assert peak["growth_kb"] >= 16 * 1024
+
+
+def test_process_product_photo_rejects_bomb():
+    with pytest.raises(image_guard.ImageTooLarge):
+        process_product_photo(_png_header(30000, 30000))
+
+
+@patch("app.webhook.billing")
+@patch("app.webhook.messenger")
+@patch("app.webhook.db")
+def test_webhook_answers_too_large(mock_db, mock_messenger, mock_billing, client):
+    mock_db.get_user_by_phone.return_value = {"id": "u1", "onboarding_step": "complete"}
+    mock_billing.check_usage.return_value = {"allowed": True}
+    mock_messenger.download_media.return_value = _png_header(30000, 30000)
+
+    resp = client.post("/webhook", json=IMAGE_MESSAGE)
+
+    assert resp.status_code == 200
+    assert mock_messenger.send_text.call_args[0][1] == image_guard.IMAGE_TOO_LARGE_MESSAGE
+    mock_billing.record_usage.assert_not_called()
+    mock_messenger.send_image.assert_not_called()
@@ -87,3 +87,34 @@ def test_to_jpeg_bytes_converts_rgba():
     loaded = Image.open(io.BytesIO(result))
     assert loaded.format == "JPEG"
     assert loaded.mode == "RGB"
+
+
+def _photo_bytes():
+    buf = io.BytesIO()
+    Image.new("RGB", (200, 200), (30, 160, 60)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_process_photo_with_poster_options_draws_label_and_badge():
+    from app.image_processor import process_product_photo
+
+    plain = Image.open(io.BytesIO(process_product_photo(_photo_bytes(), "#1A1A2E")))
+    poster = Image.open(io.BytesIO(process_product_photo(
+        _photo_bytes(), "#1A1A2E",
+        {"template": "sale_promo", "price": 85000, "currency": "TZS", "discount": 30},
+    )))
+    assert poster.size == (1080, 1080)
+    # White price pill at price_zone, red badge at top left
+    assert min(poster.getpixel((540 - 150, 900))) > 200
+    assert poster.getpixel((50, 180))[0] > 180 and poster.getpixel((50, 180))[1] < 100
+    assert plain.getpixel((540 - 150, 900)) != poster.getpixel((540 - 150, 900))
+
+
+def test_process_photo_solid_background_option():
+    from app.image_processor import process_product_photo
+
+    img = Image.open(io.BytesIO(process_product_photo(
+        _photo_bytes(), "#1A1A2E", {"background": "solid", "color": "#FFFFFF"}
+    )))
+    assert min(img.getpixel((5, 5))) > 245
+    assert min(img.getpixel((5, 1070))) > 245
@@ -0,0 +1,129 @@
+import io
+import pytest
+from unittest.mock import patch
+from PIL import Image, ImageDraw
+from app import image_guard, logo_processor
+from app.config import Config
+
+
+def _logo_on_white(size=(400, 200), fmt="JPEG"):
+    img = Image.new("RGB", size, (255, 255, 255))
+    ImageDraw.Draw(img).rectangle((100, 50, 299, 149), fill=(200, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def _open(png):
+    img = Image.open(io.BytesIO(png))
+    assert img.format == "PNG"
+    return img
+
+
+def test_flat_background_is_keyed_out_and_trimmed():
+    result = logo_processor.normalize_logo(_logo_on_white(), (140, 140))
+    full = _open(result["full"])
+    assert full.mode == "RGBA"
+    # Trimmed to the red mark (JPEG edges may add a pixel or two)
+    assert 198 <= full.width <= 204 and 98 <= full.height <= 104
+    assert full.getpixel((full.width // 2, full.height // 2))[3] == 255
+
+
+def test_zone_asset_is_exact_zone_size_and_centred():
+    zone = _open(logo_processor.normalize_logo(_logo_on_white(), (140, 140))["zone"])
+    assert zone.size == (140, 140)
+    assert zone.getpixel((0, 0))[3] == 0  # letterbox is transparent
+    assert zone.getpixel((70, 70))[3] == 255
+    bbox = zone.getchannel("A").getbbox()
+    assert bbox[0] == 0 and bbox[2] == 140  # wide logo fills the width
+
+
+def test_existing_transparency_is_kept():
+    img = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+    ImageDraw.Draw(img).ellipse((10, 10, 89, 89), fill=(255, 255, 255, 255))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    full = _open(logo_processor.normalize_logo(buf.getvalue(), (140, 140))["full"])
+    # White mark on transparency must not be keyed away
+    assert full.getpixel((full.width // 2, full.height // 2)) == (255, 255, 255, 255)
+
+
+def test_busy_background_is_not_keyed():
+    img = Image.new("RGB", (100, 100), (0, 0, 255))
+    ImageDraw.Draw(img).rectangle((0, 0, 49, 99), fill=(0, 255, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    full = _open(logo_processor.normalize_logo(buf.getvalue(), (140, 140))["full"])
+    assert full.getchannel("A").getextrema() == (255, 255)
+
+
+def test_large_logo_is_downscaled():
+    full = _open(logo_processor.normalize_logo(_logo_on_white((4000, 2000)), (140, 140))["full"])
+    assert max(full.size) <= logo_processor.LOGO_FULL_MAX
+
+
+@patch("app.logo_processor.db")
+def test_ingest_logo_stores_derivatives_and_returns_keys(mock_db):
+    mock_db.upload_to_storage.side_effect = lambda key, data, content_type, wait=True: f"https://cdn/{key}"
+    fields = logo_processor.ingest_logo("255712345678", _logo_on_white())
+
+    assert fields["logo_zone_key"].endswith("_140x140.png")
+    assert fields["logo_url"] == f"https://cdn/{fields['logo_key']}"
+    stored = {c.args[0]: c for c in mock_db.upload_to_storage.call_args_list}
+    assert set(stored) == {fields["logo_original_key"], fields["logo_key"], fields["logo_zone_key"]}
+    assert stored[fields["logo_original_key"]].kwargs["wait"] is False
+    assert stored[fields["logo_zone_key"]].args[2] == "image/png"
+
+
+def test_composite_logo_pastes_into_zone():
+    zone = _open(logo_processor.normalize_logo(_logo_on_white(), (140, 140))["zone"])
+    canvas = Image.new("RGB", (1080, 1080), (0, 0, 0))
+    logo_processor.composite_logo(canvas, zone)
+    assert canvas.getpixel((900 + 70, 40 + 70))[0] > 150  # red mark
+    assert canvas.getpixel((900 + 2, 40 + 2)) == (0, 0, 0)  # transparent corner
+
+
+@patch("app.onboarding.messenger")
+@patch("app.onboarding.db")
+def test_onboarding_logo_step_records_derivative_keys(mock_db, mock_messenger):
+    from app import onboarding
+
+    mock_messenger.download_media.return_value = _logo_on_white()
+    fields = {"logo_url": "u", "logo_original_key": "o", "logo_key": "k", "logo_zone_key": "z"}
+    with patch.object(logo_processor, "ingest_logo", return_value=fields) as ingest:
+        onboarding.handle_onboarding(
+            "255712345678", {"onboarding_step": "logo"}, "image", None, "media_1"
+        )
+    ingest.assert_called_once()
+    mock_db.update_user.assert_called_once_with(
+        "255712345678", {**fields, "onboarding_step": "location"}
+    )
+
+
+def test_oversized_logo_is_rejected_before_decode(monkeypatch):
+    monkeypatch.setattr(Config, "IMAGE_MAX_DECODE_MB", 1)
+    buf = io.BytesIO()
+    Image.new("L", (2000, 2000)).save(buf, "PNG")  # compresses to a few kB
+    with patch.object(Image.Image, "load", side_effect=AssertionError("decoded")):
+        with pytest.raises(image_guard.ImageTooLarge):
+            logo_processor.normalize_logo(buf.getvalue(), (140, 140))
+
+
+@patch("app.onboarding.messenger")
+@patch("app.onboarding.db")
+def test_onboarding_answers_oversized_logo(mock_db, mock_messenger):
+    from app import onboarding
+
+    mock_messenger.download_media.return_value = b"png"
+    with patch.object(logo_processor, "ingest_logo", side_effect=image_guard.ImageTooLarge("big")):
+        onboarding.handle_onboarding("255712345678", {"onboarding_step": "logo"}, "image", None, "media_1")
+    mock_messenger.send_text.assert_called_once_with("255712345678", image_guard.IMAGE_TOO_LARGE_MESSAGE)
+    mock_db.update_user.assert_not_called()
+
+
+@patch("app.logo_processor.db")
+def test_stored_zone_logo_goes_through_guard(mock_db, monkeypatch):
+    monkeypatch.setattr(Config, "IMAGE_MAX_BYTES", 10)
+    mock_db.download_from_storage.return_value = b"x" * 11
+    with pytest.raises(image_guard.ImageTooLarge):
+        logo_processor.load_zone_logo({"logo_zone_key": "logos/z.png"})
@@ -0,0 +1,114 @@
+import io
+import json
+import logging
+import logging.handlers
+import queue
+import pytest
+from unittest.mock import patch
+from app import logs, metrics
+from app.config import Config
+
+
+@pytest.fixture
+def captured(request):
+    """A logger wired like setup() does, writing JSON lines to a buffer."""
+    out = io.StringIO()
+    handler = logs._QueueHandler(queue.Queue())
+    handler.addFilter(logs.ContextFilter())
+    output = logging.StreamHandler(out)
+    output.setFormatter(logs.JsonFormatter())
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+
+    logger = logging.getLogger(f"test.logs.{request.node.name}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+
+    def lines():
+        listener.stop()
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    logger.lines = lines
+    yield logger
+    if listener._thread is not None:
+        listener.stop()
+
+
+def test_json_lines_carry_correlation_id_and_extras(captured):
+    with logs.correlate("abc123"):
+        captured.info("Image pipeline done", extra={"stage_ms": 42})
+    captured.warning("no context")
+
+    first, second = captured.lines()
+    assert first["msg"] == "Image pipeline done"
+    assert (first["level"], first["cid"], first["stage_ms"]) == ("INFO", "abc123", 42)
+    assert first["ts"].endswith("Z")
+    assert "cid" not in second
+
+
+def test_secrets_are_redacted(captured):
+    try:
+        raise ValueError(f"401 for token={Config.WHATSAPP_ACCESS_TOKEN}")
+    except ValueError:
+        captured.exception(
+            f"Supabase key {Config.SUPABASE_SERVICE_KEY}, "
+            "header Authorization: Bearer EAAGm0PX4ZCpsBA, jwt eyJhbGciOiJIUzI1.eyJyb2xlIjoiYW5vbiJ9.sig"
+        )
+
+    [line] = captured.lines()
+    text = json.dumps(line)
+    for secret in (Config.WHATSAPP_ACCESS_TOKEN, Config.SUPABASE_SERVICE_KEY, "EAAGm0PX4ZCpsBA", "eyJhbGci"):
+        assert secret not in text
+    assert "ValueError" in line["exc"] and "[REDACTED]" in line["exc"]
+
+
+def test_info_is_sampled_per_correlation_id(captured, monkeypatch):
+    monkeypatch.setattr(Config, "LOG_SAMPLE_RATE", 0.5)
+    cids = [f"req{n}" for n in range(200)]
+    for cid in cids:
+        with logs.correlate(cid):
+            captured.info("step one")
+            captured.info("step two")
+            captured.error("always kept")
+
+    lines = captured.lines()
+    errors = [line for line in lines if line["level"] == "ERROR"]
+    infos = [line["cid"] for line in lines if line["level"] == "INFO"]
+    assert len(errors) == 200
+    assert 50 < len(set(infos)) < 150
+    # A kept request keeps every line
+    assert all(infos.count(cid) == 2 for cid in set(infos))
+
+
+def test_full_queue_drops_instead_of_blocking(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    metrics.reset()
+    handler = logs._QueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("test.logs.full")
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    for n in range(5):
+        logger.warning(f"line {n}")
+    assert handler.queue.qsize() == 2
+    assert "pichasafi_log_dropped_total 3" in metrics.render_prometheus()
+
+
+def test_setup_replaces_basic_config_once(app):
+    root = logging.getLogger()
+    queue_handlers = [h for h in root.handlers if isinstance(h, logs._QueueHandler)]
+    assert len(queue_handlers) == 1
+    assert not [h for h in root.handlers if type(h) is logging.StreamHandler]
+    logs.setup()
+    assert [h for h in root.handlers if isinstance(h, logs._QueueHandler)] == queue_handlers
+
+
+def test_supabase_connect_does_not_log_key(caplog):
+    with patch("supabase.create_client"), patch("app.database._client", None):
+        from app import database
+
+        with caplog.at_level(logging.INFO, logger="app.database"):
+            database.get_client()
+    assert caplog.messages == [f"Connecting to Supabase: url={Config.SUPABASE_URL}"]
@@ -0,0 +1,87 @@
+import json
+import os
+import pytest
+from app import metrics
+from app.config import Config
+
+
+@pytest.fixture
+def enabled_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    metrics.reset()
+    yield tmp_path
+    metrics.reset()
+
+
+def test_stage_is_noop_when_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", False)
+    assert metrics.stage("download_media") is metrics.stage("send_image")
+    assert metrics.begin_trace() is None
+    assert metrics.end_trace(None) == {}
+
+
+def test_stage_records_histogram_and_trace(enabled_metrics):
+    token = metrics.begin_trace()
+    with metrics.stage("enhance_image"):
+        pass
+    trace = metrics.end_trace(token)
+
+    assert set(trace) == {"enhance_image"}
+    text = metrics.render_prometheus()
+    assert "# TYPE pichasafi_stage_seconds histogram" in text
+    assert 'pichasafi_stage_seconds_count{stage="enhance_image"} 1' in text
+    assert 'pichasafi_stage_seconds_bucket{stage="enhance_image",le="+Inf"} 1' in text
+
+
+def test_stage_counts_errors(enabled_metrics):
+    with pytest.raises(ValueError):
+        with metrics.stage("download_media"):
+            raise ValueError("boom")
+    assert 'pichasafi_stage_errors_total{stage="download_media"} 1' in metrics.render_prometheus()
+
+
+def test_render_merges_other_worker_snapshots(enabled_metrics):
+    metrics.inc("pichasafi_messages_total", type="text")
+    metrics.flush(force=True)
+    assert os.path.exists(enabled_metrics / f"{os.getpid()}.json")
+
+    # Another worker's snapshot (pid 1 is always alive)
+    other = {
+        "counters": [["pichasafi_messages_total", [["type", "text"]], 2.0]],
+        "gauges": [],
+        "histograms": [],
+        "buckets": {},
+    }
+    (enabled_metrics / "1.json").write_text(json.dumps(other))
+
+    assert 'pichasafi_messages_total{type="text"} 3' in metrics.render_prometheus()
+
+
+def test_metrics_endpoint(client, enabled_metrics):
+    metrics.inc("pichasafi_messages_total", type="image")
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert b'pichasafi_messages_total{type="image"} 1' in resp.data
+
+
+def test_metrics_endpoint_disabled(client, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
+
+
+def test_gathered_uploads_are_timed_per_stage(enabled_metrics):
+    import asyncio
+    from app.asgi import _timed
+
+    async def upload():
+        await asyncio.sleep(0)
+        return "url"
+
+    async def pipeline():
+        token = metrics.begin_trace()
+        await asyncio.gather(_timed("upload_original", upload()), _timed("upload_result", upload()))
+        return metrics.end_trace(token)
+
+    assert set(asyncio.run(pipeline())) == {"upload_original", "upload_result"}
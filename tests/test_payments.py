@@ -0,0 +1,214 @@
+import hashlib
+import hmac
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from app import billing, payments
+from app.config import Config
+
+SECRET = "test_payment_secret"
+PHONE = "255712345678"
+
+
+class FakeDB:
+    """The users/transactions calls payments makes, against dicts."""
+
+    def __init__(self):
+        self.users = {PHONE: {"id": "u1", "phone_number": PHONE, "subscription_tier": "free",
+                              "subscription_expires_at": None, "monthly_limit": 3}}
+        self.transactions = {}
+        self.fail_user_updates = 0
+
+    def get_user_by_phone(self, phone):
+        user = self.users.get(phone)
+        return dict(user) if user else None
+
+    def update_user(self, phone, updates):
+        if self.fail_user_updates:
+            self.fail_user_updates -= 1
+            raise ConnectionError("supabase down")
+        self.users[phone].update(updates)
+        return dict(self.users[phone])
+
+    def insert_transaction(self, row):
+        if row["transaction_ref"] in self.transactions:
+            return None
+        self.transactions[row["transaction_ref"]] = {"period_end": None, **row}
+        return dict(self.transactions[row["transaction_ref"]])
+
+    def get_transaction(self, ref):
+        tx = self.transactions.get(ref)
+        return dict(tx) if tx else None
+
+    def update_transaction(self, ref, updates, only_if_null=None):
+        tx = self.transactions[ref]
+        if only_if_null and tx.get(only_if_null) is not None:
+            return None
+        tx.update(updates)
+        return dict(tx)
+
+
+@pytest.fixture
+def fake_db():
+    fake = FakeDB()
+    with patch("app.payments.db", fake), patch("app.payments.messenger") as mock_messenger:
+        fake.messenger = mock_messenger
+        yield fake
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PAYMENT_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(payments.PaymentQueue, "ensure_workers", lambda self: None)
+    q = payments.PaymentQueue(str(tmp_path / "payments.sqlite3"), max_attempts=3)
+    monkeypatch.setattr(payments, "_queue", q)
+    return q
+
+
+def _callback(ref="MP1001", amount=35000, status="success", **extra):
+    body = json.dumps({"transaction_ref": ref, "phone": f"+{PHONE}", "amount": amount,
+                       "currency": "TZS", "status": status, "provider": "mpesa", **extra}).encode()
+    return body, "sha256=" + hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _event(**kwargs):
+    return payments.parse_callback(_callback(**kwargs)[0])
+
+
+def test_callback_is_verified_and_queued(queue, client):
+    body, signature = _callback()
+    resp = client.post("/payments/callback", data=body, headers={"X-Payment-Signature": signature})
+    assert resp.status_code == 202
+    assert resp.get_json() == {"status": "queued"}
+
+    # Provider retry while still queued
+    resp = client.post("/payments/callback", data=body, headers={"X-Payment-Signature": signature})
+    assert (resp.status_code, resp.get_json()) == (200, {"status": "duplicate"})
+    [(ref, event, attempts)] = queue.claim_due()
+    assert (ref, event["phone"], event["amount"], attempts) == ("MP1001", PHONE, 35000.0, 0)
+
+
+def test_callback_rejections(queue, monkeypatch):
+    body, signature = _callback()
+    assert payments.accept(body, "sha256=" + "0" * 64)[0] == 401
+    assert payments.accept(body, None)[0] == 401
+    assert payments.accept(body + b" ", signature)[0] == 401
+
+    bad = b'{"transaction_ref": "MP1", "phone": "255700000000", "amount": "lots"}'
+    bad_sig = hmac.new(SECRET.encode(), bad, hashlib.sha256).hexdigest()
+    assert payments.accept(bad, bad_sig) == (400, {"error": "amount must be a number"})
+
+    monkeypatch.setattr(Config, "PAYMENT_WEBHOOK_SECRET", "")
+    assert payments.accept(body, signature)[0] == 503
+    assert queue.depth() == 0
+
+
+@pytest.mark.parametrize("body, error", [
+    (b'{"transaction_ref": "MP1", "phone": "255700000000", "amount": 1e400}', "amount must be positive"),
+    (b'{"transaction_ref": "MP1", "phone": "255700000000", "amount": NaN}', "amount must be positive"),
+    (b'{"transaction_ref": "MP1", "phone": "255700000000", "amount": "-Infinity"}', "amount must be positive"),
+    (b'{"transaction_ref": "MP1", "phone": "255700000000", "amount": 35000, "plan": ["pro"]}',
+     "plan must be a string"),
+    (b'{"transaction_ref": "MP1", "phone": "255700000000", "amount": 35000, "plan": {"id": 1}}',
+     "plan must be a string"),
+])
+def test_callback_rejects_unusable_amounts_and_plans(queue, body, error):
+    signature = hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+    assert payments.accept(body, signature) == (400, {"error": error})
+    assert queue.depth() == 0
+
+
+def test_payment_upgrades_user_and_notifies(fake_db):
+    assert payments.apply_payment(_event()) == "completed"
+
+    user = fake_db.users[PHONE]
+    assert (user["subscription_tier"], user["monthly_limit"]) == ("pro", 100)
+    expires = datetime.fromisoformat(user["subscription_expires_at"])
+    assert expires - datetime.now(timezone.utc) > timedelta(days=billing.PLAN_PERIOD_DAYS - 1)
+    tx = fake_db.transactions["MP1001"]
+    assert (tx["status"], tx["plan"], tx["user_id"], tx["payment_method"]) == ("completed", "pro", "u1", "mpesa")
+    assert "*Pro*: 100 images a month" in fake_db.messenger.send_text.call_args[0][1]
+
+
+def test_redelivered_payment_applies_once(fake_db):
+    payments.apply_payment(_event())
+    first = fake_db.users[PHONE]["subscription_expires_at"]
+
+    assert payments.apply_payment(_event()) == "duplicate"
+    assert fake_db.users[PHONE]["subscription_expires_at"] == first
+    assert fake_db.messenger.send_text.call_count == 1
+
+
+def test_retry_after_partial_apply_keeps_period(fake_db):
+    fake_db.fail_user_updates = 1
+    with pytest.raises(ConnectionError):
+        payments.apply_payment(_event())
+    period_end = fake_db.transactions["MP1001"]["period_end"]
+
+    assert payments.apply_payment(_event()) == "completed"
+    assert fake_db.users[PHONE]["subscription_expires_at"] == period_end
+
+
+def test_renewal_extends_unexpired_plan(fake_db):
+    current = datetime.now(timezone.utc) + timedelta(days=10)
+    fake_db.users[PHONE].update(subscription_tier="starter", subscription_expires_at=current.isoformat())
+
+    payments.apply_payment(_event(amount=75000))
+
+    user = fake_db.users[PHONE]
+    assert (user["subscription_tier"], user["monthly_limit"]) == ("business", billing.UNLIMITED)
+    assert datetime.fromisoformat(user["subscription_expires_at"]) == current + timedelta(days=30)
+
+
+@pytest.mark.parametrize("kwargs, outcome, status", [
+    ({"status": "failed"}, "failed", "failed"),
+    ({"amount": 20000}, "rejected", "rejected"),  # not a plan price
+    ({"amount": 20000, "plan": "pro"}, "rejected", "rejected"),  # short for the plan named
+    ({"amount": 40000, "plan": "pro"}, "completed", "completed"),
+])
+def test_payment_outcomes(fake_db, kwargs, outcome, status):
+    assert payments.apply_payment(_event(**kwargs)) == outcome
+    assert fake_db.transactions["MP1001"]["status"] == status
+    if outcome != "completed":
+        assert fake_db.users[PHONE]["subscription_tier"] == "free"
+        fake_db.messenger.send_text.assert_called_once()
+
+
+def test_worker_retries_then_marks_dead(queue):
+    queue.enqueue(_event())
+    calls = []
+
+    def flaky(event):
+        calls.append(event["transaction_ref"])
+        raise ConnectionError("supabase down")
+
+    for _ in range(3):
+        with patch("app.payments.time.time", return_value=1e12 + len(calls) * 1000):
+            queue.process_once(flaky)
+    assert calls == ["MP1001"] * 3
+    assert queue.depth() == 0
+    assert [e["transaction_ref"] for e in queue.dead()] == ["MP1001"]
+
+
+def test_worker_settles_queue(queue, fake_db):
+    for n in range(3):
+        queue.enqueue(_event(ref=f"MP{n}"))
+    # Same merchant: one renewal per pass, each extending the last
+    assert [queue.process_once() for _ in range(4)] == [1, 1, 1, 0]
+    assert {tx["status"] for tx in fake_db.transactions.values()} == {"completed"}
+    expires = datetime.fromisoformat(fake_db.users[PHONE]["subscription_expires_at"])
+    assert expires - datetime.now(timezone.utc) > timedelta(days=3 * billing.PLAN_PERIOD_DAYS - 1)
+
+
+def test_one_payment_per_merchant_in_flight(queue):
+    queue.enqueue(_event(ref="A1"))
+    queue.enqueue(_event(ref="A2"))
+    other = _event(ref="B1")
+    other["phone"] = "255700000099"
+    queue.enqueue(other)
+
+    assert [ref for ref, _, _ in queue.claim_due()] == ["A1", "B1"]
+    assert queue.claim_due() == []  # A2 waits for A1
+    queue.complete("A1")
+    assert [ref for ref, _, _ in queue.claim_due()] == ["A2"]
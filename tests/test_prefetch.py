@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from app import messenger, metrics, prefetch
+from app.config import Config
+from tests.test_asgi import COMPLETE_USER, _call, _image_message
+
+
+@pytest.fixture
+def enabled_metrics(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _slow_download(seconds, data=b"photo"):
+    def download(media_id, cancel):
+        time.sleep(seconds)
+        return data
+    return download
+
+
+def _blocking_download(outcomes: list, started: threading.Event = None):
+    """Runs until cancelled, like a large download over a slow link."""
+    def download(media_id, cancel):
+        if started is not None:
+            started.set()
+        if cancel.wait(5):
+            outcomes.append("cancelled")
+            raise prefetch.DownloadCancelled(media_id)
+        outcomes.append("completed")
+        return b"late"
+    return download
+
+
+def test_prefetch_overlaps_routing(enabled_metrics):
+    media = prefetch.start("media_1", _slow_download(0.1))
+    time.sleep(0.15)  # routing
+    started = time.perf_counter()
+    assert media.result() == b"photo"
+    assert time.perf_counter() - started < 0.05
+    text = metrics.render_prometheus()
+    assert 'pichasafi_prefetch_total{outcome="used"} 1' in text
+    assert "pichasafi_prefetch_saved_seconds_count 1" in text
+
+
+def test_cancel_stops_running_download(enabled_metrics):
+    cancelled, started = [], threading.Event()
+    media = prefetch.start("media_2", _blocking_download(cancelled, started))
+    assert started.wait(2)
+    media.cancel()
+    media.cancel()  # idempotent
+    with pytest.raises(prefetch.DownloadCancelled):
+        media._future.result()
+    assert cancelled == ["cancelled"]
+    assert 'pichasafi_prefetch_total{outcome="discarded"} 1' in metrics.render_prometheus()
+
+
+def test_prefetch_off(monkeypatch):
+    monkeypatch.setattr(Config, "PREFETCH_MEDIA", False)
+    assert prefetch.start("media_3", _slow_download(0)) is None
+    assert prefetch.start(None, _slow_download(0)) is None
+
+
+def test_download_media_checks_cancel_between_chunks():
+    cancel = threading.Event()
+    lookup = MagicMock()
+    lookup.json.return_value = {"url": "https://lookaside/media"}
+    body = MagicMock()
+    body.__enter__.return_value = body
+
+    def chunks(size):
+        yield b"a" * size
+        cancel.set()
+        yield b"b" * size
+
+    body.iter_content.side_effect = chunks
+    session = MagicMock()
+    session.get.side_effect = [lookup, body]
+    with patch("app.messenger.get_session", return_value=session):
+        with pytest.raises(prefetch.DownloadCancelled):
+            messenger.download_media("media_4", cancel=cancel)
+    assert session.get.call_args.kwargs["stream"] is True
+
+
+IMAGE_MESSAGE = {
+    "entry": [{"changes": [{"value": {"messages": [{
+        "from": "255712345678",
+        "id": "msg_002",
+        "type": "image",
+        "image": {"id": "media_123"},
+    }]}}]}]
+}
+
+
+@patch("app.webhook.billing")
+@patch("app.webhook.messenger")
+@patch("app.webhook.db")
+def test_webhook_over_limit_cancels_prefetch(mock_db, mock_messenger, mock_billing, client):
+    outcomes = []
+    mock_db.get_user_by_phone.return_value = COMPLETE_USER
+    mock_billing.check_usage.return_value = {"allowed": False}
+    mock_messenger.download_media.side_effect = _blocking_download(outcomes)
+
+    started = time.perf_counter()
+    resp = client.post("/webhook", json=IMAGE_MESSAGE)
+
+    assert resp.status_code == 200
+    mock_billing.get_limit_reached_message.assert_called_once()
+    # Either stopped mid-download or never started; never ran to the end
+    for _ in range(prefetch.Config.PREFETCH_THREADS):
+        prefetch._get_executor().submit(time.sleep, 0).result()
+    assert "completed" not in outcomes
+    assert time.perf_counter() - started < 2
+
+
+@patch("app.asgi.onboarding")
+@patch("app.asgi.amessenger")
+@patch("app.asgi.adb")
+def test_asgi_onboarding_cancels_prefetch(mock_adb, mock_messenger, mock_onboarding):
+    cancelled = []
+
+    async def download(media_id):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(media_id)
+            raise
+
+    async def mark_as_read(message_id):
+        # A real read receipt yields to the loop, so the download gets under way
+        await asyncio.sleep(0.01)
+
+    mock_adb.get_user_by_phone = AsyncMock(return_value={**COMPLETE_USER, "onboarding_step": "logo"})
+    mock_messenger.mark_as_read = mark_as_read
+    mock_messenger.download_media = download
+
+    started = time.perf_counter()
+    status, _ = _call("POST", "/webhook", _image_message())
+
+    assert status == 200
+    assert time.perf_counter() - started < 2
+    mock_onboarding.handle_onboarding.assert_called_once()
+    assert cancelled == ["media_123"]
@@ -0,0 +1,77 @@
+import os
+import time
+import pytest
+from app import profiling
+from app.config import Config
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "PROFILE_INTERVAL_MS", 1)
+    monkeypatch.setattr(Config, "PROFILE_SAMPLE_RATE", 0.0)
+    return tmp_path
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+def test_off_writes_nothing(profile_dir, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_MODE", "off")
+    with profiling.profile_request("webhook"):
+        _busy(0.01)
+    assert os.listdir(profile_dir) == []
+
+
+def test_sampler_keeps_only_slow_requests(profile_dir, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_MODE", "sample")
+    monkeypatch.setattr(Config, "PROFILE_THRESHOLD_MS", 30)
+
+    with profiling.profile_request("fast"):
+        pass
+    with profiling.profile_request("slow"):
+        _busy(0.1)
+
+    files = os.listdir(profile_dir)
+    assert len(files) == 1
+    assert "_slow_" in files[0] and files[0].endswith(".folded")
+
+    summary = profiling.summarize(top=5)
+    assert summary["profiles"] == 1
+    assert any("_busy" in name for name, _, _ in summary["functions"])
+
+
+def test_cprofile_sampled_fraction(profile_dir, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_MODE", "cprofile")
+    monkeypatch.setattr(Config, "PROFILE_THRESHOLD_MS", 0)
+    monkeypatch.setattr(Config, "PROFILE_SAMPLE_RATE", 1.0)
+
+    with profiling.profile_request("webhook"):
+        _busy(0.01)
+
+    files = os.listdir(profile_dir)
+    assert len(files) == 1 and files[0].endswith(".prof")
+    assert "Profiles analysed: 1" in profiling.format_summary(profiling.summarize())
+
+
+def test_rotation_keeps_newest(profile_dir, monkeypatch):
+    monkeypatch.setattr(Config, "PROFILE_MODE", "sample")
+    monkeypatch.setattr(Config, "PROFILE_THRESHOLD_MS", 0)
+    monkeypatch.setattr(Config, "PROFILE_MAX_FILES", 3)
+
+    for i in range(5):
+        with profiling.profile_request(f"req{i}"):
+            pass
+
+    files = sorted(os.listdir(profile_dir))
+    assert len(files) == 3
+    assert "_req4_" in files[-1]
+
+
+def test_profile_summary_command(app, profile_dir):
+    result = app.test_cli_runner().invoke(args=["profile-summary", "--top", "5"])
+    assert result.exit_code == 0
+    assert "Profiles analysed: 0" in result.output
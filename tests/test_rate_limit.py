@@ -0,0 +1,181 @@
+import asyncio
+import sqlite3
+import pytest
+from unittest.mock import MagicMock, patch
+from app import messenger, metrics, rate_limit
+from app.config import Config
+from app.rate_limit import PRIORITY_BULK, PRIORITY_NOTICE, PRIORITY_REPLY, PRIORITY_RESULT, RateLimiter
+
+
+def make_limiter(tmp_path, rate=1.0, burst=10.0, min_rate=0.5, max_attempts=3):
+    return RateLimiter(str(tmp_path / "rate.sqlite3"), "phone-1", rate, burst, min_rate, 2.0, max_attempts)
+
+
+@pytest.fixture(autouse=True)
+def no_drainer():
+    with patch.object(RateLimiter, "_ensure_drainer"):
+        yield
+
+
+def _drain_tokens(limiter, count):
+    for _ in range(count):
+        assert limiter.try_acquire(PRIORITY_RESULT) == 0
+
+
+def test_bucket_allows_burst_then_waits(tmp_path):
+    limiter = make_limiter(tmp_path, burst=5)
+    _drain_tokens(limiter, 5)
+    wait = limiter.try_acquire(PRIORITY_RESULT)
+    assert 0 < wait <= 1.0
+
+
+def test_bucket_is_shared_between_processes(tmp_path):
+    first, second = make_limiter(tmp_path, burst=4), make_limiter(tmp_path, burst=4)
+    _drain_tokens(first, 2)
+    _drain_tokens(second, 2)
+    assert first.try_acquire(PRIORITY_RESULT) > 0
+
+
+def test_results_go_out_when_notices_are_held_back(tmp_path):
+    limiter = make_limiter(tmp_path, burst=10)
+    _drain_tokens(limiter, 6)  # 4 left: below the notice reserve
+    assert limiter.try_acquire(PRIORITY_NOTICE) > 0
+    assert limiter.try_acquire(PRIORITY_REPLY) == 0
+    assert limiter.try_acquire(PRIORITY_RESULT) == 0
+
+
+def test_acquire_times_out(tmp_path):
+    limiter = make_limiter(tmp_path, rate=0.5, burst=1)
+    assert limiter.acquire(PRIORITY_RESULT, timeout=0.1)
+    assert not limiter.acquire(PRIORITY_RESULT, timeout=0.1)
+
+
+def test_acquire_async_keeps_the_loop_free_while_sqlite_is_locked(tmp_path):
+    limiter = make_limiter(tmp_path)
+    other = sqlite3.connect(str(tmp_path / "rate.sqlite3"), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # another worker mid-transaction
+
+    async def scenario():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        tick = asyncio.create_task(ticker())
+        acquire = asyncio.create_task(limiter.acquire_async(PRIORITY_RESULT, timeout=5))
+        await asyncio.sleep(0.2)
+        other.execute("COMMIT")
+        assert await acquire
+        tick.cancel()
+        return ticks
+
+    assert len(asyncio.run(scenario())) >= 5
+
+
+def test_429_halves_rate_and_success_recovers(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path / "metrics"))
+    metrics.reset()
+    limiter = make_limiter(tmp_path, rate=8.0, min_rate=1.0)
+    assert limiter.record(429) == "retry"
+    assert limiter.current_rate() == 4.0
+    limiter.on_throttled()
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.current_rate() == 1.0  # floor
+
+    # Recovery is additive and waits a second between steps
+    assert limiter.record(200) == "ok"
+    assert limiter.current_rate() == 1.0
+    limiter._conn().execute("UPDATE buckets SET rate_changed = rate_changed - 1.5")
+    limiter.record(200)
+    assert limiter.current_rate() == pytest.approx(4.0, abs=0.1)
+    assert "pichasafi_send_rate_limited_total 4" in metrics.render_prometheus()
+    metrics.reset()
+
+
+def test_retry_queue_backs_off_and_drops(tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RETRY_BASE_DELAY", 0)
+    limiter = make_limiter(tmp_path, rate=100, burst=100, max_attempts=2)
+    limiter.enqueue({"n": "notice"}, PRIORITY_NOTICE)
+    limiter.enqueue({"n": "image"}, PRIORITY_RESULT)
+    assert limiter.queue_depth() == 2
+
+    # Claimed rows are leased, best priority first
+    claimed = limiter.claim_due()
+    assert [payload["n"] for _, _, payload, _ in claimed] == ["image", "notice"]
+    assert limiter.claim_due() == []
+    limiter._conn().execute("UPDATE retry_queue SET not_before = 0")
+
+    sent = []
+    outcomes = iter(["ok", "retry", "retry"])
+    assert limiter.drain_once(lambda p: sent.append(p["n"]) or next(outcomes)) == 1
+    assert limiter.queue_depth() == 1
+    assert limiter.drain_once(lambda p: sent.append(p["n"]) or next(outcomes)) == 0
+    assert sent == ["image", "notice", "notice"]
+    assert limiter.queue_depth() == 0  # out of attempts
+
+
+def _response(status, body=None):
+    response = MagicMock(status_code=status)
+    response.json.return_value = body or {}
+    if status >= 400:
+        error = messenger.requests.HTTPError(f"{status} error", response=response)
+        response.raise_for_status.side_effect = error
+    return response
+
+
+def test_bulk_leaves_room_for_notices(tmp_path):
+    limiter = make_limiter(tmp_path, rate=0.001)
+    taken = 0
+    while limiter.try_acquire(PRIORITY_BULK) == 0:
+        taken += 1
+    assert taken == 4  # 10 tokens down to the 6-token reserve
+    assert limiter.try_acquire(PRIORITY_NOTICE) == 0
+    assert rate_limit.wait_for(PRIORITY_BULK) == Config.RATE_LIMIT_MAX_WAIT
+
+
+def test_bulk_sends_are_not_queued(tmp_path):
+    limiter = make_limiter(tmp_path, rate=8.0)
+    with patch("app.rate_limit._limiter", limiter), \
+            patch("app.messenger._post", return_value=_response(429)):
+        result = messenger.send_text("255700000000", "Promo", priority=PRIORITY_BULK)
+
+    assert (result["status"], result["queued"]) == (429, False)  # the broadcaster retries
+    assert limiter.queue_depth() == 0
+
+
+def test_send_queues_throttled_results(tmp_path):
+    limiter = make_limiter(tmp_path, rate=8.0)
+    with patch("app.rate_limit._limiter", limiter), \
+            patch("app.messenger._post", return_value=_response(429)):
+        result = messenger.send_image("255700000000", "https://cdn/x.jpg")
+        notice = messenger.send_text("255700000000", "Processing...", priority=PRIORITY_NOTICE)
+
+    assert result["queued"] is True
+    assert notice["queued"] is False  # late notices are pointless
+    assert limiter.queue_depth() == 1
+    assert limiter.current_rate() == 2.0
+
+
+def test_send_success_returns_graph_response(tmp_path):
+    limiter = make_limiter(tmp_path)
+    with patch("app.rate_limit._limiter", limiter), \
+            patch("app.messenger._post", return_value=_response(200, {"messages": [{"id": "m1"}]})):
+        assert messenger.send_text("255700000000", "hi") == {"messages": [{"id": "m1"}]}
+    assert limiter.queue_depth() == 0
+
+
+def test_start_resumes_a_leftover_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "RATE_LIMIT_ENABLED", True)
+    limiter = make_limiter(tmp_path)
+    with patch("app.rate_limit._limiter", limiter):
+        rate_limit.start()
+        assert not limiter._ensure_drainer.called
+
+        limiter.enqueue({"n": 1}, PRIORITY_RESULT)
+        limiter._ensure_drainer.reset_mock()
+        rate_limit.start()
+    limiter._ensure_drainer.assert_called_once_with()
@@ -0,0 +1,98 @@
+import threading
+import pytest
+from app import metrics, render_queue
+from app.config import Config
+from app.render_queue import FairScheduler
+
+
+def _gated():
+    """A job that holds its worker until the gate opens, and a log of what ran."""
+    gate = threading.Event()
+    ran = []
+
+    def job(label):
+        if label == "hold":
+            assert gate.wait(5)
+        ran.append(label)
+        return label
+
+    return gate, ran, job
+
+
+def test_paid_tier_overtakes_free_backlog():
+    gate, ran, job = _gated()
+    scheduler = FairScheduler(workers=1)
+    futures = [scheduler.submit("free-bulk", "free", job, "hold")]
+    futures += [scheduler.submit("free-bulk", "free", job, f"f{n}") for n in range(1, 6)]
+    futures += [scheduler.submit("paying", "business", job, f"b{n}") for n in range(1, 4)]
+    assert scheduler.depth() == 8
+
+    gate.set()
+    for f in futures:
+        f.result(5)
+    assert ran == ["hold", "b1", "b2", "b3", "f1", "f2", "f3", "f4", "f5"]
+
+
+def test_weights_share_workers_between_busy_merchants():
+    gate, ran, job = _gated()
+    scheduler = FairScheduler(workers=1)
+    blocker = scheduler.submit("other", "free", job, "hold")
+    futures = [scheduler.submit("a", "free", job, "free") for _ in range(6)]
+    futures += [scheduler.submit("b", "starter", job, "starter") for _ in range(6)]
+
+    gate.set()
+    for f in [blocker] + futures:
+        f.result(5)
+    # Starter has twice the weight: two renders per free render while both wait
+    assert ran[1:7].count("starter") == 4
+
+
+def test_per_user_cap_leaves_workers_for_others():
+    gate, ran, job = _gated()
+    scheduler = FairScheduler(workers=3, max_per_user=1)
+    held = [scheduler.submit("bulk", "free", job, "hold") for _ in range(3)]
+    other = scheduler.submit("someone", "free", job, "other")
+
+    assert other.result(5) == "other"
+    assert scheduler.depth() == 2  # bulk's 2nd and 3rd wait for its first
+    gate.set()
+    assert [f.result(5) for f in held] == ["hold"] * 3
+
+
+def test_errors_and_cancellation():
+    gate, ran, job = _gated()
+    scheduler = FairScheduler(workers=1)
+    first = scheduler.submit("a", "free", job, "hold")
+    cancelled = scheduler.submit("a", "free", job, "never")
+    failing = scheduler.submit("b", "free", lambda: 1 / 0)
+    assert cancelled.cancel()
+
+    gate.set()
+    first.result(5)
+    with pytest.raises(ZeroDivisionError):
+        failing.result(5)
+    assert "never" not in ran and scheduler.depth() == 0
+
+
+def test_wait_histogram_per_tier(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    metrics.reset()
+    scheduler = FairScheduler(workers=2)
+    for tier in ("free", "pro", "pro"):
+        scheduler.submit(f"user-{tier}", tier, lambda: None).result(5)
+
+    text = metrics.render_prometheus()
+    assert 'pichasafi_render_queue_wait_seconds_count{tier="free"} 1' in text
+    assert 'pichasafi_render_queue_wait_seconds_count{tier="pro"} 2' in text
+    assert "pichasafi_render_queue_depth 0" in text
+
+
+def test_run_is_inline_without_workers(monkeypatch):
+    monkeypatch.setattr(Config, "RENDER_WORKERS", 0)
+    assert render_queue.run("2557", "free", threading.current_thread) is threading.current_thread()
+
+    monkeypatch.setattr(Config, "RENDER_WORKERS", 2)
+    monkeypatch.setattr(render_queue, "_scheduler", None)
+    worker = render_queue.run("2557", "free", threading.current_thread)
+    assert worker is not threading.current_thread() and worker.name.startswith("render")
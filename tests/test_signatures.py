@@ -0,0 +1,66 @@
+import pytest
+from unittest.mock import patch
+from app import metrics, signatures
+from app.config import Config
+from tests.test_asgi import _call, _text_message
+
+SECRET = "app_secret_for_tests"
+
+
+@pytest.fixture
+def secret(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "WHATSAPP_APP_SECRET", SECRET)
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path))
+    metrics.reset()
+
+
+def test_valid_accepts_prefixed_and_bare_hex():
+    body = b'{"entry": []}'
+    signature = signatures.sign(SECRET, body)
+    assert signature.startswith("sha256=") and len(signature) == 71
+    assert signatures.valid(SECRET, body, signature)
+    assert signatures.valid(SECRET, body, signature[7:].upper())
+    assert not signatures.valid(SECRET, body + b" ", signature)
+    assert not signatures.valid("other", body, signature)
+    assert not signatures.valid("", body, signature)
+    assert not signatures.valid(SECRET, body, "sha256=zz")
+
+
+@patch("app.webhook.messenger")
+@patch("app.webhook.db")
+def test_flask_rejects_before_any_work(mock_db, mock_messenger, client, secret):
+    body = _text_message("help")
+    for headers in ({}, {"X-Hub-Signature-256": "sha256=abc"},
+                    {"X-Hub-Signature-256": signatures.sign("wrong", body)}):
+        resp = client.post("/webhook", data=body, headers=headers, content_type="application/json")
+        assert resp.status_code == 401
+    assert not mock_db.method_calls and not mock_messenger.method_calls
+
+    text = metrics.render_prometheus()
+    for reason in ("missing", "malformed", "mismatch"):
+        assert f'pichasafi_webhook_rejected_total{{reason="{reason}"}} 1' in text
+
+
+@patch("app.webhook.messenger")
+@patch("app.webhook.db")
+def test_flask_accepts_signed_body(mock_db, mock_messenger, client, secret):
+    mock_db.get_user_by_phone.return_value = {"phone_number": "255712345678", "onboarding_step": "complete"}
+    body = _text_message("help")
+    resp = client.post("/webhook", data=body, content_type="application/json",
+                       headers={"X-Hub-Signature-256": signatures.sign(SECRET, body)})
+    assert resp.status_code == 200
+    mock_messenger.mark_as_read.assert_called_once_with("msg_001")
+
+
+def test_unset_secret_leaves_webhook_open(client, monkeypatch):
+    monkeypatch.setattr(Config, "WHATSAPP_APP_SECRET", "")
+    assert signatures.check_webhook(b"{}", None)
+    assert client.post("/webhook", json={}).status_code == 200
+
+
+def test_asgi_rejects_unsigned_post(secret):
+    with patch("app.asgi.handle_message") as handle:
+        status, body = _call("POST", "/webhook", _text_message("help"))
+    assert (status, body) == (401, b'{"error":"invalid signature"}')
+    handle.assert_not_called()
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds a worker may spend importing the app and running create_app().
+# Generous enough for a slow CI box; supabase alone blows well past it.
+BOOT_BUDGET_S = float(os.environ.get("BOOT_BUDGET_S", "1.5"))
+
+BOOT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "elapsed": elapsed,
+    "loaded": sorted(m for m in ("supabase", "PIL", "rembg") if m in sys.modules),
+}))
+"""
+
+
+def _boot():
+    proc = subprocess.run(
+        [sys.executable, "-c", BOOT_SCRIPT],
+        cwd=ROOT, env=dict(os.environ), capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_worker_boot_skips_heavy_imports():
+    assert _boot()["loaded"] == []
+
+
+def test_worker_boot_within_budget():
+    # Best of three so a noisy neighbour doesn't fail the build
+    elapsed = min(_boot()["elapsed"] for _ in range(3))
+    assert elapsed < BOOT_BUDGET_S, f"worker boot took {elapsed:.2f}s (budget {BOOT_BUDGET_S}s)"
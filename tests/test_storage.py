@@ -0,0 +1,172 @@
+import fcntl
+import json
+import os
+import subprocess
+import threading
+import pytest
+from app import storage
+from app.storage import LocalBackend, TieredStorage
+
+
+class RecordingBackend(LocalBackend):
+    """LocalBackend that counts calls and can be held or made to fail."""
+
+    def __init__(self, root):
+        super().__init__(root, "https://cdn.test")
+        self.gets = 0
+        self.puts = []
+        self.fail = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def put(self, path, data, content_type):
+        self.release.wait(5)
+        if self.fail:
+            self.fail -= 1
+            raise OSError("upload failed")
+        self.puts.append(path)
+        super().put(path, data, content_type)
+
+    def get(self, path):
+        self.gets += 1
+        return super().get(path)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return RecordingBackend(str(tmp_path / "bucket"))
+
+
+def make_storage(tmp_path, backend, max_bytes=1000):
+    return TieredStorage(backend, str(tmp_path / "cache"), max_bytes, writer_threads=1)
+
+
+def test_put_writes_back_and_returns_public_url(tmp_path, backend):
+    store = make_storage(tmp_path, backend)
+    url = store.put("generated/255700/a.jpg", b"result", wait=True)
+    assert url == "https://cdn.test/generated/255700/a.jpg"
+    assert backend.puts == ["generated/255700/a.jpg"]
+    assert store.pending_count() == 0
+    assert os.listdir(os.path.join(store.cache_dir, "pending")) == []
+
+
+def test_reads_are_served_from_disk_tier(tmp_path, backend):
+    store = make_storage(tmp_path, backend)
+    store.put("logos/a.png", b"logo", wait=True)
+    assert store.get("logos/a.png") == b"logo"
+    assert backend.gets == 0
+
+    # A fresh process sees the same disk tier
+    assert make_storage(tmp_path, backend).get("logos/a.png") == b"logo"
+    assert backend.gets == 0
+
+
+def test_miss_fetches_from_backend_once(tmp_path, backend):
+    backend.put("originals/x.jpg", b"original", "image/jpeg")
+    store = make_storage(tmp_path, backend)
+    assert store.get("originals/x.jpg") == b"original"
+    assert store.get("originals/x.jpg") == b"original"
+    assert backend.gets == 1
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path, backend):
+    store = make_storage(tmp_path, backend, max_bytes=250)
+    for name in "abc":
+        store.put(f"o/{name}", b"x" * 100, wait=True)
+    # a was evicted when c pushed the tier over 250 bytes
+    assert store.cached_bytes() == 200
+    store.get("o/b")  # touch b
+    store.put("o/d", b"x" * 100, wait=True)
+    store.get("o/b")
+    assert backend.gets == 0
+    store.get("o/c")
+    assert backend.gets == 1
+
+
+def test_dirty_objects_are_not_evicted(tmp_path, backend):
+    store = make_storage(tmp_path, backend, max_bytes=100)
+    backend.release.clear()
+    store.put("o/a", b"x" * 100)
+    store.put("o/b", b"x" * 100)
+    assert store.cached_bytes() == 200  # both still waiting for write-back
+    backend.release.set()
+    store.flush(timeout=5)
+    assert store.cached_bytes() <= 100
+    assert sorted(backend.puts) == ["o/a", "o/b"]
+
+
+def test_write_back_retries_then_succeeds(tmp_path, backend, monkeypatch):
+    monkeypatch.setattr(storage.time, "sleep", lambda s: None)
+    backend.fail = 2
+    store = make_storage(tmp_path, backend)
+    store.put("o/a", b"data", wait=True)
+    assert backend.puts == ["o/a"]
+
+
+def test_interrupted_upload_is_requeued_on_start(tmp_path, backend, monkeypatch):
+    monkeypatch.setattr(storage.time, "sleep", lambda s: None)
+    backend.fail = storage.WRITE_BACK_ATTEMPTS
+    store = make_storage(tmp_path, backend)
+    with pytest.raises(OSError):
+        store.put("o/a", b"data", wait=True)
+    assert backend.puts == []
+
+    restarted = make_storage(tmp_path, backend)
+    restarted.flush(timeout=5)
+    assert backend.puts == ["o/a"]
+    assert os.listdir(os.path.join(restarted.cache_dir, "pending")) == []
+
+
+def test_paths_cannot_escape_cache(tmp_path, backend):
+    store = make_storage(tmp_path, backend)
+    with pytest.raises(ValueError):
+        store.put("../../etc/passwd", b"x")
+
+
+def _sibling_marker(store, path, pid):
+    store.put(path, b"data")
+    store.flush(timeout=5)
+    local = os.path.join(store.cache_dir, "objects", path)
+    with open(local, "wb") as f:
+        f.write(b"data")
+    marker = store._pending_marker(path)
+    with open(marker, "w") as f:
+        json.dump({"path": path, "content_type": "image/jpeg", "pid": pid}, f)
+    return marker
+
+
+def test_live_siblings_uploads_are_left_to_them(tmp_path, backend):
+    sibling = subprocess.Popen(["sleep", "30"])
+    try:
+        store = make_storage(tmp_path, backend, max_bytes=4)
+        marker = _sibling_marker(store, "o/theirs", sibling.pid)
+        backend.puts.clear()
+
+        booted = make_storage(tmp_path, backend, max_bytes=4)
+        booted.put("o/mine", b"data", wait=True)
+        assert backend.puts == ["o/mine"]
+        # Over max_bytes, but the sibling still has to upload it
+        assert os.path.exists(os.path.join(booted.cache_dir, "objects", "o/theirs"))
+        assert os.path.exists(marker)
+    finally:
+        sibling.kill()
+        sibling.wait()
+
+    # Once the owner is dead its upload is taken over, stamped with the new owner
+    backend.release.clear()
+    restarted = make_storage(tmp_path, backend)
+    with open(marker) as f:
+        assert json.load(f)["pid"] == os.getpid()
+    backend.release.set()
+    restarted.flush(timeout=5)
+    assert backend.puts.count("o/theirs") == 1
+    assert not os.path.exists(marker)
+
+
+def test_marker_claim_is_exclusive(tmp_path, backend):
+    store = make_storage(tmp_path, backend)
+    marker = _sibling_marker(store, "o/a", 0)
+    with open(marker) as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        assert storage._claim_marker(marker) is None
+    assert storage._claim_marker(marker)["pid"] == os.getpid()
@@ -0,0 +1,146 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from app import billing, metrics, subscriptions
+from app.config import Config
+
+NOW = datetime.now(timezone.utc)
+
+
+class FakeUsers:
+    """The users table as the two sweep queries see it."""
+
+    def __init__(self, rows):
+        self.rows = {row["id"]: row for row in rows}
+        self.updates = []
+        self.frozen = False
+
+    def _expired(self, row, now):
+        return (
+            row["subscription_tier"] != "free"
+            and row["subscription_expires_at"] is not None
+            and row["subscription_expires_at"] <= now
+        )
+
+    def list_expired(self, now, limit):
+        rows = sorted(
+            (r for r in self.rows.values() if self._expired(r, now)),
+            key=lambda r: r["subscription_expires_at"],
+        )
+        return [dict(r) for r in rows[:limit]]
+
+    def downgrade(self, ids, now, monthly_limit):
+        self.updates.append(list(ids))
+        if self.frozen:
+            return []
+        changed = []
+        for user_id in ids:
+            row = self.rows[user_id]
+            if self._expired(row, now):
+                row.update(subscription_tier="free", monthly_limit=monthly_limit)
+                changed.append(dict(row))
+        return changed
+
+
+def _user(n, tier="pro", expires_in_days=-1):
+    expires = (NOW + timedelta(days=expires_in_days)).isoformat() if expires_in_days is not None else None
+    return {"id": f"u{n}", "phone_number": f"2557{n:08d}", "subscription_tier": tier,
+            "subscription_expires_at": expires, "monthly_limit": 100, "images_created_this_month": 5}
+
+
+@pytest.fixture
+def users():
+    table = FakeUsers(
+        [_user(n) for n in range(7)]
+        + [_user(10, expires_in_days=3), _user(11, tier="free"), _user(12, expires_in_days=None)]
+    )
+    with patch("app.subscriptions.db") as mock_db:
+        mock_db.list_expired_subscriptions.side_effect = table.list_expired
+        mock_db.downgrade_subscriptions.side_effect = table.downgrade
+        yield table
+
+
+def test_sweep_downgrades_expired_in_batches(users, monkeypatch):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", "/tmp/pichasafi-test-metrics-subs")
+    metrics.reset()
+
+    result = subscriptions.sweep(now=NOW, batch_size=3)
+
+    assert (result["downgraded"], result["batches"]) == (7, 3)
+    assert [len(ids) for ids in users.updates] == [3, 3, 1]
+    for n in range(7):
+        row = users.rows[f"u{n}"]
+        assert (row["subscription_tier"], row["monthly_limit"]) == ("free", Config.FREE_IMAGE_LIMIT)
+    # Not yet expired, already free, or no expiry: untouched
+    assert users.rows["u10"]["subscription_tier"] == "pro"
+    assert users.rows["u12"]["monthly_limit"] == 100
+    assert "pichasafi_subscriptions_downgraded_total 7" in metrics.render_prometheus()
+
+
+def test_sweep_with_nothing_expired_is_one_query(users):
+    result = subscriptions.sweep(now=NOW - timedelta(days=30))
+    assert result["downgraded"] == 0
+    assert users.updates == []
+
+
+def test_sweep_stops_when_rows_cannot_be_updated(users):
+    users.frozen = True
+    result = subscriptions.sweep(now=NOW, batch_size=3)
+    assert (result["downgraded"], len(users.updates)) == (0, 1)
+
+
+def test_renewal_between_list_and_update_is_kept(users):
+    real_list = users.list_expired
+
+    def list_then_renew(now, limit):
+        rows = real_list(now, limit)
+        users.rows["u0"]["subscription_expires_at"] = (NOW + timedelta(days=30)).isoformat()
+        return rows
+
+    with patch("app.subscriptions.db.list_expired_subscriptions", side_effect=list_then_renew):
+        subscriptions.sweep(now=NOW, batch_size=50)
+    assert users.rows["u0"]["subscription_tier"] == "pro"
+    assert users.rows["u1"]["subscription_tier"] == "free"
+
+
+def test_run_due_sweeps_once_per_interval(users, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SUBSCRIPTION_SWEEP_LOCK", str(tmp_path / "sweep.lock"))
+    monkeypatch.setattr(Config, "SUBSCRIPTION_SWEEP_INTERVAL", 300)
+
+    with patch.object(subscriptions, "sweep", return_value={"downgraded": 0}) as sweep:
+        assert subscriptions.run_due() == {"downgraded": 0}
+        assert subscriptions.run_due() is None  # another worker swept just now
+        assert subscriptions.run_due(force=True) == {"downgraded": 0}
+    assert sweep.call_count == 2
+
+
+def test_run_due_skips_while_another_process_holds_the_lock(tmp_path, monkeypatch):
+    import fcntl
+
+    lock = tmp_path / "sweep.lock"
+    monkeypatch.setattr(Config, "SUBSCRIPTION_SWEEP_LOCK", str(lock))
+    with open(lock, "a+") as held, patch.object(subscriptions, "sweep") as sweep:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        assert subscriptions.run_due(force=True) is None
+    sweep.assert_not_called()
+
+
+def test_start_is_off_with_zero_interval(monkeypatch):
+    monkeypatch.setattr(Config, "SUBSCRIPTION_SWEEP_INTERVAL", 0)
+    assert subscriptions.start() is None
+
+
+@patch("app.billing.db")
+def test_check_usage_uses_row_in_hand(mock_db):
+    user = _user(1)
+    user["subscription_tier"], user["monthly_limit"] = "free", 3
+    assert billing.check_usage("255700000001", user)["limit"] == 3
+    mock_db.get_user_by_phone.assert_not_called()
+
+
+def test_sweep_cli(app, users, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SUBSCRIPTION_SWEEP_LOCK", str(tmp_path / "sweep.lock"))
+    result = app.test_cli_runner().invoke(args=["sweep-subscriptions"])
+    assert result.exit_code == 0
+    assert "Downgraded 7 subscriptions" in result.output
@@ -0,0 +1,179 @@
+import io
+import json
+import os
+import shutil
+import time
+import pytest
+from PIL import Image
+from app import assets, image_processor, logo_processor, metrics, template_registry
+from app.config import Config
+from app.image_processor import draw_overlays
+
+
+@pytest.fixture
+def templates_dir(tmp_path, monkeypatch):
+    """A private copy of templates/ with the registry state reset around the test."""
+    directory = tmp_path / "templates"
+    shutil.copytree(Config.TEMPLATES_DIR, directory)
+    monkeypatch.setattr(Config, "TEMPLATES_DIR", str(directory))
+    monkeypatch.setattr(template_registry, "_snapshot", None)
+    monkeypatch.setattr(template_registry, "_fingerprint", None)
+    monkeypatch.setattr(template_registry, "_listeners", list(template_registry._listeners))
+    monkeypatch.setattr(Config, "PRELOAD_GRADIENTS", [])
+    assets._layers.clear()
+    assets._pinned_layers.clear()
+    yield directory
+    template_registry.stop()
+    assets._layers.clear()
+    assets._pinned_layers.clear()
+
+
+def _edit(directory, change):
+    path = directory / "template_config.json"
+    config = json.loads(path.read_text())
+    change(config)
+    path.write_text(json.dumps(config))
+    # Make sure the mtime moves even on coarse-grained filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def _move_price(config, y=880):
+    config["product_showcase"]["price_zone"]["y"] = y
+
+
+def test_compiles_layouts_with_fonts(templates_dir):
+    template = template_registry.get("product_showcase")
+    assert template.canvas_size == (1080, 1080)
+    assert template.zone("logo") == {"x": 900, "y": 40, "w": 140, "h": 140}
+    assert template.font("price") is assets.get_font("bold", 48)
+    assert template.version == template_registry.version()
+    # Same files, same version
+    assert template_registry.compile_templates().version == template.version
+
+
+def test_edit_is_swapped_in_and_unchanged_touch_is_not(templates_dir):
+    first = template_registry.current()
+    swaps = []
+    template_registry.on_reload(swaps.append)
+
+    os.utime(templates_dir / "template_config.json")
+    assert template_registry.reload() is False
+
+    _edit(templates_dir, _move_price)
+    assert template_registry.reload() is True
+    assert template_registry.get("product_showcase").zone("price")["y"] == 880
+    assert [s.version for s in swaps] == [template_registry.version()] != [first.version]
+    # A render holding the old snapshot still sees the old layout
+    assert first.get("product_showcase").zone("price")["y"] == 900
+
+
+def test_broken_edit_keeps_running_version(templates_dir, monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path / "metrics"))
+    metrics.reset()
+    version = template_registry.version()
+
+    (templates_dir / "template_config.json").write_text("{not json")
+    assert template_registry.reload() is False
+    (templates_dir / "template_config.json").write_text(
+        json.dumps({"product_showcase": {"canvas_size": [1080]}})
+    )
+    assert template_registry.reload() is False
+    assert template_registry.version() == version
+    assert 'pichasafi_template_reloads_total{result="error"} 2' in metrics.render_prometheus()
+
+
+@pytest.mark.parametrize("spec, error", [
+    ({"canvas_size": [1080]}, "canvas_size"),
+    ({"canvas_size": [10, 10], "price_zone": {"x": 1}}, "price_zone needs x and y"),
+    ({"canvas_size": [10, 10], "price_zone": {"x": 1, "y": 1, "anchor": "top"}}, "anchor"),
+    ({"canvas_size": [10, 10], "fonts": {"price": {"size": 0}}}, "fonts.price"),
+    ({"canvas_size": [10, 10], "fonts": {"price": {"size": 12, "weight": "black"}}}, "weight"),
+])
+def test_invalid_specs_are_rejected(templates_dir, spec, error):
+    (templates_dir / "template_config.json").write_text(json.dumps({"poster": spec}))
+    with pytest.raises(template_registry.TemplateError, match=error):
+        template_registry.compile_templates()
+
+
+def test_templates_merge_across_files(templates_dir):
+    (templates_dir / "price_list.json").write_text(json.dumps({"price_list": {"canvas_size": [1080, 1350]}}))
+    assert template_registry.get("price_list").canvas_size == (1080, 1350)
+    assert "product_showcase" in assets.load_template_config()
+
+    (templates_dir / "dupe.json").write_text(json.dumps({"price_list": {"canvas_size": [1, 1]}}))
+    with pytest.raises(template_registry.TemplateError, match="defined twice"):
+        template_registry.compile_templates()
+
+
+def test_swap_drops_layers_built_for_old_version(templates_dir, monkeypatch):
+    monkeypatch.setattr(Config, "PRELOAD_GRADIENTS", ["#112233"])
+    monkeypatch.setattr(image_processor, "OUTPUT_SIZE", (8, 8))
+    old = template_registry.version()
+    assets.preload_gradients()
+    assets.get_gradient_layer((4, 4), "#111111", "#000000")
+
+    _edit(templates_dir, _move_price)
+    template_registry.reload()
+
+    new = template_registry.version()
+    assert {key[-1] for key in assets._layers} == {new}
+    assert {key[-1] for key in assets._pinned_layers} == {new} != {old}
+
+
+def test_render_uses_one_snapshot(templates_dir):
+    snapshot = template_registry.current()
+    _edit(templates_dir, lambda c: _move_price(c, y=100))
+    template_registry.reload()
+
+    def price_rows(**kwargs):
+        img = draw_overlays(Image.new("RGB", (1080, 1080)), {"price": 5000}, **kwargs)
+        return img.getchannel("R").crop((500, 0, 580, 1080)).getbbox()[1::2]
+
+    assert price_rows(snapshot=snapshot)[0] > 800  # old layout: price at y=900
+    assert price_rows()[1] < 200  # live layout: price at y=100
+
+
+def test_render_uses_the_requested_template(templates_dir):
+    _edit(templates_dir, lambda c: c["sale_promo"]["price_zone"].update(y=100))
+    template_registry.reload()
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 300), (10, 10, 10)).save(buf, format="PNG")
+
+    def render(template):
+        options = {"template": template, "price": 5000}
+        return Image.open(io.BytesIO(image_processor.process_product_photo(buf.getvalue(), "#000000", options)))
+
+    def pill_rows(img):
+        white = img.convert("L").point(lambda v: 255 if v > 230 else 0)
+        return white.crop((300, 0, 780, 1080)).getbbox()[1::2]
+
+    # The price pill is drawn where each layout puts it
+    assert pill_rows(render("sale_promo"))[1] < 200
+    assert pill_rows(render("product_showcase"))[0] > 800
+
+
+def test_stale_zone_logo_is_refitted(templates_dir):
+    _edit(templates_dir, lambda c: c["product_showcase"]["logo_zone"].update(w=100, h=50))
+    template_registry.reload()
+    canvas = Image.new("RGB", (1080, 1080))
+    logo_processor.composite_logo(canvas, Image.new("RGBA", (140, 140), (255, 0, 0, 255)))
+    assert canvas.getbbox() == (925, 40, 975, 90)
+
+
+def test_watcher_reloads_in_background(templates_dir, monkeypatch):
+    monkeypatch.setattr(Config, "TEMPLATE_RELOAD_INTERVAL", 0.02)
+    version = template_registry.version()
+    assert template_registry.start() is not None
+
+    _edit(templates_dir, _move_price)
+    deadline = time.time() + 5
+    while template_registry.version() == version and time.time() < deadline:
+        time.sleep(0.02)
+    assert template_registry.version() != version
+
+
+def test_watcher_off_with_zero_interval(monkeypatch):
+    monkeypatch.setattr(Config, "TEMPLATE_RELOAD_INTERVAL", 0)
+    assert template_registry.start() is None
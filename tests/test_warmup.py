@@ -0,0 +1,89 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import time
+from app import warmup
+from app.config import Config
+
+
+@pytest.fixture(autouse=True)
+def reset_warmup():
+    warmup._state.update(state="pending", steps={}, error=None, started_at=None, finished_at=None, failures=0, retry_at=None)
+    warmup._probe_cache.update(checked_at=0.0, results=None)
+    yield
+    warmup._state.update(state="pending", steps={}, error=None, started_at=None, finished_at=None, failures=0, retry_at=None)
+    warmup._probe_cache.update(checked_at=0.0, results=None)
+
+
+def test_ready_is_503_before_warmup(client):
+    resp = client.get("/ready")
+    assert resp.status_code == 503
+    assert resp.get_json()["state"] == "pending"
+
+
+def test_health_stays_live_before_warmup(client):
+    assert client.get("/health").status_code == 200
+
+
+@patch("app.database.get_client")
+@patch("app.database.get_service_client")
+def test_warmup_then_ready(mock_service, mock_client, client):
+    with patch.dict(warmup.STEPS, http_pools=lambda: None):
+        result = warmup.run()
+
+    assert result["state"] == "ready"
+    assert set(result["steps_ms"]) == set(warmup.STEPS)
+
+    resp = client.get("/ready")
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["dependencies"]["supabase"]["ok"] is True
+
+
+def test_failed_step_reports_failure():
+    with patch.dict(warmup.STEPS, {"templates": MagicMock(side_effect=OSError("missing"))}):
+        result = warmup.run(steps=("templates",))
+    assert result["state"] == "failed"
+    assert "templates" in result["error"]
+    assert not warmup.is_ready()
+
+
+def test_failed_warmup_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(Config, "WARMUP_RETRY_DELAY", 10.0)
+    flaky = MagicMock(side_effect=[OSError("down"), OSError("down"), None])
+    with patch.dict(warmup.STEPS, {"templates": flaky}):
+        warmup.run(steps=("templates",))
+        first_retry = warmup._state["retry_at"] - time.monotonic()
+        assert 9 < first_retry <= 10
+
+        # Backoff not elapsed: /ready doesn't re-run
+        body, ready = warmup.readiness()
+        assert (body["state"], ready) == ("failed", False)
+        assert flaky.call_count == 1
+
+        warmup._state["retry_at"] = 0
+        with patch.object(warmup, "start", side_effect=lambda steps: warmup.run(steps)) as start:
+            warmup.readiness()
+            start.assert_called_once_with(("templates",))
+        assert warmup._state["failures"] == 2
+        assert 19 < warmup._state["retry_at"] - time.monotonic() <= 20
+
+        warmup._state["retry_at"] = 0
+        with patch.object(warmup, "start", side_effect=lambda steps: warmup.run(steps)), \
+                patch.object(warmup, "probe_dependencies", return_value={}):
+            body, ready = warmup.readiness()
+    assert ready is True
+    assert body["failures"] == 0
+
+
+@patch("app.database.get_client")
+def test_probe_results_are_cached(mock_client):
+    warmup.probe_dependencies()
+    warmup.probe_dependencies()
+    assert mock_client.call_count == 1
+
+    mock_client.return_value.table.side_effect = RuntimeError("down")
+    warmup.probe_dependencies(force=True)
+    warmup.mark_ready()
+    body, ready = warmup.readiness()
+    assert ready is False
+    assert body["dependencies"]["supabase"]["ok"] is False